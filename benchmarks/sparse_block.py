@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of the per-read cost of CbModbusSparseDataBlock with 10k configured registers.
+
+Measures validate + getValues of a 125 register (maximum FC3/FC4) window served from memory,
+and the merge of a fetched window into the block, against the nested-loop merge it replaced.
+
+Usage: python benchmarks/sparse_block.py [registers] [iterations]
+"""
+
+import logging
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbusproxy_cpe_cb'))
+
+import store
+from cache import RegisterCache
+from constants import READ_MODE_PREFETCH, TYPE_HOLDING_REGISTER
+
+WINDOW = 125
+
+
+class _BenchContext(object):
+    """The slave context attributes used by a data block, with no ClearBlade connection"""
+    def __init__(self):
+        self.log = logging.getLogger('sparse_block')
+        self.read_mode = READ_MODE_PREFETCH
+        self.cache = RegisterCache()
+        self.shared_table = None
+        self.read_ahead = 0
+        self.ip_proxy = '10.0.0.1'
+        self.slave_id = 1
+
+
+def _legacy_merge(block, values, timestamps):
+    """The nested-loop merge previously used by CbModbusSparseDataBlock.fetch"""
+    for key in values:
+        for addr in block.values:
+            if key == addr:
+                block.values[addr] = values[key]
+                block.timestamps[addr] = timestamps[key]
+
+
+def main(registers=10000, iterations=200):
+    random.seed(1)
+    # registers configured in runs of one window, scattered over the address space with gaps between them
+    bases = sorted(random.sample(range(0, 65536 // (2 * WINDOW)), max(1, registers // WINDOW)))
+    config = dict((base * 2 * WINDOW + i, 0) for base in bases for i in range(0, WINDOW))
+    block = store.CbModbusSparseDataBlock(_BenchContext(), TYPE_HOLDING_REGISTER, config)
+    windows = [(random.choice(bases) * 2 * WINDOW, WINDOW) for n in range(0, 100)]
+    fetched = [(dict((addr, 1) for addr in range(address, address + count)),
+                dict((addr, '2019-01-21T07:00:00Z') for addr in range(address, address + count)))
+               for address, count in windows]
+
+    def read():
+        for address, count in windows:
+            assert block.validate(address, count)
+            block.getValues(address, count)
+
+    def merge():
+        for values, timestamps in fetched:
+            store.read_collection_data = lambda context, register_type, address, count: (values, timestamps)
+            block.fetch(min(values), WINDOW)
+
+    def legacy():
+        for values, timestamps in fetched:
+            _legacy_merge(block, values, timestamps)
+
+    print("CbModbusSparseDataBlock with {} registers, {} register windows".format(len(config), WINDOW))
+    for label, func, runs in [("validate + getValues", read, iterations),
+                              ("fetch merge", merge, iterations),
+                              ("legacy nested-loop merge", legacy, 1)]:
+        seconds = timeit.timeit(func, number=runs)
+        print("{:<26} {:>10.1f} us per read".format(label, seconds / (runs * 100) * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -1,4 +1,16 @@
 import constants
 import context
 import store
+import cache
+import refresh
+import writer
+import journal
+import client
+import fetch
+import server
+import supervisor
+import shared
+import template
+import startup
+import snapshot
 import modbus_server_adapter
@@ -0,0 +1,154 @@
+"""
+A time-to-live register cache that sits in front of the ClearBlade data collection queries.
+
+Register values and timestamps stay in the data blocks of the slave context; the cache only records when each
+register was last refreshed from ClearBlade so that reads within the TTL are served without a network round-trip.
+"""
+
+import numbers
+import threading
+import time
+from collections import OrderedDict
+
+from constants import REGISTER_TYPES, DEFAULT_CACHE_SIZE
+
+
+def parse_ttl(ttl):
+    """
+    Normalizes a TTL specification into a per-register-type dictionary
+
+    Accepts a number of seconds applied to all register types, a dictionary ``{register_type: seconds}``
+    or a string such as ``30`` or ``hr=5,ir=60,di=10,co=10``.
+
+    :param ttl: the TTL specification (or None to disable caching)
+    :returns: TTL seconds per register type
+    :rtype: dict
+    """
+    result = dict((reg_type, 0) for reg_type in REGISTER_TYPES)
+    if ttl is None or ttl == '':
+        return result
+    if isinstance(ttl, dict):
+        items = ttl.items()
+    elif isinstance(ttl, numbers.Number):
+        items = [(reg_type, ttl) for reg_type in REGISTER_TYPES]
+    else:
+        items = []
+        for token in str(ttl).split(','):
+            token = token.strip()
+            if '=' in token:
+                reg_type, seconds = token.split('=', 1)
+                items.append((reg_type.strip(), seconds))
+            elif token != '':
+                items.extend([(reg_type, token) for reg_type in REGISTER_TYPES])
+    for reg_type, seconds in items:
+        if reg_type not in REGISTER_TYPES:
+            raise ValueError("Cache TTL register type must be one of: {}".format(REGISTER_TYPES))
+        result[reg_type] = max(0, float(seconds))
+    return result
+
+
+class RegisterCache(object):
+    """
+    A bounded TTL cache of register freshness for a single slave context.
+    Entries are keyed by (register_type, address) and evicted least-recently-used once ``max_size`` is reached.
+    """
+    def __init__(self, ttl=None, max_size=DEFAULT_CACHE_SIZE):
+        """
+        Initializes the cache
+
+        :param ttl: seconds a register stays fresh, either a single value or per register type (see ``parse_ttl``)
+        :param int max_size: the maximum number of registers tracked before least-recently-used eviction
+        """
+        self.ttl = parse_ttl(ttl)
+        self.max_size = int(max_size)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._expiry = OrderedDict()
+        self._lock = threading.Lock()
+
+    def enabled(self, register_type):
+        """
+        Indicates if caching applies to the register type
+
+        :param str register_type: the type of register ('co', 'di', 'hr', 'ir')
+        :rtype: bool
+        """
+        return self.ttl.get(register_type, 0) > 0 and self.max_size > 0
+
+    def lookup(self, register_type, addresses):
+        """
+        Checks if all the registers are fresh, counting a hit or a miss for the request
+
+        :param str register_type: the type of register ('co', 'di', 'hr', 'ir')
+        :param iterable addresses: the register addresses being read
+        :returns: True if every register was refreshed within its TTL
+        :rtype: bool
+        """
+        if not self.enabled(register_type):
+            return False
+        now = time.time()
+        with self._lock:
+            fresh = True
+            for addr in addresses:
+                key = (register_type, addr)
+                expiry = self._expiry.pop(key, None)
+                if expiry is None or expiry <= now:
+                    fresh = False
+                    break
+                self._expiry[key] = expiry
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return fresh
+
+    def update(self, register_type, addresses):
+        """
+        Marks registers as freshly read from ClearBlade
+
+        :param str register_type: the type of register ('co', 'di', 'hr', 'ir')
+        :param iterable addresses: the register addresses refreshed
+        """
+        if not self.enabled(register_type):
+            return
+        expiry = time.time() + self.ttl[register_type]
+        with self._lock:
+            for addr in addresses:
+                key = (register_type, addr)
+                self._expiry.pop(key, None)
+                self._expiry[key] = expiry
+            while len(self._expiry) > self.max_size:
+                self._expiry.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, register_type=None, addresses=None):
+        """
+        Expires cached registers so the next read goes to ClearBlade
+
+        :param str register_type: (optional) limits invalidation to a register type
+        :param iterable addresses: (optional) limits invalidation to specific addresses of the register type
+        """
+        with self._lock:
+            if register_type is None:
+                self._expiry.clear()
+            elif addresses is None:
+                for key in [k for k in self._expiry if k[0] == register_type]:
+                    del self._expiry[key]
+            else:
+                for addr in addresses:
+                    self._expiry.pop((register_type, addr), None)
+
+    def stats(self):
+        """
+        Returns the cache counters
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._expiry),
+            }
@@ -0,0 +1,249 @@
+"""
+A shared ClearBlade client layer that caches Collection handles and pools keep-alive HTTP sessions,
+so register reads and writes reuse connections instead of paying object construction and TLS handshakes per call.
+"""
+
+import json
+import threading
+from multiprocessing.pool import ThreadPool as WorkerPool
+from Queue import Queue, Empty
+
+import requests
+
+from constants import DEFAULT_HTTP_POOL_SIZE, DEFAULT_HTTP_TIMEOUT, RETRYABLE_CLIENT_STATUS
+
+
+class ClearBladeError(IOError):
+    """A ClearBlade REST call answered with an HTTP status other than 200"""
+    def __init__(self, message, status_code):
+        """
+        :param str message: the error description
+        :param int status_code: the HTTP status of the response
+        """
+        super(ClearBladeError, self).__init__(message)
+        self.status_code = status_code
+
+
+def is_retryable(error):
+    """
+    Returns False if ClearBlade rejected a request as invalid, so sending it again cannot succeed.
+    Connection failures, server errors, authorization and throttling responses may succeed later.
+
+    :param Exception error: the exception raised by a ClearBlade call
+    :rtype: bool
+    """
+    if isinstance(error, ClearBladeError):
+        return not (400 <= error.status_code < 500) or error.status_code in RETRYABLE_CLIENT_STATUS
+    return True
+
+
+class SessionPool(object):
+    """
+    A bounded pool of keep-alive ``requests.Session`` objects shared across threads.
+    Each session is used by one thread at a time; callers wait when all sessions are in use.
+    """
+    def __init__(self, max_size=DEFAULT_HTTP_POOL_SIZE):
+        """
+        Initializes the pool
+
+        :param int max_size: the maximum number of sessions (concurrent connections)
+        """
+        self.max_size = max(1, int(max_size))
+        self.created = 0
+        self.in_use = 0
+        self.waits = 0
+        self.reconnects = 0
+        self._idle = Queue()
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        """Creates a keep-alive session"""
+        return requests.Session()
+
+    def acquire(self):
+        """
+        Leases a session, creating one if the pool is not yet full or waiting for one to be released
+
+        :rtype: requests.Session
+        """
+        try:
+            session = self._idle.get_nowait()
+        except Empty:
+            with self._lock:
+                create = self.created < self.max_size
+                if create:
+                    self.created += 1
+                else:
+                    self.waits += 1
+            session = self._new_session() if create else self._idle.get()
+        with self._lock:
+            self.in_use += 1
+        return session
+
+    def release(self, session):
+        """
+        Returns a leased session to the pool
+
+        :param requests.Session session: the session
+        """
+        with self._lock:
+            self.in_use -= 1
+        self._idle.put(session)
+
+    def reconnect(self, session):
+        """
+        Replaces a session whose connection failed with a fresh one
+
+        :param requests.Session session: the failed session
+        :returns: the replacement session, still leased by the caller
+        :rtype: requests.Session
+        """
+        session.close()
+        with self._lock:
+            self.reconnects += 1
+        return self._new_session()
+
+    def stats(self):
+        """
+        Returns the pool counters
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'size': self.created,
+                'in_use': self.in_use,
+                'idle': self._idle.qsize(),
+                'waits': self.waits,
+                'reconnects': self.reconnects,
+            }
+
+
+class PooledCollection(object):
+    """
+    A ClearBlade Collection handle that issues the same REST calls as ``clearblade.Collections.Collection``
+    through a shared SessionPool. Unlike the SDK handle it keeps no paging state, so it may be shared by threads,
+    and failed calls raise ``ClearBladeError`` (an ``IOError``) rather than exiting the process.
+    """
+    def __init__(self, client, collection):
+        """
+        :param ClearBladeClient client: the owning client
+        :param clearblade.Collections.Collection collection: the SDK handle providing the URL and headers
+        """
+        self.client = client
+        self.url = collection.url
+        self.headers = collection.headers
+        self.collectionName = collection.collectionName
+        self.sslVerify = collection.sslVerify
+
+    def _request(self, method, **kwargs):
+        """Performs a request on a pooled session, reconnecting once if the connection was dropped"""
+        pool = self.client.pool
+        session = pool.acquire()
+        try:
+            try:
+                resp = session.request(method, self.url, headers=self.headers, verify=self.sslVerify,
+                                       timeout=self.client.timeout, **kwargs)
+            except requests.ConnectionError:
+                session = pool.reconnect(session)
+                resp = session.request(method, self.url, headers=self.headers, verify=self.sslVerify,
+                                       timeout=self.client.timeout, **kwargs)
+        finally:
+            pool.release(session)
+        if resp.status_code != 200:
+            raise ClearBladeError("ClearBlade {} {} failed with status {}: {}"
+                                  .format(method, self.collectionName, resp.status_code, resp.text), resp.status_code)
+        try:
+            return resp.json()
+        except ValueError:
+            return resp.text
+
+    def getItems(self, query=None, pagesize=100, pagenum=1):
+        """
+        Return Collection Items
+
+        :param clearblade.ClearBladeCore.Query query: (optional) the query to match
+        :param int pagesize: the number of rows per page
+        :param int pagenum: the page number starting from 1
+        :rtype: list of dict
+        """
+        params = {
+            'PAGESIZE': pagesize,
+            'PAGENUM': pagenum,
+        }
+        if query:
+            params['FILTERS'] = query.filters
+            params['SORT'] = query.sorting
+        return self._request('GET', params={'query': json.dumps(params)})['DATA']
+
+    def updateItems(self, query, data):
+        """
+        Update Collection Items
+
+        :param clearblade.ClearBladeCore.Query query: the rows to update
+        :param dict data: the column values to set
+        """
+        return self._request('PUT', data=json.dumps({'query': query.filters, '$set': data}))
+
+
+class ClearBladeClient(object):
+    """
+    The ClearBlade access shared by the server and slave contexts of the adapter,
+    holding one Collection handle per collection name and a bounded pool of HTTP sessions.
+    """
+    def __init__(self, cb_system, cb_auth, pool_size=DEFAULT_HTTP_POOL_SIZE, timeout=DEFAULT_HTTP_TIMEOUT):
+        """
+        Initializes the client
+
+        :param clearblade.ClearBladeCore.System cb_system: a ClearBlade System
+        :param clearblade.ClearBladeCore.Device cb_auth: a ClearBlade authenticated Device
+        :param int pool_size: the maximum number of concurrent HTTP connections
+        :param float timeout: seconds before an HTTP request is abandoned
+        """
+        self.cb_system = cb_system
+        self.cb_auth = cb_auth
+        self.timeout = timeout
+        self.pool = SessionPool(max_size=pool_size)
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._workers = None
+
+    def collection(self, name):
+        """
+        Returns the shared handle of a collection
+
+        :param str name: the ClearBlade collection name
+        :rtype: PooledCollection
+        """
+        with self._lock:
+            handle = self._collections.get(name, None)
+            if handle is None:
+                handle = PooledCollection(self, self.cb_system.Collection(self.cb_auth, collectionName=name))
+                self._collections[name] = handle
+            return handle
+
+    def map(self, function, items):
+        """
+        Calls a function on each item concurrently, on at most as many worker threads as there are HTTP sessions.
+        The workers start with the first call of more than one item. The function must not call ``map`` itself.
+
+        :param callable function: the function making ClearBlade calls
+        :param list items: the argument of each call
+        :returns: the results in the order of the items
+        :rtype: list
+        :raises Exception: the error of a failed call
+        """
+        if len(items) <= 1:
+            return [function(item) for item in items]
+        with self._lock:
+            if self._workers is None:
+                self._workers = WorkerPool(self.pool.max_size)
+        return self._workers.map(function, items)
+
+    def stats(self):
+        """
+        Returns the connection pool counters
+
+        :rtype: dict
+        """
+        return self.pool.stats()
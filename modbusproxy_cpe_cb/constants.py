@@ -11,6 +11,13 @@ TYPE_INPUT_REGISTER = 'ir'
 TYPE_DISCRETE_INPUT = 'di'
 TYPE_COIL = 'co'
 REGISTER_TYPES = [TYPE_HOLDING_REGISTER, TYPE_INPUT_REGISTER, TYPE_DISCRETE_INPUT, TYPE_COIL]
+# Keys of the PyModbus slave context store (see IModbusSlaveContext.decode) for each register type
+STORE_KEYS = {
+    TYPE_HOLDING_REGISTER: 'h',
+    TYPE_INPUT_REGISTER: 'i',
+    TYPE_DISCRETE_INPUT: 'd',
+    TYPE_COIL: 'c',
+}
 
 
 # ---------- ClearBlade platform RTU Configuraion Collection & Columns (minimum required) ---------- #
@@ -20,6 +27,8 @@ COL_PROXY_IP_PORT = 'ip_port'
 COL_SLAVE_ID = 'slave_id'
 COL_PROXY_CONFIG_FILE = 'config_file'
 COL_PROXY_TIMESTAMP = 'last_report_time'
+COL_PROXY_CACHE_TTL = 'cache_ttl'   # optional per-RTU override of the adapter register cache TTL
+COL_PROXY_READ_DEADLINE = 'read_deadline'   # optional per-RTU override of the adapter read deadline
 
 
 # ---------- ClearBlade platform Data Collection & Columns (minimum required) ---------------------- #
@@ -31,6 +40,7 @@ COL_REG_ADDRESS = 'register_address'
 COL_REG_DATA = 'register_data'
 COL_DATA_TIMESTAMP = 'timestamp'
 COL_REG_TYPE = 'register_type'
+COL_ITEM_ID = 'item_id'   # the row ID assigned by ClearBlade, breaking ties when paging in timestamp order
 
 
 # ---------- ModbusProxy Lua service tags/labels used in the config.dat file ----------------------- #
@@ -50,3 +60,59 @@ TEMPLATE_PARSER_TYPE_HOLDING_REGISTER = 'holding'
 TEMPLATE_PARSER_TYPE_INPUT_REGISTER = 'analog'
 TEMPLATE_PARSER_TYPE_DISCRETE_INPUT = 'input'
 TEMPLATE_PARSER_TYPE_COIL = 'coil'
+TEMPLATE_PARSER_REG_CLASS = 'refreshClass'
+REFRESH_CLASS_BULK = 'bulk'   # registers refreshed on the regular schedule
+REFRESH_CLASS_CRITICAL = 'critical'   # registers such as alarms and trips refreshed on a short schedule of their own
+REFRESH_CLASSES = [REFRESH_CLASS_BULK, REFRESH_CLASS_CRITICAL]
+
+
+# ---------- Adapter runtime defaults ------------------------------------------------------------- #
+DEFAULT_CACHE_SIZE = 65536   # maximum registers tracked per slave context by the register cache
+DEFAULT_HTTP_POOL_SIZE = 4   # maximum concurrent keep-alive HTTP connections to ClearBlade
+DEFAULT_HTTP_TIMEOUT = 30   # seconds before a ClearBlade HTTP request is abandoned
+DEFAULT_FETCH_WORKERS = 4   # maximum concurrent ClearBlade fetches in async read mode
+DEFAULT_READ_DEADLINE = 0   # seconds a direct read waits for ClearBlade before serving last-known values (0 disables)
+DEFAULT_DEADLINE_WORKERS = 8   # maximum concurrent ClearBlade fetches of direct reads with a read deadline
+DEADLINE_LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10]   # upper bounds in seconds of the fetch latency histogram
+DEFAULT_QUERY_GROUPS = 50   # OR filter groups per ClearBlade query, bounding the length of the query URL
+DEFAULT_PAGE_SIZE = 1000   # rows requested per page when reading whole collections from ClearBlade
+DEFAULT_READ_AHEAD = 0   # registers a cache-miss fetch is widened to within its data block (0 disables)
+DEFAULT_REFRESH_INTERVAL = 60   # seconds between background refreshes of register data
+DEFAULT_DELTA_OVERLAP = 60   # seconds delta sync reads back before the newest timestamp loaded, for late rows
+DEFAULT_ADAPTIVE_MIN_INTERVAL = 5   # fewest seconds between adaptive refreshes of a slave
+DEFAULT_ADAPTIVE_MAX_INTERVAL = 3600   # most seconds between adaptive refreshes of a slave
+DEFAULT_ADAPTIVE_MARGIN = 5   # seconds after an RTU's expected report before its adaptive refresh
+DEFAULT_CADENCE_SMOOTHING = 0.3   # weight of the latest reporting interval in an RTU's learned cadence
+DEFAULT_CRITICAL_INTERVAL = 5   # seconds between refreshes of critical registers in priority read mode
+DEFAULT_REFRESH_BUDGET = 0   # slaves refreshed per round of a refresh class in priority read mode (0 is unlimited)
+DEFAULT_WRITE_RETRY_INTERVAL = 1.0   # seconds before the first retry of a failed coalesced write to ClearBlade
+DEFAULT_WRITE_RETRY_MAX_BACKOFF = 300   # maximum seconds between retries of failed coalesced writes
+DEFAULT_WRITE_BEHIND_INTERVAL = 1.0   # seconds between write-behind journal flushes to ClearBlade
+DEFAULT_WRITE_BEHIND_BATCH = 500   # journal entries written to ClearBlade per flush
+DEFAULT_WRITE_BEHIND_MAX_BACKOFF = 300   # maximum seconds between retries of failed write-behind flushes
+DEFAULT_WRITE_BEHIND_MAX_ATTEMPTS = 10   # failed flushes of a journal entry before it is dead-lettered
+RETRYABLE_CLIENT_STATUS = [401, 403, 408, 429]   # 4xx ClearBlade responses that may succeed when retried
+DEFAULT_JOURNAL_COMPACT_BYTES = 1048576   # journal size above which it is truncated once fully flushed
+
+READ_MODE_DIRECT = 'direct'   # each Modbus read queries ClearBlade for the requested window (subject to cache)
+READ_MODE_PREFETCH = 'prefetch'   # each slave reads all its registers on a schedule, Modbus reads use memory only
+READ_MODE_BATCH = 'batch'   # one adapter-wide paged query refreshes every slave, Modbus reads use memory only
+READ_MODE_ASYNC = 'async'   # Modbus reads use memory only, cache misses are fetched by a background worker pool
+READ_MODE_SHARED = 'shared'   # Modbus reads use the shared register table only, refreshed by another process
+READ_MODE_ADAPTIVE = 'adaptive'   # each slave is read just after its RTU is expected to report, reads use memory only
+READ_MODE_PRIORITY = 'priority'   # critical registers and whole slaves are read on separate schedules and budgets
+READ_MODES = [READ_MODE_DIRECT, READ_MODE_PREFETCH, READ_MODE_BATCH, READ_MODE_ASYNC, READ_MODE_SHARED,
+              READ_MODE_ADAPTIVE, READ_MODE_PRIORITY]
+
+ENGINE_REACTOR = 'reactor'   # every proxy listener is registered on the single reactor event loop
+ENGINE_THREADS = 'threads'   # each proxy server is started from its own reactor pool thread (legacy)
+ENGINES = [ENGINE_REACTOR, ENGINE_THREADS]
+DEFAULT_REACTOR_THREADS = 10   # reactor thread pool size for background work, independent of the proxy count
+
+WORKER_STATS_PREFIX = '@@STATS '   # marks worker stdout lines carrying JSON statistics for the supervisor
+DEFAULT_WORKER_MAX_BACKOFF = 60   # maximum seconds before a crashed worker process is restarted
+DEFAULT_WORKER_STOP_TIMEOUT = 10   # seconds a worker is given to exit when interrupted before it is killed
+WORKER_PEAK_STATS = ['backoff', 'build_seconds', 'fetch_seconds', 'last_duration', 'mean_interval',
+                     'first_listener_seconds', 'serving_seconds', 'slots', 'claimed', 'slots_claimed']   # worker stats aggregated by max
+DEFAULT_SHARED_TABLE_SLOTS = 262144   # registers a new shared register table can hold (24 bytes each)
+DEFAULT_SNAPSHOT_INTERVAL = 30   # seconds between warm-start snapshots of the register values
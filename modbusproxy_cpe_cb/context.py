@@ -4,13 +4,20 @@ Requires a unique instance per slave device represented in the platform.
 """
 
 from clearblade.ClearBladeCore import Query
+from twisted.internet import reactor, task, threads
 from pymodbus.interfaces import IModbusSlaveContext
 from pymodbus.datastore.context import ModbusServerContext
 from pymodbus.device import ModbusDeviceIdentification
 from pymodbus.constants import Endian
 
 from headless import is_logger, get_wrapping_logger
-from store import CbModbusSequentialDataBlock, CbModbusSparseDataBlock
+from store import CbModbusSequentialDataBlock, CbModbusSegmentedDataBlock, CbModbusSparseDataBlock
+from store import read_slave_data, read_registers, parse_timestamp, sortable_timestamp
+from cache import RegisterCache
+from client import ClearBladeClient
+from fetch import FetchPool, DeadlineFetcher
+from writer import WriteCoalescer
+from template import parse_template
 from constants import *
 
 
@@ -28,6 +35,11 @@ class ClearBladeModbusProxySlaveContext(IModbusSlaveContext):
        * ``last_report_time`` (ts) timestamp of the most recently received data from the RTU in the field (metadata)
        * ``config_file`` (str) a formatted text file conforming to Inmarsat's IDP Modbus Proxy template
 
+    Optionally the row may define:
+
+       * ``cache_ttl`` (str) register cache TTL override for this RTU e.g. ``60`` or ``hr=5,ir=60``
+       * ``read_deadline`` (float) read deadline override for this RTU in seconds
+
     .. todo::
        Add URL link to Modbus Proxy template
 
@@ -37,7 +49,19 @@ class ClearBladeModbusProxySlaveContext(IModbusSlaveContext):
 
         :param ClearBladeModbusProxyServerContext server_context: the parent server context
         :param dict config: a row returned from reading the Clearblade collection for RTU configuration
-        :param kwargs: optional arguments such as log
+        :param kwargs: optional arguments such as log, cache_ttl (seconds or per register type), cache_size,
+           read_mode ('direct', 'prefetch', 'batch', 'async', 'shared', 'adaptive' or 'priority'),
+           refresh_interval (seconds between prefetches),
+           read_ahead (rows a cache-miss fetch is widened to within its data block, 0 disables),
+           read_deadline (seconds a direct read waits for ClearBlade before serving last-known values, 0 disables),
+           deadline_fetcher (a fetch.DeadlineFetcher running the cache misses of direct reads with a deadline),
+           delta_sync (refreshes only read rows at or after the newest timestamp already loaded),
+           delta_overlap (seconds delta sync reads back before the newest timestamp, for rows stored late)
+           write_window (seconds to coalesce writes before updating ClearBlade)
+           write_behind (a journal.WriteBehindFlusher to acknowledge writes once journaled locally)
+           fetch_pool (a fetch.FetchPool serving cache misses in async read mode)
+           shared_table (a shared.SharedRegisterTable used as the storage of the data blocks)
+           and template_cache (a template.TemplateCache of parsed ``config.dat`` files shared by the slaves)
         """
         if is_logger(kwargs.get('log', None)):
             self.log = kwargs.get('log')
@@ -46,6 +70,7 @@ class ClearBladeModbusProxySlaveContext(IModbusSlaveContext):
                                            debug=True if kwargs.get('debug', None) else False)
         self.cb_system = server_context.cb_system
         self.cb_auth = server_context.cb_auth
+        self.client = server_context.client
         self.cb_data_collection = server_context.cb_data
         self.ip_proxy = str(config[COL_PROXY_IP_ADDRESS])
         self.ip_port = int(config[COL_PROXY_IP_PORT])
@@ -53,10 +78,40 @@ class ClearBladeModbusProxySlaveContext(IModbusSlaveContext):
             self.log.warning("No proxy IP address specified, may result in conflicting slave_id")
         self.slave_id = int(config[COL_SLAVE_ID])
         self.zero_mode = True
-        # self.last_report_time = config[COL_PROXY_TIMESTAMP]
+        self.last_report_time = config.get(COL_PROXY_TIMESTAMP, None)
+        cache_ttl = config.get(COL_PROXY_CACHE_TTL, None)
+        if cache_ttl is None or cache_ttl == '':
+            cache_ttl = kwargs.get('cache_ttl', None)
+        self.cache = RegisterCache(ttl=cache_ttl, max_size=kwargs.get('cache_size', DEFAULT_CACHE_SIZE))
+        self.read_mode = kwargs.get('read_mode', READ_MODE_DIRECT)
+        if self.read_mode not in READ_MODES:
+            raise ValueError("Read mode must be one of: {}".format(READ_MODES))
+        self.refresh_interval = float(kwargs.get('refresh_interval', DEFAULT_REFRESH_INTERVAL))
+        self.read_ahead = max(0, int(kwargs.get('read_ahead', DEFAULT_READ_AHEAD)))
+        read_deadline = config.get(COL_PROXY_READ_DEADLINE, None)
+        if read_deadline is None or read_deadline == '':
+            read_deadline = kwargs.get('read_deadline', DEFAULT_READ_DEADLINE)
+        self.read_deadline = max(0.0, float(read_deadline))
+        self.deadline_fetcher = kwargs.get('deadline_fetcher', None)
+        if self.read_deadline > 0 and self.deadline_fetcher is None:
+            self.deadline_fetcher = DeadlineFetcher()
+        self.fetch_pool = kwargs.get('fetch_pool', None)
+        if self.read_mode == READ_MODE_ASYNC and self.fetch_pool is None:
+            self.fetch_pool = FetchPool()
+        self.shared_table = kwargs.get('shared_table', None)
+        self.template_cache = kwargs.get('template_cache', None)
+        self._refresh_loop = None
+        self.delta_sync = bool(kwargs.get('delta_sync', False))
+        self.delta_overlap = max(0.0, float(kwargs.get('delta_overlap', DEFAULT_DELTA_OVERLAP)))
+        self.high_water_mark = None
+        self.high_water_epoch = None
+        self._pending_high_water = None
+        self.writer = WriteCoalescer(self, window=kwargs.get('write_window', 0),
+                                     write_behind=kwargs.get('write_behind', None))
         self.identity = ModbusDeviceIdentification()
         self.sparse = False
         self.store = dict()
+        self.critical = dict()
         # Byte order and word order may be per-register and are assumed to be handled by the Polling Client
         # self.byteorder = Endian.Big
         # self.wordorder = Endian.Big
@@ -64,132 +119,29 @@ class ClearBladeModbusProxySlaveContext(IModbusSlaveContext):
         self.log.debug("Slave context {} complete".format(self.ip_proxy))
 
     def _parse_config(self, config_file):
-        """Parses the ``config.dat`` file"""
-        registers = []
-        lines = config_file.splitlines()
-        for line in lines:
-            if line[0:len(TEMPLATE_PARSER_DESC)] == TEMPLATE_PARSER_DESC:
-                identity = line.split(TEMPLATE_PARSER_SEPARATOR)
-                for id_tag in identity:
-                    if id_tag[0:len('VendorName')] == 'VendorName':
-                        self.identity.VendorName = id_tag[len('VendorName') + 1:].strip()
-                    elif id_tag[0:len('ProductCode')] == 'ProductCode':
-                        self.identity.ProductCode = id_tag[len('ProductCode') + 1:].strip()
-                    elif id_tag[0:len('VendorUrl')] == 'VendorUrl':
-                        self.identity.VendorUrl = id_tag[len('VendorUrl') + 1:].strip()
-                    elif id_tag[0:len('ProductName')] == 'ProductName':
-                        self.identity.ProductName = id_tag[len('ProductName') + 1:].strip()
-                    elif id_tag[0:len('ModelName')] == 'ModelName':
-                        self.identity.ModelName = id_tag[len('ModelName') + 1:].strip()
-                    elif id_tag[0:len('MajorMinorRevision')] == 'MajorMinorRevision':
-                        self.identity.MajorMinorRevision = id_tag[len('MajorMinorRevision') + 1:].strip()
-                    elif id_tag[0:len('sparse')].lower() == 'sparse':
-                        self.sparse = bool(int(id_tag[len('sparse') + 1:].strip()))
-            elif line[0:len(TEMPLATE_PARSER_NETWORK)] == TEMPLATE_PARSER_NETWORK:
-                net_info = line.split(TEMPLATE_PARSER_SEPARATOR)
-                for i in net_info:
-                    if i[0:len(TEMPLATE_PARSER_SLAVE_ID)] == TEMPLATE_PARSER_SLAVE_ID:
-                        net_id = int(i[len(TEMPLATE_PARSER_SLAVE_ID) + 1:].strip())
-                        if net_id in range(1, 255):
-                            self.slave_id = int(i[len(TEMPLATE_PARSER_SLAVE_ID) + 1:])
-                        else:
-                            self.log.error("Invalid Modbus Slave ID {id}".format(id=net_id))
-                    elif i[0:len(TEMPLATE_PARSER_NOT_ZERO_MODE)] == TEMPLATE_PARSER_NOT_ZERO_MODE:
-                        plc = int(i[len(TEMPLATE_PARSER_NOT_ZERO_MODE) + 1:].strip())
-                        self.zero_mode = False if plc == 1 else True
-                    # Byte order and word order may be per-register and are assumed to be handled by the Polling Client
-                    # elif i[0:len('byteOrder')] == 'byteOrder':
-                    #     self.byteorder = Endian.Big if i[len('byteOrder') + 1:].strip() == 'msb' else Endian.Little
-                    # elif i[0:len('wordOrder')] == 'wordOrder':
-                    #     self.wordorder = Endian.Big if i[len('wordOrder') + 1:].strip() == 'msw' else Endian.Little
-            elif line[0:len(TEMPLATE_PARSER_REGISTER_DEF)] == TEMPLATE_PARSER_REGISTER_DEF:
-                # TODO: handle multi-register blocks
-                reg_config = line.split(TEMPLATE_PARSER_SEPARATOR)
-                reg_exists = False
-                this_reg = None
-                for c in reg_config:
-                    if c[0:len(TEMPLATE_PARSER_REG_UID)] == TEMPLATE_PARSER_REG_UID:
-                        param_id = int(c[len(TEMPLATE_PARSER_REG_UID) + 1:].strip())
-                        for reg in registers:
-                            if param_id == reg.param_id:
-                                reg_exists = True
-                        if not reg_exists:
-                            registers.append(self._RegisterBlockConfig(param_id=param_id))
-                            reg_exists = True
-                        this_reg = param_id
-                    elif c[0:len(TEMPLATE_PARSER_REG_ADDRESS)] == TEMPLATE_PARSER_REG_ADDRESS:
-                        addr = int(c[len(TEMPLATE_PARSER_REG_ADDRESS) + 1:].strip())
-                        # TODO: confirm this works properly
-                        if not self.zero_mode:
-                            addr += 1
-                        if addr in range(0, 99999+1):
-                            for reg in registers:
-                                if reg.param_id == this_reg:
-                                    reg.address = addr
-                            if not reg_exists:
-                                registers.append(self._RegisterBlockConfig(address=addr))
-                                reg_exists = True
-                        else:
-                            self.log.error("Invalid Modbus address {num}".format(num=addr))
-                    elif c[0:len(TEMPLATE_PARSER_REG_TYPE)] == TEMPLATE_PARSER_REG_TYPE:
-                        reg_type = c[len(TEMPLATE_PARSER_REG_TYPE) + 1:].strip()
-                        if reg_type in [TEMPLATE_PARSER_TYPE_INPUT_REGISTER]:
-                            for reg in registers:
-                                if reg.param_id == this_reg:
-                                    reg.register_type = TYPE_INPUT_REGISTER
-                        elif reg_type in [TEMPLATE_PARSER_TYPE_HOLDING_REGISTER]:
-                            for reg in registers:
-                                if reg.param_id == this_reg:
-                                    reg.register_type = TYPE_HOLDING_REGISTER
-                        elif reg_type in [TEMPLATE_PARSER_TYPE_DISCRETE_INPUT]:
-                            for reg in registers:
-                                if reg.param_id == this_reg:
-                                    reg.register_type = TYPE_DISCRETE_INPUT
-                        elif reg_type in [TEMPLATE_PARSER_TYPE_COIL]:
-                            for reg in registers:
-                                if reg.param_id == this_reg:
-                                    reg.register_type = TYPE_COIL
-                        else:
-                            self.log.error("Unsupported registerType {}".format(reg_type))
-        hr_sparse_block = {}
-        ir_sparse_block = {}
-        di_sparse_block = {}
-        co_sparse_block = {}
-        hr_sequential = []
-        ir_sequential = []
-        di_sequential = []
-        co_sequential = []
-        for reg in registers:
-            if reg.register_type == TYPE_HOLDING_REGISTER:
-                if self.sparse:
-                    hr_sparse_block[reg.address] = 0
-                else:
-                    hr_sequential.append(reg.address)
-            elif reg.register_type == TYPE_INPUT_REGISTER:
-                if self.sparse:
-                    ir_sparse_block[reg.address] = 0
-                else:
-                    ir_sequential.append(reg.address)
-            elif reg.register_type == TYPE_DISCRETE_INPUT:
-                if self.sparse:
-                    di_sparse_block[reg.address] = 0
-                else:   # reg.register_type == TYPE_COIL
-                    di_sequential.append(reg.address)
-            else:
-                if self.sparse:
-                    co_sparse_block[reg.address] = 0
-                else:
-                    co_sequential.append(reg.address)
-        if self.sparse:
-            self.store['h'] = self._setup_sparse_block(hr_sparse_block, TYPE_HOLDING_REGISTER)
-            self.store['i'] = self._setup_sparse_block(ir_sparse_block, TYPE_INPUT_REGISTER)
-            self.store['d'] = self._setup_sparse_block(di_sparse_block, TYPE_DISCRETE_INPUT)
-            self.store['c'] = self._setup_sparse_block(co_sparse_block, TYPE_COIL)
+        """Parses the ``config.dat`` file, through the template cache if one is configured"""
+        if self.template_cache is not None:
+            template = self.template_cache.get(config_file)
         else:
-            self.store['h'] = self._setup_sequential_block(hr_sequential, TYPE_HOLDING_REGISTER)
-            self.store['i'] = self._setup_sequential_block(ir_sequential, TYPE_INPUT_REGISTER)
-            self.store['d'] = self._setup_sequential_block(di_sequential, TYPE_DISCRETE_INPUT)
-            self.store['c'] = self._setup_sequential_block(co_sequential, TYPE_COIL)
+            template = parse_template(config_file)
+        for error in template['errors']:
+            self.log.error(error)
+        for tag, value in template['identity'].items():
+            setattr(self.identity, tag, value)
+        self.sparse = template['sparse']
+        if template['slave_id'] is not None:
+            self.slave_id = template['slave_id']
+        self.zero_mode = template['zero_mode']
+        self.critical = dict((register_type, addresses) for register_type, addresses in template['critical'].items()
+                             if len(addresses) > 0)
+        # the template blocks are shared by every slave using the same template, so each block gets a copy
+        blocks = template['blocks']
+        for key, register_type in (('h', TYPE_HOLDING_REGISTER), ('i', TYPE_INPUT_REGISTER),
+                                   ('d', TYPE_DISCRETE_INPUT), ('c', TYPE_COIL)):
+            if self.sparse:
+                self.store[key] = self._setup_sparse_block(dict.fromkeys(blocks[register_type], 0), register_type)
+            else:
+                self.store[key] = self._setup_sequential_block(list(blocks[register_type]), register_type)
 
     def _setup_sparse_block(self, block, register_type):
         """
@@ -207,43 +159,156 @@ class ClearBladeModbusProxySlaveContext(IModbusSlaveContext):
 
     def _setup_sequential_block(self, block, register_type):
         """
-        Sets up a custom ModbusSequentialDataBlock for ClearBlade interaction and metadata
+        Sets up a custom ModbusSequentialDataBlock for ClearBlade interaction and metadata.
+        Addresses with gaps between them are set up as a segmented block holding only the configured registers.
 
-        :param list block: a list of contiguous register addresses starting from a base address
+        :param list block: a list of register addresses starting from a base address
         :param str register_type: the type of register / memory value ['di', 'co', 'hr', 'ir']
         :return: a ModbusDataBlock
-        :rtype: CbModbusSequentialDataBlock or None
+        :rtype: CbModbusSequentialDataBlock or CbModbusSegmentedDataBlock or None
         """
         if register_type in REGISTER_TYPES and len(block) > 0:
             block.sort()
+            if block[-1] - block[0] + 1 > len(set(block)):
+                return CbModbusSegmentedDataBlock(context=self, register_type=register_type, addresses=block)
             return CbModbusSequentialDataBlock(context=self, register_type=register_type,
                                                address=block[0],
-                                               values=[0 for x in range(block[0], block[len(block)-1])])
+                                               values=[0 for x in range(block[0], block[len(block)-1] + 1)])
         else:
             return None
 
-    class _RegisterBlockConfig(object):
-        """Private class for parsing of register block metadata"""
-        def __init__(self, param_id=None, address=None, register_type=None, block_size=1):
-            """
-            Initialize termporary metadata for parsing
-
-            :param int param_id: A unique parameterId defined on the Modbus Proxy remote edge device
-            :param int address: the starting address of the block
-            :param str register_type: the type of data 'di', 'co', 'hr', 'ir'
-            :param int block_size: (optional) for specifying blocks that span multiple registers (unused)
-            """
-            self.param_id = param_id
-            self.address = address
-            self.register_type = register_type
-            self.block_size = block_size
-
     def __str__(self):
         """
         Returns a string representation of the context
         """
         return "ClearBlade Modbus Proxy Slave Context"
 
+    def load_rows(self, rows, high_water=True):
+        """
+        Splits data collection rows by register type and loads them into the data blocks
+
+        :param list rows: ClearBlade data collection rows for this slave
+        :param bool high_water: tracks the newest timestamp for the delta sync high-water mark, only if the rows are
+           every changed register (see ``commit_high_water_mark``)
+        :returns: the number of registers loaded
+        :rtype: int
+        """
+        by_type = {}
+        for row in rows:
+            by_type.setdefault(row[COL_REG_TYPE], []).append(row)
+            if high_water:
+                self._track_high_water_mark(row.get(COL_DATA_TIMESTAMP, None))
+        loaded = 0
+        for register_type, type_rows in by_type.items():
+            block = self.store.get(STORE_KEYS.get(register_type, None), None)
+            if block is None:
+                self.log.warning("Ignoring {} {} rows not configured for slave {}"
+                                 .format(len(type_rows), register_type, self.slave_id))
+                continue
+            addresses = block.load(type_rows)
+            self.cache.update(register_type, addresses)
+            loaded += len(addresses)
+        return loaded
+
+    def _track_high_water_mark(self, timestamp):
+        """
+        Remembers the newest data timestamp of the read in progress, committed once the read is complete
+
+        :param timestamp: a data collection row timestamp
+        """
+        epoch = parse_timestamp(timestamp)
+        if epoch is not None and (self._pending_high_water is None or epoch > self._pending_high_water[0]):
+            self._pending_high_water = (epoch, timestamp)
+
+    def commit_high_water_mark(self):
+        """
+        Advances the lower bound of delta sync queries to the newest data timestamp of a complete read,
+        stepped back by ``delta_overlap`` so rows stored after newer ones with an older field timestamp are still read.
+        Delta sync requires a timestamp-typed column, epoch numbers or ISO 8601 strings, which ClearBlade compares
+        in time order, and is turned off for the slave when rows use another format.
+        """
+        if self._pending_high_water is None:
+            return
+        epoch, timestamp = self._pending_high_water
+        self._pending_high_water = None
+        if self.high_water_epoch is None or epoch > self.high_water_epoch:
+            self.high_water_epoch = epoch
+            self.high_water_mark = sortable_timestamp(timestamp, self.delta_overlap)
+            if self.high_water_mark is None and self.delta_sync:
+                self.log.warning("Delta sync disabled for slave {} at {}: timestamp {} does not sort in time order"
+                                 .format(self.slave_id, self.ip_proxy, timestamp))
+                self.delta_sync = False
+
+    def reset_high_water_mark(self):
+        """Forces the next delta sync refresh to read every register of the slave"""
+        self.high_water_mark = None
+        self.high_water_epoch = None
+        self._pending_high_water = None
+
+    def refresh(self):
+        """
+        Reads every register of the slave from ClearBlade in a single query and loads all the data blocks.
+        In delta sync mode only rows at or after the high-water-mark timestamp are read,
+        and the mark only advances once every page of the read has been loaded.
+
+        :returns: the number of registers loaded
+        :rtype: int
+        """
+        since = self.high_water_mark if self.delta_sync else None
+        rows = read_slave_data(self, since=since)
+        loaded = self.load_rows(rows)
+        self.commit_high_water_mark()
+        self.log.debug("Refreshed {} registers of slave {} at {}{}".format(
+            loaded, self.slave_id, self.ip_proxy, " since {}".format(since) if since is not None else ""))
+        return loaded
+
+    def refresh_critical(self):
+        """
+        Reads the registers tagged ``refreshClass=critical`` in the template from ClearBlade in a single query.
+        The high-water mark is left to the whole-slave refresh, so delta sync does not skip other registers.
+
+        :returns: the number of registers loaded
+        :rtype: int
+        """
+        if len(self.critical) == 0:
+            return 0
+        loaded = self.load_rows(read_registers(self, self.critical), high_water=False)
+        self.log.debug("Refreshed {} critical registers of slave {} at {}".format(loaded, self.slave_id, self.ip_proxy))
+        return loaded
+
+    def refresh_in_background(self):
+        """
+        Refreshes the slave on the reactor thread pool, as scheduled by ``start_refresh`` or requested by a snapshot
+        reconciliation. A failed refresh is logged and the Deferred fires with None, so a LoopingCall is not stopped.
+
+        :returns: a Deferred firing with the number of registers loaded, or None if the refresh failed
+        :rtype: twisted.internet.defer.Deferred
+        """
+        d = threads.deferToThread(self.refresh)
+        d.addErrback(lambda failure: self.log.error("Refresh of slave {} at {} failed: {}"
+                                                    .format(self.slave_id, self.ip_proxy,
+                                                            failure.getErrorMessage())))
+        return d
+
+    def start_refresh(self, interval=None):
+        """
+        Schedules periodic refreshes of all the data blocks from ClearBlade, starting once the reactor runs
+
+        :param float interval: (optional) seconds between refreshes, defaults to ``refresh_interval``
+        """
+        if interval is not None:
+            self.refresh_interval = float(interval)
+        if self._refresh_loop is None:
+            self._refresh_loop = task.LoopingCall(self.refresh_in_background)
+            reactor.callWhenRunning(self._refresh_loop.start, self.refresh_interval, now=True)
+
+    def stop_refresh(self):
+        """Stops the periodic refresh"""
+        if self._refresh_loop is not None:
+            if self._refresh_loop.running:
+                self._refresh_loop.stop()
+            self._refresh_loop = None
+
     def reset(self):
         """ NOT IMPLEMENTED - placeholder for future """
         # No-op for this implementation
@@ -295,6 +360,10 @@ class ClearBladeModbusProxyServerContext(ModbusServerContext):
     """
     A Modbus server context, initialized by reading a ClearBlade collection defining Slave configurations / templates
     """
+    #: Keyword arguments passed through to each ClearBladeModbusProxySlaveContext of the server
+    SLAVE_OPTIONS = ('cache_ttl', 'cache_size', 'read_mode', 'refresh_interval', 'read_ahead', 'read_deadline',
+                     'deadline_fetcher', 'delta_sync', 'delta_overlap', 'write_window', 'write_behind', 'fetch_pool', 'shared_table',
+                     'template_cache')
 
     def __init__(self, cb_system, cb_auth, cb_slaves_config, cb_data, **kwargs):
         """
@@ -304,7 +373,9 @@ class ClearBladeModbusProxyServerContext(ModbusServerContext):
         :param clearblade.ClearBladeCore.Device cb_auth: a ClearBlade authenticated Device
         :param str cb_slaves_config: the name of the ClearBlade Collection holding Slave definitions
         :param str cb_data: the name of the ClearBlade Collection holding data
-        :param kwargs: optionally takes log definition
+        :param kwargs: optionally takes log definition, a client.ClearBladeClient shared with other server contexts,
+           rows (the RTU rows of ip_address already read from cb_slaves_config, skipping the query)
+           and any of ``SLAVE_OPTIONS`` for the slave contexts
         """
         super(ClearBladeModbusProxyServerContext, self).__init__(single=kwargs.get('single', False))
         if is_logger(kwargs.get('log', None)):
@@ -314,29 +385,91 @@ class ClearBladeModbusProxyServerContext(ModbusServerContext):
                                            debug=True if kwargs.get('debug', None) else False)
         self.cb_system = cb_system
         self.cb_auth = cb_auth
+        self.client = kwargs.get('client', None) or ClearBladeClient(cb_system, cb_auth)
         self.ip_address = kwargs.get('ip_address', None)
         self.cb_slaves = cb_slaves_config
         self.cb_data = cb_data
-        self._initialize_slaves()
+        self.read_mode = kwargs.get('read_mode', READ_MODE_DIRECT)
+        self.slave_options = dict((k, v) for k, v in kwargs.items() if k in self.SLAVE_OPTIONS)
+        if self.read_mode == READ_MODE_ASYNC and self.slave_options.get('fetch_pool', None) is None:
+            self.slave_options['fetch_pool'] = FetchPool()
+        if self.read_mode == READ_MODE_DIRECT and self.slave_options.get('deadline_fetcher', None) is None:
+            # created for every direct server context as RTU rows may set a read deadline of their own
+            self.slave_options['deadline_fetcher'] = DeadlineFetcher()
+        self._initialize_slaves(kwargs.get('rows', None))
+
+    def _initialize_slaves(self, rows=None):
+        """
+        Sets up the slave contexts for the server
 
-    def _initialize_slaves(self):
-        """Sets up the slave contexts for the server"""
+        :param list rows: (optional) the RTU rows of the server, otherwise they are queried from ClearBlade
+        """
         slaves = []
-        collection = self.cb_system.Collection(self.cb_auth, collectionName=self.cb_slaves)
-        query = Query()
-        if self.ip_address is not None:
-            self.log.debug("Querying ClearBlade based on ip_address: {}".format(self.ip_address))
-            query.equalTo(COL_PROXY_IP_ADDRESS, self.ip_address)
-        else:
-            self.log.debug("No ip_address found in ClearBlade, querying based on non-empty slave_id")
-            query.notEqualTo(COL_SLAVE_ID, '')
-        rows = collection.getItems(query)
+        if rows is None:
+            collection = self.client.collection(self.cb_slaves)
+            query = Query()
+            if self.ip_address is not None:
+                self.log.debug("Querying ClearBlade based on ip_address: {}".format(self.ip_address))
+                query.equalTo(COL_PROXY_IP_ADDRESS, self.ip_address)
+            else:
+                self.log.debug("No ip_address found in ClearBlade, querying based on non-empty slave_id")
+                query.notEqualTo(COL_SLAVE_ID, '')
+            rows = collection.getItems(query)
         self.log.debug("Found {} rows in ClearBlade adapter config".format(len(rows)))
         for row in rows:
             slave_id = int(row[COL_SLAVE_ID])
             if slave_id not in slaves:
                 slaves.append(slave_id)
-                self[slave_id] = ClearBladeModbusProxySlaveContext(server_context=self, config=row, log=self.log)
+                self[slave_id] = ClearBladeModbusProxySlaveContext(server_context=self, config=row, log=self.log,
+                                                                   **self.slave_options)
             else:
                 self.log.warning("Duplicate slave_id {} found in RTUs collection - only 1 RTU per server context"
                                  .format(slave_id))
+
+    def start_prefetch(self):
+        """Schedules the periodic whole-slave refresh of every slave context when running in prefetch mode"""
+        if self.read_mode == READ_MODE_PREFETCH:
+            for slave_id, slave in self:
+                slave.start_refresh()
+
+    def cache_stats(self):
+        """
+        Returns the register cache counters aggregated across the slave contexts of the server
+
+        :rtype: dict
+        """
+        totals = {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0}
+        for slave_id, slave in self:
+            stats = slave.cache.stats()
+            for key in totals:
+                totals[key] += stats[key]
+        return totals
+
+    def write_stats(self):
+        """
+        Returns the write coalescing counters aggregated across the slave contexts of the server
+
+        :rtype: dict
+        """
+        totals = {'requests': 0, 'registers': 0, 'updates': 0, 'errors': 0, 'retries': 0, 'pending': 0}
+        for slave_id, slave in self:
+            stats = slave.writer.stats()
+            for key in totals:
+                totals[key] += stats[key]
+        return totals
+
+    def fetch_stats(self):
+        """
+        Returns the ClearBlade fetch counters aggregated across the data blocks of the server,
+        where ``saved`` counts the fetches answered by waiting on an overlapping fetch already in flight
+
+        :rtype: dict
+        """
+        totals = {'fetches': 0, 'coalesced': 0, 'saved': 0}
+        for slave_id, slave in self:
+            for block in slave.store.values():
+                if block is not None:
+                    stats = block.in_flight.stats()
+                    for key in totals:
+                        totals[key] += stats[key]
+        return totals
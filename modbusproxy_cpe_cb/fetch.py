@@ -0,0 +1,205 @@
+"""
+Background fetching of register data so ClearBlade I/O never runs on the Twisted reactor thread,
+and deadline-bounded fetching so a slow ClearBlade call never outlasts the timeout of the Modbus master.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from multiprocessing.pool import ThreadPool as WorkerPool
+
+from twisted.internet import reactor, threads
+from twisted.internet.defer import Deferred
+from twisted.python.failure import Failure
+from twisted.python.threadable import isInIOThread
+from twisted.python.threadpool import ThreadPool
+
+from constants import DEFAULT_FETCH_WORKERS, DEFAULT_DEADLINE_WORKERS, DEADLINE_LATENCY_BUCKETS
+
+
+class FetchPool(object):
+    """
+    A bounded pool of worker threads that reads registers from ClearBlade into the data blocks.
+    Each range of a data block has at most one fetch in flight, so repeated reads of a slow RTU join the fetch
+    already requested instead of queueing more, and reads of other slaves keep being served from memory.
+    """
+    def __init__(self, workers=DEFAULT_FETCH_WORKERS):
+        """
+        Initializes the pool, starting its threads once the reactor runs
+
+        :param int workers: the maximum number of concurrent ClearBlade fetches
+        """
+        self.workers = max(1, int(workers))
+        self.requested = 0
+        self.joined = 0
+        self.completed = 0
+        self.failed = 0
+        self._in_flight = {}
+        self._pool = ThreadPool(minthreads=0, maxthreads=self.workers, name='ClearBladeFetchPool')
+        reactor.callWhenRunning(self._start)
+
+    def _start(self):
+        """Starts the worker threads and stops them with the reactor"""
+        self._pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', self._pool.stop)
+
+    def fetch(self, block, address, count=1):
+        """
+        Requests registers of a data block from ClearBlade on a worker thread.
+        Must be called from the reactor thread; while the same range of the block has a fetch in flight
+        the request joins it instead of queueing another.
+
+        :param block: the CbModbusSequentialDataBlock or CbModbusSparseDataBlock to read into
+        :param int address: The starting address
+        :param int count: The number of values to retrieve
+        :returns: a Deferred firing with the number of registers read once the block is updated
+        :rtype: twisted.internet.defer.Deferred
+        """
+        self.requested += 1
+        d = Deferred()
+        key = (block, address, count)
+        waiting = self._in_flight.get(key, None)
+        if waiting is not None:
+            self.joined += 1
+            waiting.append(d)
+            return d
+        self._in_flight[key] = [d]
+        fetched = threads.deferToThreadPool(reactor, self._pool, block.fetch, address, count)
+        fetched.addBoth(self._done, key)
+        return d
+
+    def _done(self, result, key):
+        """Fires the deferreds waiting on a block fetch"""
+        block = key[0]
+        waiting = self._in_flight.pop(key, [])
+        if isinstance(result, Failure):
+            self.failed += 1
+            block.context.log.warning("Background fetch of {} registers for slave {} failed: {}"
+                                      .format(block.register_type, block.context.slave_id,
+                                              result.getErrorMessage()))
+            for d in waiting:
+                d.errback(result)
+        else:
+            self.completed += 1
+            for d in waiting:
+                d.callback(result)
+
+    def stats(self):
+        """
+        Returns the fetch counters
+
+        :rtype: dict
+        """
+        return {
+            'requested': self.requested,
+            'joined': self.joined,
+            'completed': self.completed,
+            'failed': self.failed,
+            'in_flight': len(self._in_flight),
+        }
+
+
+class DeadlineFetcher(object):
+    """
+    Runs the cache-miss fetches of direct read mode on worker threads, waiting for each at most the read deadline
+    of its slave context. A fetch that misses its deadline keeps running and updates the data block when it completes,
+    while the Modbus request is answered with the last-known values instead of timing out at the master.
+    Identical requests waiting on the same fetch (e.g. master retries) join it instead of queueing another.
+    The wait blocks the calling thread, so servers with a read deadline execute requests on the reactor thread pool
+    (see ``server.ThreadedModbusTcpProtocol``); a read on the running reactor thread falls back without waiting.
+    """
+    def __init__(self, workers=DEFAULT_DEADLINE_WORKERS, buckets=None):
+        """
+        Initializes the fetcher, whose threads start with its first fetch
+
+        :param int workers: the maximum number of concurrent ClearBlade fetches
+        :param list buckets: (optional) upper bounds in seconds of the fetch latency histogram
+        """
+        self.workers = max(1, int(workers))
+        self.buckets = sorted(buckets or DEADLINE_LATENCY_BUCKETS)
+        self.requested = 0
+        self.joined = 0
+        self.fresh = 0
+        self.fallbacks = 0
+        self.failed = 0
+        self.latencies = [0] * (len(self.buckets) + 1)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def fetch(self, block, address, count, deadline):
+        """
+        Requests registers of a data block from ClearBlade and waits for them until the deadline
+
+        :param block: the CbModbusSequentialDataBlock, CbModbusSegmentedDataBlock or CbModbusSparseDataBlock
+           to read into
+        :param int address: The starting address
+        :param int count: The number of values to retrieve
+        :param float deadline: the most seconds to wait for the fetch
+        :returns: True if the block was updated within the deadline, False if it holds the last-known values
+        :rtype: bool
+        """
+        key = (block, address, count)
+        with self._lock:
+            self.requested += 1
+            result = self._in_flight.get(key, None)
+            if result is None:
+                if self._pool is None:
+                    self._pool = WorkerPool(self.workers)
+                result = self._pool.apply_async(self._run, (key,))
+                self._in_flight[key] = result
+            else:
+                self.joined += 1
+        if reactor.running and isInIOThread():
+            # waiting would stall every connection served by the reactor
+            deadline = 0
+        result.wait(deadline)
+        fresh = result.ready() and result.successful()
+        with self._lock:
+            if fresh:
+                self.fresh += 1
+            else:
+                self.fallbacks += 1
+        if not fresh:
+            block.context.log.debug("Serving last-known {} registers {}:{} of slave {} after {}s read deadline"
+                                    .format(block.register_type, address, count, block.context.slave_id, deadline))
+        return fresh
+
+    def _run(self, key):
+        """Fetches the registers of a request on a worker thread, recording its latency"""
+        block, address, count = key
+        started = time.time()
+        try:
+            return block.fetch(address, count)
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            block.context.log.warning("Deadline fetch of {} registers for slave {} failed: {}"
+                                      .format(block.register_type, block.context.slave_id, e))
+            raise
+        finally:
+            latency = time.time() - started
+            with self._lock:
+                self.latencies[bisect_left(self.buckets, latency)] += 1
+                self._in_flight.pop(key, None)
+
+    def stats(self):
+        """
+        Returns the fetch counters, ``fallbacks`` counting the reads answered with last-known values,
+        and the fetch latency histogram as ``latency_le_<bound>s`` counters plus ``latency_gt_<last bound>s``
+
+        :rtype: dict
+        """
+        with self._lock:
+            totals = {
+                'requested': self.requested,
+                'joined': self.joined,
+                'fresh': self.fresh,
+                'fallbacks': self.fallbacks,
+                'failed': self.failed,
+                'in_flight': len(self._in_flight),
+            }
+            for bound, fetches in zip(self.buckets, self.latencies):
+                totals['latency_le_{}s'.format(bound)] = fetches
+            totals['latency_gt_{}s'.format(self.buckets[-1])] = self.latencies[-1]
+            return totals
@@ -0,0 +1,312 @@
+"""
+Durable write-behind of Modbus register writes.
+
+Writes are appended to a local journal file so a Modbus write can be acknowledged as soon as it is on disk,
+then a background flusher drains the journal to ClearBlade in batches, retrying with backoff.
+Entries not yet acknowledged by ClearBlade are replayed when the adapter restarts.
+Entries for slaves no longer served by the adapter, rejected by ClearBlade as invalid or still failing after
+a number of attempts are moved to a dead-letter file next to the journal.
+"""
+
+import json
+import os
+import threading
+
+from headless import is_logger, get_wrapping_logger
+from store import write_collection_batch
+from client import is_retryable
+from constants import *
+
+
+class WriteJournal(object):
+    """
+    An append-only journal of register writes stored as JSON lines.
+    Write entries are ``{"seq": n, "ip": ..., "slave_id": ..., "type": ..., "writes": {address: value}}``
+    and acknowledgements are ``{"ack": [n, ...]}``.
+    Entries that cannot be delivered are appended to ``<path>.dead`` in the same format and acknowledged.
+    """
+    def __init__(self, path, fsync=True, compact_bytes=DEFAULT_JOURNAL_COMPACT_BYTES):
+        """
+        Opens the journal, loading any entries not yet acknowledged
+
+        :param str path: the journal file path
+        :param bool fsync: forces each append to disk before returning
+        :param int compact_bytes: the file size above which a fully acknowledged journal is truncated
+        """
+        self.path = path
+        self.dead_letter_path = '{}.dead'.format(path)
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._seq = 0
+        self._load()
+        self._file = open(self.path, 'a')
+
+    def _load(self):
+        """
+        Reads the existing journal, truncating a torn final line from an interrupted append
+        so the next record starts on a line of its own
+        """
+        if not os.path.exists(self.path):
+            return
+        complete = 0
+        with open(self.path, 'rb+') as f:
+            for line in iter(f.readline, b''):
+                if not line.endswith(b'\n'):
+                    break
+                complete += len(line)
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+                if 'ack' in record:
+                    for seq in record['ack']:
+                        self._pending.pop(seq, None)
+                else:
+                    record['writes'] = dict((int(addr), value) for addr, value in record['writes'].items())
+                    self._pending[record['seq']] = record
+                    self._seq = max(self._seq, record['seq'])
+            if f.tell() > complete:
+                f.truncate(complete)
+
+    def _write(self, record):
+        """Appends a record to the journal file"""
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def append(self, ip_proxy, slave_id, register_type, writes):
+        """
+        Durably records register writes
+
+        :param str ip_proxy: the proxy IP address of the slave
+        :param int slave_id: the Modbus slave ID
+        :param str register_type: the type of register (co, hr)
+        :param dict writes: the data written in the format {address: value}
+        :returns: the sequence number of the entry
+        :rtype: int
+        """
+        with self._lock:
+            self._seq += 1
+            record = {'seq': self._seq, 'ip': ip_proxy, 'slave_id': slave_id, 'type': register_type,
+                      'writes': dict(writes)}
+            self._write(record)
+            self._pending[self._seq] = record
+            return self._seq
+
+    def pending(self, limit=None):
+        """
+        Returns entries not yet acknowledged, oldest first
+
+        :param int limit: (optional) the maximum number of entries
+        :rtype: list of dict
+        """
+        with self._lock:
+            seqs = sorted(self._pending)
+            if limit is not None:
+                seqs = seqs[0:limit]
+            return [self._pending[seq] for seq in seqs]
+
+    def ack(self, seqs):
+        """
+        Marks entries as written to ClearBlade, compacting the journal once nothing is pending
+
+        :param list seqs: the sequence numbers acknowledged
+        """
+        if len(seqs) == 0:
+            return
+        with self._lock:
+            self._write({'ack': list(seqs)})
+            for seq in seqs:
+                self._pending.pop(seq, None)
+            if len(self._pending) == 0 and self._file.tell() > self.compact_bytes:
+                self._file.seek(0)
+                self._file.truncate()
+
+    def dead_letter(self, entries):
+        """
+        Moves entries that cannot be delivered to the dead-letter file, acknowledging them in the journal
+
+        :param list entries: the journal entries
+        """
+        if len(entries) == 0:
+            return
+        with open(self.dead_letter_path, 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self.ack([entry['seq'] for entry in entries])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def close(self):
+        """Closes the journal file"""
+        with self._lock:
+            self._file.close()
+
+
+class WriteBehindFlusher(object):
+    """
+    Drains a WriteJournal to ClearBlade on a background thread.
+    Entries for the same slave and register type are merged (latest value per register wins)
+    and written with the fewest ClearBlade update calls.
+    """
+    def __init__(self, journal, server_contexts=None, **kwargs):
+        """
+        Initializes the flusher
+
+        :param WriteJournal journal: the journal to drain
+        :param list server_contexts: the ClearBladeModbusProxyServerContext instances whose writes are journaled
+        :param kwargs: optional log, interval (seconds between flushes), batch_size (entries per flush),
+           max_backoff (seconds), max_attempts (failed flushes of an entry before it is dead-lettered)
+        """
+        if is_logger(kwargs.get('log', None)):
+            self.log = kwargs.get('log')
+        else:
+            self.log = get_wrapping_logger(name='ClearBladeModbusWriteBehind',
+                                           debug=True if kwargs.get('debug', None) else False)
+        self.journal = journal
+        self.interval = float(kwargs.get('interval', DEFAULT_WRITE_BEHIND_INTERVAL))
+        self.batch_size = int(kwargs.get('batch_size', DEFAULT_WRITE_BEHIND_BATCH))
+        self.max_backoff = float(kwargs.get('max_backoff', DEFAULT_WRITE_BEHIND_MAX_BACKOFF))
+        self.max_attempts = int(kwargs.get('max_attempts', DEFAULT_WRITE_BEHIND_MAX_ATTEMPTS))
+        self.slaves = {}
+        self._attempts = {}
+        self.flushed = 0
+        self.updates = 0
+        self.dead_lettered = 0
+        self.retries = 0
+        self.backoff = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        for server_context in server_contexts or []:
+            self.register(server_context)
+
+    def register(self, server_context):
+        """
+        Adds the slave contexts of a server context as flush targets
+
+        :param ClearBladeModbusProxyServerContext server_context: the server context
+        """
+        for slave_id, slave in server_context:
+            self.slaves[(slave.ip_proxy, slave.slave_id)] = slave
+
+    def notify(self):
+        """Wakes the flusher after a new journal entry"""
+        self._wake.set()
+
+    def flush(self):
+        """
+        Writes a batch of pending journal entries to ClearBlade, acknowledging each slave's entries on success.
+        A failed slave and register type does not hold up the others; its entries stay pending for the next flush
+        unless ClearBlade rejected them as invalid or they have failed ``max_attempts`` times.
+        Those entries, and entries for slaves not registered with the flusher, are moved to the journal's
+        dead-letter file.
+
+        :returns: the number of entries flushed or dead-lettered
+        :rtype: int
+        """
+        entries = self.journal.pending(self.batch_size)
+        groups = {}
+        unknown = []
+        for entry in entries:
+            if (entry['ip'], entry['slave_id']) not in self.slaves:
+                unknown.append(entry)
+                continue
+            key = (entry['ip'], entry['slave_id'], entry['type'])
+            seqs, writes = groups.setdefault(key, ([], {}))
+            seqs.append(entry['seq'])
+            writes.update(entry['writes'])
+        if len(unknown) > 0:
+            self.log.warning("Moving {} journaled writes for unknown slaves to {}"
+                             .format(len(unknown), self.journal.dead_letter_path))
+            self.journal.dead_letter(unknown)
+            self.dead_lettered += len(unknown)
+        flushed = 0
+        dead = set()
+        failed = False
+        for (ip_proxy, slave_id, register_type), (seqs, writes) in sorted(groups.items()):
+            slave = self.slaves[(ip_proxy, slave_id)]
+            try:
+                self.updates += write_collection_batch(slave, register_type, writes)
+            except Exception as e:
+                self.log.error("Write-behind to ClearBlade failed for slave {} at {}: {}"
+                               .format(slave_id, ip_proxy, e))
+                failed = True
+                retryable = is_retryable(e)
+                for seq in seqs:
+                    self._attempts[seq] = self._attempts.get(seq, 0) + 1
+                    if not retryable or self._attempts[seq] >= self.max_attempts:
+                        dead.add(seq)
+                continue
+            self.journal.ack(seqs)
+            for seq in seqs:
+                self._attempts.pop(seq, None)
+            flushed += len(seqs)
+        if len(dead) > 0:
+            self.log.warning("Moving {} journaled writes ClearBlade did not accept to {}"
+                             .format(len(dead), self.journal.dead_letter_path))
+            self.journal.dead_letter([entry for entry in entries if entry['seq'] in dead])
+            for seq in dead:
+                self._attempts.pop(seq, None)
+            self.dead_lettered += len(dead)
+        self.flushed += flushed
+        if failed:
+            raise IOError("Write-behind flush incomplete")
+        return flushed + len(unknown) + len(dead)
+
+    def _run(self):
+        """The flusher thread loop, backing off exponentially while ClearBlade writes fail"""
+        while not self._stop.is_set():
+            self._wake.wait(self.backoff if self.backoff > 0 else self.interval)
+            self._wake.clear()
+            try:
+                while len(self.journal) > 0 and not self._stop.is_set():
+                    if self.flush() == 0:
+                        break
+                self.backoff = 0
+            except Exception:
+                self.retries += 1
+                self.backoff = min(self.max_backoff, max(self.interval, self.backoff * 2))
+                self.log.warning("Retrying {} journaled writes in {}s".format(len(self.journal), self.backoff))
+
+    def start(self):
+        """Starts the flusher thread, replaying any writes pending from a previous run"""
+        if self._thread is None:
+            pending = len(self.journal)
+            if pending > 0:
+                self.log.info("Replaying {} journaled writes to ClearBlade".format(pending))
+                self._wake.set()
+            self._thread = threading.Thread(target=self._run, name='WriteBehindFlusher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stops the flusher thread"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """
+        Returns the write-behind counters
+
+        :rtype: dict
+        """
+        return {
+            'pending': len(self.journal),
+            'flushed': self.flushed,
+            'updates': self.updates,
+            'dead_lettered': self.dead_lettered,
+            'retries': self.retries,
+            'backoff': self.backoff,
+        }
@@ -38,6 +38,7 @@ Register Types:
 
 __version__ = "0.1.0"
 
+import os
 import sys
 import argparse
 import subprocess
@@ -45,12 +46,30 @@ import time
 from clearblade.ClearBladeCore import System, Query
 from pymodbus.server.async import StartTcpServer
 from pymodbus.device import ModbusDeviceIdentification
-from twisted.internet import reactor
+from twisted.internet import reactor, task
 
 import headless
 from context import ClearBladeModbusProxyServerContext
+from refresh import BatchRefresher, AdaptiveRefresher, PriorityRefresher
+from journal import WriteJournal, WriteBehindFlusher
+from client import ClearBladeClient
+from fetch import FetchPool, DeadlineFetcher
+from server import listen_tcp, listen_tcp_dispatch, DispatchingModbusServerFactory
+from supervisor import Supervisor, shard_proxies, emit_worker_stats
+from shared import SharedRegisterTable
+from template import TemplateCache
+from startup import StartupPipeline
+from snapshot import RegisterSnapshot
 from constants import ADAPTER_DEVICE_ID, ADAPTER_CONFIG_COLLECTION, DEVICE_PROXY_CONFIG_COLLECTION, DATA_COLLECTION
-from constants import COL_PROXY_IP_ADDRESS, COL_PROXY_IP_PORT
+from constants import COL_PROXY_IP_ADDRESS, COL_PROXY_IP_PORT, DEFAULT_CACHE_SIZE, DEFAULT_REFRESH_INTERVAL
+from constants import DEFAULT_DELTA_OVERLAP
+from constants import READ_MODE_DIRECT, READ_MODE_PREFETCH, READ_MODE_BATCH, READ_MODE_ASYNC, READ_MODE_SHARED
+from constants import READ_MODE_ADAPTIVE, DEFAULT_ADAPTIVE_MIN_INTERVAL, DEFAULT_ADAPTIVE_MAX_INTERVAL
+from constants import READ_MODE_PRIORITY, DEFAULT_CRITICAL_INTERVAL, DEFAULT_REFRESH_BUDGET
+from constants import READ_MODES, DEFAULT_SNAPSHOT_INTERVAL
+from constants import DEFAULT_PAGE_SIZE, DEFAULT_HTTP_POOL_SIZE, DEFAULT_FETCH_WORKERS
+from constants import DEFAULT_READ_AHEAD, DEFAULT_READ_DEADLINE, DEFAULT_DEADLINE_WORKERS
+from constants import ENGINE_REACTOR, ENGINE_THREADS, ENGINES, DEFAULT_REACTOR_THREADS
 
 
 def get_parser():
@@ -99,6 +118,44 @@ def get_parser():
     parser.add_argument('--tcp', dest='tcp_port', default=502,
                         help="The local TCP Port the PyModbus server will listen on")
 
+    parser.add_argument('--engine', dest='engine', default=ENGINE_REACTOR, choices=ENGINES,
+                        help="'reactor' registers every proxy listener on one event loop with a fixed thread count, \
+                        'threads' starts each proxy server from its own thread.")
+
+    parser.add_argument('--wildcard', dest='wildcard', action='store_true',
+                        help="With the reactor engine, binds one listener on 0.0.0.0 per TCP port and dispatches \
+                        each connection to its proxy by destination IP address instead of one socket per alias. \
+                        Not available with --workers.")
+
+    parser.add_argument('--workers', dest='workers', default=0, type=int,
+                        help="Splits the proxies across this many worker processes, each with its own reactor, \
+                        under a supervisor that restarts crashed workers and aggregates their logs and statistics.")
+
+    parser.add_argument('--shard', dest='shard', default=None, type=int,
+                        help=argparse.SUPPRESS)
+
+    parser.add_argument('--sharedTable', dest='shared_table', default=None, metavar='PATH',
+                        help="Keeps register values in a shared memory table at PATH (e.g. under /dev/shm) \
+                        that one --tableRefresher process fills and every serving process reads. \
+                        With --workers the supervisor also runs the refresher.")
+
+    parser.add_argument('--tableRefresher', dest='table_refresher', action='store_true',
+                        help="Refreshes the --sharedTable from ClearBlade (prefetch, batch, adaptive or priority \
+                        read mode) \
+                        without serving Modbus.")
+
+    parser.add_argument('--snapshot', dest='snapshot', default=None, metavar='PATH',
+                        help="Periodically saves the register values to a memory-mapped file at PATH and \
+                        restores them at startup, so masters read last-known values until ClearBlade is reached. \
+                        Not used with --sharedTable, whose table already outlives the adapter.")
+
+    parser.add_argument('--snapshotInterval', dest='snapshot_interval', default=DEFAULT_SNAPSHOT_INTERVAL,
+                        type=float, help="The seconds between register snapshots.")
+
+    parser.add_argument('--templateCache', dest='template_cache', default=None, metavar='DIR',
+                        help="Compiles parsed config.dat templates into binary register maps in DIR, keyed by \
+                        a hash of their content, that restarts memory-map instead of parsing the templates.")
+
     parser.add_argument('--logLevel', dest='log_level', default='INFO',
                         choices=['INFO', 'DEBUG'],
                         help="The level of logging that will be utilized by the adapter.")
@@ -106,6 +163,89 @@ def get_parser():
     parser.add_argument('--heartbeat', dest='heartbeat', default=30,
                         help="The logging heartbeat interval in seconds.")
 
+    parser.add_argument('--cacheTtl', dest='cache_ttl', default=None,
+                        help="Seconds a register read from ClearBlade is served from memory, either a single value \
+                        or per register type e.g. hr=5,ir=60,di=10,co=10 (default no caching).")
+
+    parser.add_argument('--cacheSize', dest='cache_size', default=DEFAULT_CACHE_SIZE, type=int,
+                        help="The maximum number of registers held in the register cache of each slave.")
+
+    parser.add_argument('--readMode', dest='read_mode', default=READ_MODE_DIRECT, choices=READ_MODES,
+                        help="How register data is read from ClearBlade: 'direct' queries each Modbus request, \
+                        'prefetch' reads all registers of each slave in one query per refresh interval, \
+                        'batch' reads the registers of all slaves in one paged query per refresh interval, \
+                        'async' serves reads from memory and fetches cache misses on a background worker pool, \
+                        'shared' serves reads from the shared register table only (implied by --sharedTable), \
+                        'adaptive' reads each slave just after its RTU is expected to report, learning the \
+                        reporting interval of each RTU, \
+                        'priority' reads registers tagged refreshClass=critical in config.dat every \
+                        --criticalRefresh seconds and whole slaves every --refresh seconds.")
+
+    parser.add_argument('--refreshMin', dest='refresh_min', default=DEFAULT_ADAPTIVE_MIN_INTERVAL, type=float,
+                        help="The fewest seconds between refreshes of a slave in adaptive read mode.")
+
+    parser.add_argument('--refreshMax', dest='refresh_max', default=DEFAULT_ADAPTIVE_MAX_INTERVAL, type=float,
+                        help="The most seconds between refreshes of a slave in adaptive read mode.")
+
+    parser.add_argument('--criticalRefresh', dest='critical_interval', default=DEFAULT_CRITICAL_INTERVAL,
+                        type=float, help="The seconds between refreshes of critical registers in priority read mode.")
+
+    parser.add_argument('--criticalBudget', dest='critical_budget', default=DEFAULT_REFRESH_BUDGET, type=int,
+                        help="The most slaves whose critical registers are read per critical refresh \
+                        in priority read mode (0 is unlimited).")
+
+    parser.add_argument('--refreshBudget', dest='refresh_budget', default=DEFAULT_REFRESH_BUDGET, type=int,
+                        help="The most slaves read per whole-slave refresh in priority read mode (0 is unlimited).")
+
+    parser.add_argument('--readDeadline', dest='read_deadline', default=DEFAULT_READ_DEADLINE, type=float,
+                        help="The most seconds a Modbus read in direct read mode waits for ClearBlade before it is \
+                        answered with the last-known register values, the fetch completing in the background \
+                        (0 waits for ClearBlade). RTU rows may override it with a read_deadline column. \
+                        With the reactor engine, requests to proxies with a deadline execute on the reactor \
+                        thread pool; with the threads engine, reads missing the cache are answered at once with \
+                        last-known values.")
+
+    parser.add_argument('--deadlineWorkers', dest='deadline_workers', default=DEFAULT_DEADLINE_WORKERS, type=int,
+                        help="The maximum number of concurrent ClearBlade fetches of direct reads with a deadline.")
+
+    parser.add_argument('--fetchWorkers', dest='fetch_workers', default=DEFAULT_FETCH_WORKERS, type=int,
+                        help="The maximum number of concurrent ClearBlade fetches in async read mode.")
+
+    parser.add_argument('--readAhead', dest='read_ahead', default=DEFAULT_READ_AHEAD, type=int,
+                        help="Widens each cache-miss fetch to the whole configured block of its register type, \
+                        or forward to this many registers, so adjacent reads within the cache TTL are served \
+                        from memory (direct and async read modes, 0 disables).")
+
+    parser.add_argument('--refresh', dest='refresh_interval', default=DEFAULT_REFRESH_INTERVAL, type=float,
+                        help="The interval in seconds between background refreshes of register data.")
+
+    parser.add_argument('--deltaSync', dest='delta_sync', action='store_true',
+                        help="In prefetch and batch read modes only read data rows newer than the latest \
+                        timestamp already loaded for each slave. Requires data timestamps in a timestamp column, \
+                        as epoch numbers or as ISO 8601 strings.")
+
+    parser.add_argument('--deltaOverlap', dest='delta_overlap', default=DEFAULT_DELTA_OVERLAP, type=float,
+                        help="Seconds each delta sync read steps back before the latest timestamp already loaded, \
+                        so rows stored late with an older timestamp are still read.")
+
+    parser.add_argument('--writeWindow', dest='write_window', default=0, type=float,
+                        help="Seconds to hold Modbus writes so writes to neighbouring registers are merged \
+                        into fewer ClearBlade updates (default 0 sends each Modbus write as one batch).")
+
+    parser.add_argument('--writeBehind', dest='write_behind', default=None, metavar='JOURNAL',
+                        help="Acknowledge Modbus writes once appended to this local journal file and flush them \
+                        to ClearBlade in the background, replaying unflushed writes at startup.")
+
+    parser.add_argument('--httpPool', dest='http_pool', default=DEFAULT_HTTP_POOL_SIZE, type=int,
+                        help="The maximum number of keep-alive HTTP connections to ClearBlade shared by all slaves.")
+
+    parser.add_argument('--pageSize', dest='page_size', default=DEFAULT_PAGE_SIZE, type=int,
+                        help="The number of rows per page when reading whole ClearBlade collections.")
+
+    parser.add_argument('--batchAll', dest='batch_all', action='store_true',
+                        help="In batch read mode read the whole data collection rather than only the rows \
+                        of the proxy IP addresses served by this adapter.")
+
     # parser.add_argument('--messagingUrl', dest='messagingURL', default='localhost',
     #                     help="The MQTT URL of the ClearBlade Platform or Edge the adapter will connect to.")
     #
@@ -158,29 +298,44 @@ def get_adapter_config(cb_system, cb_auth, log):
     #     log.info("ClearBlade Adapter Config: {}".format(row))
 
 
-def _heartbeat(log, time_ref, interval=30):
+def _heartbeat(log, time_ref, interval=30, statistics=None):
     """
     Logs a heartbeat message intended to be show the service still running if no data is flowing from polling clients
 
     :param logging.Logger log: the service logger
     :param float time_ref: a time.time() reference for the first heartbeat
     :param int interval: seconds between heartbeat messages
+    :param list statistics: (optional) tuples of (label, callable) whose returned statistics are logged each heartbeat
     """
     if headless.is_logger(log):
         log.debug("Starting heartbeat ({}s)".format(interval))
         while True:
             if time.time() - time_ref >= interval:
-                log.debug("Heartbeat ({}s)".format(interval))
+                _log_heartbeat(log, interval, statistics)
                 time_ref = time.time()
             time.sleep(1)
 
 
+def _log_heartbeat(log, interval, statistics=None):
+    """
+    Logs a single heartbeat message with statistics, scheduled on the reactor by the reactor engine
+
+    :param logging.Logger log: the service logger
+    :param int interval: seconds between heartbeat messages
+    :param list statistics: (optional) tuples of (label, callable) whose returned statistics are logged
+    """
+    log.debug("Heartbeat ({}s)".format(interval))
+    for label, get_stats in statistics or []:
+        log.debug("{}: {}".format(label, get_stats()))
+
+
 def run_async_server():
     """
     The main loop instantiates one or more PyModbus servers mapped to ClearBlade Modbus proxies based on
     IP address and port defined in a ClearBlade platform Collection
     """
     log = None
+    write_behind = None
     virtual_ifs = []
     err_msg = None
     defer_reactor = False
@@ -188,6 +343,9 @@ def run_async_server():
     try:
         parser = get_parser()
         user_options = parser.parse_args()
+        if user_options.wildcard and user_options.workers > 0:
+            parser.error("--wildcard cannot be combined with --workers: every worker would bind the same 0.0.0.0 "
+                         "ports but only serves the proxies of its own shard")
         local_ip_address = user_options.ip_address
         local_tcp_port = user_options.tcp_port
         net_if = user_options.net_if
@@ -195,41 +353,125 @@ def run_async_server():
             _debug = True
         else:
             _debug = False
-        HEARTBEAT = user_options.heartbeat
+        HEARTBEAT = int(user_options.heartbeat)
 
         log = headless.get_wrapping_logger(name=ADAPTER_DEVICE_ID, debug=_debug)
         server_log = headless.get_wrapping_logger(name="pymodbus.server", debug=_debug)
 
+        if user_options.workers > 0 and user_options.shard is None and not user_options.table_refresher:
+            log.info("Supervising {} worker processes".format(user_options.workers))
+            command = [sys.executable, os.path.abspath(sys.argv[0])] + sys.argv[1:]
+            refresher = command + ['--tableRefresher'] if user_options.shared_table is not None else None
+            Supervisor(user_options.workers, command, log=log, heartbeat=HEARTBEAT, refresher=refresher).run()
+            return
+
+        startup = StartupPipeline()
+
+        read_mode = user_options.read_mode
+        shared_table = None
+        if user_options.shared_table is not None:
+            shared_table = SharedRegisterTable(user_options.shared_table)
+            if not user_options.table_refresher:
+                read_mode = READ_MODE_SHARED
+            elif read_mode not in (READ_MODE_PREFETCH, READ_MODE_BATCH, READ_MODE_ADAPTIVE, READ_MODE_PRIORITY):
+                read_mode = READ_MODE_BATCH
+            log.info("Using shared register table {} ({} slots) in {} mode"
+                     .format(user_options.shared_table, shared_table.slots, read_mode))
+
         log.info("Initializing ClearBlade System connection")
         cb_system = System(systemKey=user_options.systemKey, systemSecret=user_options.systemSecret, url=user_options.url)
         cb_auth = cb_system.Device(name=user_options.deviceName, key=user_options.deviceKey)
+        cb_client = ClearBladeClient(cb_system, cb_auth, pool_size=user_options.http_pool)
         cb_slave_config = user_options.slaves_collection
         cb_data = user_options.data_collection
 
+        if user_options.write_behind is not None:
+            journal_path = user_options.write_behind
+            if user_options.shard is not None:
+                journal_path = '{}.{}'.format(journal_path, user_options.shard)
+            log.info("Journaling Modbus writes to {}".format(journal_path))
+            write_behind = WriteBehindFlusher(WriteJournal(journal_path), log=log)
+
+        template_cache = TemplateCache(user_options.template_cache)
+
+        snapshot = None
+        if user_options.snapshot is not None:
+            if shared_table is not None:
+                log.warning("Ignoring --snapshot with --sharedTable")
+            else:
+                snapshot_path = user_options.snapshot
+                if user_options.shard is not None:
+                    snapshot_path = '{}.{}'.format(snapshot_path, user_options.shard)
+                log.info("Warm-starting register values from {}".format(snapshot_path))
+                snapshot = RegisterSnapshot(snapshot_path, log=log, interval=user_options.snapshot_interval)
+
+        fetch_pool = None
+        if read_mode == READ_MODE_ASYNC:
+            fetch_pool = FetchPool(workers=user_options.fetch_workers)
+        deadline_fetcher = None
+        if read_mode == READ_MODE_DIRECT:
+            deadline_fetcher = DeadlineFetcher(workers=user_options.deadline_workers)
+
         ip_proxies = []
         proxy_ports = []
-        ip_address = None
-        collection = cb_system.Collection(cb_auth, collectionName=cb_slave_config)
-        query = Query()
-        query.notEqualTo(COL_PROXY_IP_ADDRESS, '')
-        rows = collection.getItems(query)
-        for row in rows:
+        rtu_rows = startup.fetch(cb_client.collection(cb_slave_config), page_size=user_options.page_size)
+        for ip_address, rows in rtu_rows.items():
             # TODO: allow for possibility of multiple IPs with same port or same IP with multiple ports
-            ip_address = str(row[COL_PROXY_IP_ADDRESS])
-            tcp_port = int(row[COL_PROXY_IP_PORT])
-            if ip_address not in ip_proxies:
-                log.info("Found slave at {} on ClearBlade adapter config".format(ip_address))
-                ip_proxies.append(ip_address)
-                proxy_ports.append(tcp_port)
-            else:
+            log.info("Found slave at {} on ClearBlade adapter config".format(ip_address))
+            ip_proxies.append(ip_address)
+            proxy_ports.append(int(rows[0][COL_PROXY_IP_PORT]))
+            for row in rows[1:]:
                 log.warning("Duplicate proxy IP address {} found in configuration - ignoring".format(ip_address))
+        log.info("Read {} RTUs in {:.1f}s".format(startup.rtus, startup.fetch_seconds))
+
+        if user_options.shard is not None:
+            # Order the proxies identically in every worker so virtual interface aliases do not collide
+            shards = shard_proxies(ip_proxies, user_options.workers)
+            proxy_ports = [port for ip, port in sorted(zip(ip_proxies, proxy_ports))]
+            ip_proxies = sorted(ip_proxies)
+            log.info("Worker {} of {} serving {} proxies"
+                     .format(user_options.shard, user_options.workers,
+                             len([ip for ip in ip_proxies if shards[ip] == user_options.shard])))
 
         log.debug("Processing {} slaves".format(len(ip_proxies)))
-        for i in range(0, len(ip_proxies)):
+        server_contexts = []
+        dispatchers = {}
+        wildcard = user_options.wildcard and user_options.engine == ENGINE_REACTOR
+
+        def build_context(i):
             log.debug("Getting server context for {}".format(ip_proxies[i]))
-            context = ClearBladeModbusProxyServerContext(cb_system=cb_system, cb_auth=cb_auth,
-                                                         cb_slaves_config=cb_slave_config, cb_data=cb_data,
-                                                         ip_address=ip_proxies[i], log=log)
+            return ClearBladeModbusProxyServerContext(cb_system=cb_system, cb_auth=cb_auth,
+                                                      cb_slaves_config=cb_slave_config, cb_data=cb_data,
+                                                      ip_address=ip_proxies[i], log=log, client=cb_client,
+                                                      rows=rtu_rows[ip_proxies[i]],
+                                                      cache_ttl=user_options.cache_ttl,
+                                                      cache_size=user_options.cache_size,
+                                                      read_mode=read_mode,
+                                                      refresh_interval=user_options.refresh_interval,
+                                                      read_ahead=user_options.read_ahead,
+                                                      read_deadline=user_options.read_deadline,
+                                                      deadline_fetcher=deadline_fetcher,
+                                                      delta_sync=user_options.delta_sync,
+                                                      delta_overlap=user_options.delta_overlap,
+                                                      write_window=user_options.write_window,
+                                                      write_behind=write_behind,
+                                                      fetch_pool=fetch_pool,
+                                                      shared_table=shared_table,
+                                                      template_cache=template_cache)
+
+        serving = [i for i in range(0, len(ip_proxies))
+                   if user_options.shard is None or shards[ip_proxies[i]] == user_options.shard]
+        for i, context in startup.build(build_context, serving):
+            if snapshot is not None:
+                log.debug("Restored {} registers of {} from snapshot"
+                          .format(snapshot.restore(context), ip_proxies[i]))
+            context.start_prefetch()
+            if write_behind is not None:
+                write_behind.register(context)
+            server_contexts.append(context)
+            if user_options.table_refresher:
+                defer_reactor = True
+                continue
             # Create IP aliases
             local_ip_address = ip_proxies[i]
             ip_mask = '255.255.255.0'
@@ -254,27 +496,110 @@ def run_async_server():
             identity.ModelName = ip_proxies[i]
             identity.MajorMinorRevision = '1.0'
 
+            # Reads waiting on a read deadline are executed off the reactor thread
+            threaded = read_mode == READ_MODE_DIRECT and any([slave.read_deadline > 0 for slave_id, slave in context])
+
             # Setup Modbus TCP Server
-            log.info("Starting Modbus TCP server on {}:{}".format(local_ip_address, local_tcp_port))
-            modbus_server_args = {
-                'context': context,
-                'identity': identity,
-                'address': (local_ip_address, local_tcp_port),
-                # 'console': _debug,
-                'defer_reactor_run': True,
-            }
-            if modbus_server_args['defer_reactor_run']:
+            if wildcard:
+                if local_tcp_port not in dispatchers:
+                    dispatchers[local_tcp_port] = DispatchingModbusServerFactory(log=server_log)
+                dispatch_ip = '127.0.0.1' if local_ip_address == 'localhost' else local_ip_address
+                log.info("Dispatching Modbus TCP on port {} to {}".format(local_tcp_port, dispatch_ip))
+                dispatchers[local_tcp_port].add(dispatch_ip, context, identity, threaded=threaded)
                 defer_reactor = True
-            reactor.callInThread(StartTcpServer, **modbus_server_args)
+            elif user_options.engine == ENGINE_REACTOR:
+                log.info("Starting Modbus TCP server on {}:{}".format(local_ip_address, local_tcp_port))
+                listen_tcp(context, identity, (local_ip_address, local_tcp_port), threaded=threaded)
+                startup.listener_added()
+                defer_reactor = True
+            else:
+                log.info("Starting Modbus TCP server on {}:{}".format(local_ip_address, local_tcp_port))
+                modbus_server_args = {
+                    'context': context,
+                    'identity': identity,
+                    'address': (local_ip_address, local_tcp_port),
+                    # 'console': _debug,
+                    'defer_reactor_run': True,
+                }
+                if modbus_server_args['defer_reactor_run']:
+                    defer_reactor = True
+                reactor.callInThread(StartTcpServer, **modbus_server_args)
+                startup.listener_added()
 
             if local_ip_address == 'localhost':
                 log.info("Windows retricted environment prevents IP alias - running localhost for {}"
                          .format(ip_proxies[i]))
                 break
 
-        reactor.callInThread(_heartbeat, log, time.time(), HEARTBEAT)
-        if defer_reactor:
+        template_cache.save()
+        log.info("Parsed templates: {}".format(template_cache.stats()))
+
+        for tcp_port, dispatcher in sorted(dispatchers.items()):
+            log.info("Starting wildcard Modbus TCP server on 0.0.0.0:{} for {} proxies"
+                     .format(tcp_port, len(dispatcher.factories)))
+            listen_tcp_dispatch(dispatcher, tcp_port)
+            startup.listener_added()
+
+        log.info("Built {} server contexts in {:.1f}s, first listener registered after {}s"
+                 .format(startup.built, startup.build_seconds or 0, startup.first_listener))
+        reactor.callWhenRunning(startup.serving)
+        if snapshot is not None:
+            snapshot.reconcile()
+            snapshot.start()
+        statistics = [("Startup", startup.stats)]
+        statistics += [("Register cache {}".format(c.ip_address), c.cache_stats) for c in server_contexts]
+        statistics += [("Writes {}".format(c.ip_address), c.write_stats) for c in server_contexts]
+        statistics += [("Fetches {}".format(c.ip_address), c.fetch_stats) for c in server_contexts]
+        statistics.append(("ClearBlade connections", cb_client.stats))
+        statistics += [("Dispatch port {}".format(p), d.stats) for p, d in sorted(dispatchers.items())]
+        if shared_table is not None:
+            statistics.append(("Shared table", shared_table.stats))
+        if snapshot is not None:
+            statistics.append(("Snapshot", snapshot.stats))
+        if read_mode == READ_MODE_BATCH:
+            refresher = BatchRefresher(cb_system=cb_system, cb_auth=cb_auth, cb_data=cb_data,
+                                       server_contexts=server_contexts, log=log, client=cb_client,
+                                       interval=user_options.refresh_interval, page_size=user_options.page_size,
+                                       filter_ips=not user_options.batch_all)
+            refresher.start()
+            statistics.append(("Batch refresh", refresher.stats))
+        elif read_mode == READ_MODE_ADAPTIVE:
+            refresher = AdaptiveRefresher(server_contexts=server_contexts, log=log,
+                                          interval=user_options.refresh_interval,
+                                          min_interval=user_options.refresh_min,
+                                          max_interval=user_options.refresh_max)
+            refresher.start()
+            statistics.append(("Adaptive refresh", refresher.stats))
+        elif read_mode == READ_MODE_PRIORITY:
+            refresher = PriorityRefresher(server_contexts=server_contexts, log=log,
+                                          interval=user_options.refresh_interval,
+                                          budget=user_options.refresh_budget,
+                                          critical_interval=user_options.critical_interval,
+                                          critical_budget=user_options.critical_budget)
+            refresher.start()
+            statistics.append(("Priority refresh", refresher.stats))
+        if fetch_pool is not None:
+            statistics.append(("Background fetch", fetch_pool.stats))
+        if deadline_fetcher is not None:
+            statistics.append(("Deadline reads", deadline_fetcher.stats))
+        if write_behind is not None:
+            write_behind.start()
+            statistics.append(("Write-behind", write_behind.stats))
+
+        if user_options.shard is not None:
+            # The supervisor logs the statistics of all workers
+            task.LoopingCall(emit_worker_stats, statistics).start(HEARTBEAT, now=False)
+            defer_reactor = True
+        elif user_options.engine == ENGINE_REACTOR:
+            task.LoopingCall(_log_heartbeat, log, HEARTBEAT, statistics).start(HEARTBEAT, now=False)
+            log.debug("Starting heartbeat ({}s)".format(HEARTBEAT))
+        else:
+            reactor.callInThread(_heartbeat, log, time.time(), HEARTBEAT, statistics)
+        if user_options.engine == ENGINE_REACTOR:
+            reactor.suggestThreadPoolSize(DEFAULT_REACTOR_THREADS)
+        else:
             reactor.suggestThreadPoolSize(len(ip_proxies))
+        if defer_reactor:
             reactor.run()
 
     except KeyboardInterrupt:
@@ -296,6 +621,8 @@ def run_async_server():
     finally:
         if defer_reactor and reactor.running:
             reactor.stop()
+        if write_behind is not None:
+            write_behind.stop()
         for vif in virtual_ifs:
             debug_msg = "Taking down virtual interface {}".format(vif)
             if log is not None:
@@ -0,0 +1,494 @@
+"""
+Adapter-wide refresh of register data, fanning the rows of a single paged ClearBlade query
+out to every slave context behind the adapter, and per-slave refresh scheduled by each RTU's reporting cadence
+or by the refresh class of its registers.
+"""
+
+import threading
+import time
+
+from clearblade.ClearBladeCore import Query
+from twisted.internet import reactor, task, threads
+
+from headless import is_logger, get_wrapping_logger
+from store import iter_data_pages, chunk_queries, parse_timestamp
+from client import ClearBladeClient
+from constants import *
+
+
+class BatchRefresher(object):
+    """
+    Refreshes all slave contexts of one or more server contexts from the data collection.
+    Cloud calls scale with the number of pages of data rather than the number of RTUs and register types.
+    """
+    def __init__(self, cb_system, cb_auth, cb_data, server_contexts=None, **kwargs):
+        """
+        Initializes the refresher
+
+        :param clearblade.ClearBladeCore.System cb_system: a ClearBlade System
+        :param clearblade.ClearBladeCore.Device cb_auth: a ClearBlade authenticated Device
+        :param str cb_data: the name of the ClearBlade Collection holding data
+        :param list server_contexts: the ClearBladeModbusProxyServerContext instances to refresh
+        :param kwargs: optional log, client (a shared client.ClearBladeClient), interval (seconds), page_size,
+           filter_ips (False reads the whole collection) and query_groups (filter groups per query)
+        """
+        if is_logger(kwargs.get('log', None)):
+            self.log = kwargs.get('log')
+        else:
+            self.log = get_wrapping_logger(name='ClearBladeModbusBatchRefresher',
+                                           debug=True if kwargs.get('debug', None) else False)
+        self.cb_system = cb_system
+        self.cb_auth = cb_auth
+        self.cb_data = cb_data
+        self.client = kwargs.get('client', None) or ClearBladeClient(cb_system, cb_auth)
+        self.interval = float(kwargs.get('interval', DEFAULT_REFRESH_INTERVAL))
+        self.page_size = int(kwargs.get('page_size', DEFAULT_PAGE_SIZE))
+        self.filter_ips = kwargs.get('filter_ips', True)
+        self.query_groups = max(1, int(kwargs.get('query_groups', DEFAULT_QUERY_GROUPS)))
+        self.slaves = {}
+        self.refreshes = 0
+        self.queries = 0
+        self.pages = 0
+        self.rows = 0
+        self.unmatched_rows = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        for server_context in server_contexts or []:
+            self.register(server_context)
+
+    def register(self, server_context):
+        """
+        Adds the slave contexts of a server context to the refresh
+
+        :param ClearBladeModbusProxyServerContext server_context: the server context
+        """
+        with self._lock:
+            for slave_id, slave in server_context:
+                self.slaves[(slave.ip_proxy, slave.slave_id)] = slave
+
+    def _build_queries(self):
+        """
+        Builds the data collection queries, restricted to the proxy IP addresses of the registered slaves
+        unless ``filter_ips`` is False.
+        Slaves in delta sync mode only request rows at or after their high-water-mark timestamp.
+        The filter groups of the slaves are split across queries of at most ``query_groups`` groups each
+        (see ``store.chunk_queries``), every query read by keyset pagination (see ``store.iter_data_pages``).
+
+        :rtype: list of clearblade.ClearBladeCore.Query
+        """
+        if not self.filter_ips:
+            query = Query()
+            slaves = self.slaves.values()
+            if len(slaves) > 0 and all([slave.delta_sync and slave.high_water_mark is not None for slave in slaves]):
+                oldest = min(slaves, key=lambda slave: slave.high_water_epoch)
+                query.greaterThanEqualTo(COL_DATA_TIMESTAMP, oldest.high_water_mark)
+            return [query]
+        groups = []
+        full_ips = set([key[0] for key, slave in self.slaves.items() if slave.high_water_mark is None
+                        or not slave.delta_sync])
+        for ip_address in sorted(full_ips):
+            ip_query = Query()
+            ip_query.equalTo(COL_PROXY_IP_ADDRESS, ip_address)
+            groups.append(ip_query)
+        for (ip_address, slave_id), slave in sorted(self.slaves.items()):
+            if ip_address not in full_ips:
+                slave_query = Query()
+                slave_query.equalTo(COL_PROXY_IP_ADDRESS, ip_address)
+                slave_query.equalTo(COL_SLAVE_ID, slave_id)
+                slave_query.greaterThanEqualTo(COL_DATA_TIMESTAMP, slave.high_water_mark)
+                groups.append(slave_query)
+        return chunk_queries(groups, self.query_groups)
+
+    def refresh(self):
+        """
+        Reads the data collection page by page, query by query, and loads each page into the matching slave contexts.
+        The delta sync high-water marks of the slaves only advance once every query has been read.
+
+        :returns: the number of registers loaded
+        :rtype: int
+        """
+        collection = self.client.collection(self.cb_data)
+        loaded = 0
+        pages = 0
+        rows = 0
+        unmatched = 0
+        queries = self._build_queries()
+        for query in queries:
+            for page in iter_data_pages(collection, query, self.page_size):
+                pages += 1
+                rows += len(page)
+                by_slave = {}
+                for row in page:
+                    key = (str(row[COL_PROXY_IP_ADDRESS]), int(row[COL_SLAVE_ID]))
+                    by_slave.setdefault(key, []).append(row)
+                for key, slave_rows in by_slave.items():
+                    slave = self.slaves.get(key, None)
+                    if slave is None:
+                        unmatched += len(slave_rows)
+                        continue
+                    loaded += slave.load_rows(slave_rows)
+        with self._lock:
+            slaves = list(self.slaves.values())
+        for slave in slaves:
+            slave.commit_high_water_mark()
+        with self._lock:
+            self.refreshes += 1
+            self.queries += len(queries)
+            self.pages += pages
+            self.rows += rows
+            self.unmatched_rows += unmatched
+        self.log.debug("Batch refresh loaded {} registers for {} slaves from {} rows in {} pages"
+                       .format(loaded, len(self.slaves), rows, pages))
+        return loaded
+
+    def _refresh_in_thread(self):
+        """Runs a refresh on the reactor thread pool, logging failures so the schedule keeps running"""
+        d = threads.deferToThread(self.refresh)
+        d.addErrback(lambda failure: self.log.error("Batch refresh failed: {}".format(failure.getErrorMessage())))
+        return d
+
+    def start(self):
+        """Schedules the periodic refresh, starting once the reactor runs"""
+        if self._loop is None:
+            self._loop = task.LoopingCall(self._refresh_in_thread)
+            reactor.callWhenRunning(self._loop.start, self.interval, now=True)
+
+    def stop(self):
+        """Stops the periodic refresh"""
+        if self._loop is not None:
+            if self._loop.running:
+                self._loop.stop()
+            self._loop = None
+
+    def stats(self):
+        """
+        Returns the refresh counters
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'slaves': len(self.slaves),
+                'refreshes': self.refreshes,
+                'queries': self.queries,
+                'pages': self.pages,
+                'rows': self.rows,
+                'unmatched_rows': self.unmatched_rows,
+            }
+
+
+class ReportCadence(object):
+    """
+    The learned reporting interval of an RTU, an exponentially weighted average of the time between
+    successive new field timestamps
+    """
+    def __init__(self, smoothing=DEFAULT_CADENCE_SMOOTHING):
+        """
+        :param float smoothing: the weight of the latest interval in the average (0..1)
+        """
+        self.smoothing = float(smoothing)
+        self.last_report = None
+        self.interval = None
+        self.samples = 0
+
+    def observe(self, epoch):
+        """
+        Records the newest field timestamp seen for the RTU
+
+        :param float epoch: the timestamp in seconds since the epoch, or None if unknown
+        :returns: True if the timestamp is newer than the last report
+        :rtype: bool
+        """
+        if epoch is None or (self.last_report is not None and epoch <= self.last_report):
+            return False
+        if self.last_report is not None:
+            delta = epoch - self.last_report
+            if self.interval is None:
+                self.interval = delta
+            else:
+                self.interval = self.smoothing * delta + (1 - self.smoothing) * self.interval
+            self.samples += 1
+        self.last_report = epoch
+        return True
+
+    def expected(self):
+        """
+        Returns when the next report is expected, or None until an interval has been learned
+
+        :rtype: float or None
+        """
+        if self.interval is None:
+            return None
+        return self.last_report + self.interval
+
+
+class AdaptiveRefresher(object):
+    """
+    Refreshes each slave context just after its RTU is expected to have reported new data to ClearBlade,
+    learning the reporting interval of each RTU from its ``last_report_time`` and the timestamps of its data rows.
+    Cloud queries follow the rate at which field data changes rather than the rate at which masters poll.
+    """
+    def __init__(self, server_contexts=None, **kwargs):
+        """
+        Initializes the refresher
+
+        :param list server_contexts: the ClearBladeModbusProxyServerContext instances to refresh
+        :param kwargs: optional log, interval (seconds between refreshes until a cadence is learned),
+           min_interval and max_interval (bounds of the seconds between refreshes of a slave),
+           margin (seconds after an expected report before refreshing)
+        """
+        if is_logger(kwargs.get('log', None)):
+            self.log = kwargs.get('log')
+        else:
+            self.log = get_wrapping_logger(name='ClearBladeModbusAdaptiveRefresher',
+                                           debug=True if kwargs.get('debug', None) else False)
+        self.interval = float(kwargs.get('interval', DEFAULT_REFRESH_INTERVAL))
+        self.min_interval = float(kwargs.get('min_interval', DEFAULT_ADAPTIVE_MIN_INTERVAL))
+        self.max_interval = float(kwargs.get('max_interval', DEFAULT_ADAPTIVE_MAX_INTERVAL))
+        self.margin = float(kwargs.get('margin', DEFAULT_ADAPTIVE_MARGIN))
+        self.slaves = {}
+        self.refreshes = 0
+        self.new_data = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._running = False
+        for server_context in server_contexts or []:
+            self.register(server_context)
+
+    def register(self, server_context):
+        """
+        Adds the slave contexts of a server context to the refresh, seeding their cadence with ``last_report_time``
+
+        :param ClearBladeModbusProxyServerContext server_context: the server context
+        """
+        with self._lock:
+            for slave_id, slave in server_context:
+                cadence = ReportCadence()
+                cadence.observe(parse_timestamp(slave.last_report_time))
+                self.slaves[(slave.ip_proxy, slave.slave_id)] = (slave, cadence)
+        if self._running:
+            reactor.callFromThread(self._schedule_all)
+
+    def next_delay(self, cadence, now=None):
+        """
+        Returns the seconds until a slave should next be refreshed: just after its next expected report,
+        or a quarter of its interval if the report is overdue, bounded by ``min_interval`` and ``max_interval``
+
+        :param ReportCadence cadence: the learned cadence of the slave
+        :param float now: (optional) the current time in seconds since the epoch
+        :rtype: float
+        """
+        expected = cadence.expected()
+        if expected is None:
+            delay = self.interval
+        else:
+            delay = expected + self.margin - (now if now is not None else time.time())
+            if delay <= 0:
+                delay = cadence.interval / 4
+        return min(self.max_interval, max(self.min_interval, delay))
+
+    def refresh(self, key):
+        """
+        Refreshes a slave context and learns from the newest field timestamp loaded
+
+        :param tuple key: the (ip_proxy, slave_id) of the slave
+        :returns: True if the RTU reported new data since the previous refresh
+        :rtype: bool
+        """
+        slave, cadence = self.slaves[key]
+        slave.refresh()
+        with self._lock:
+            updated = cadence.observe(slave.high_water_epoch)
+            self.refreshes += 1
+            if updated:
+                self.new_data += 1
+        return updated
+
+    def _refresh_in_thread(self, key):
+        """Runs a refresh of a slave on the reactor thread pool, then schedules its next refresh"""
+        self._calls.pop(key, None)
+        d = threads.deferToThread(self.refresh, key)
+
+        def _failed(failure):
+            self.failures += 1
+            self.log.error("Adaptive refresh of slave {} at {} failed: {}"
+                           .format(key[1], key[0], failure.getErrorMessage()))
+
+        d.addErrback(_failed)
+        d.addBoth(lambda result: self._schedule(key))
+        return d
+
+    def _schedule(self, key, delay=None):
+        """Schedules the next refresh of a slave on the reactor"""
+        if not self._running or key in self._calls:
+            return
+        if delay is None:
+            delay = self.next_delay(self.slaves[key][1])
+        self._calls[key] = reactor.callLater(delay, self._refresh_in_thread, key)
+
+    def _schedule_all(self):
+        """Refreshes every slave not yet scheduled"""
+        for key in list(self.slaves):
+            self._schedule(key, delay=0)
+
+    def start(self):
+        """Starts refreshing every slave once the reactor runs"""
+        if not self._running:
+            self._running = True
+            reactor.callWhenRunning(self._schedule_all)
+
+    def stop(self):
+        """Cancels the scheduled refreshes"""
+        self._running = False
+        for call in self._calls.values():
+            if call.active():
+                call.cancel()
+        self._calls = {}
+
+    def stats(self):
+        """
+        Returns the refresh counters and the mean learned reporting interval in seconds
+
+        :rtype: dict
+        """
+        with self._lock:
+            learned = [cadence.interval for slave, cadence in self.slaves.values() if cadence.interval is not None]
+            return {
+                'slaves': len(self.slaves),
+                'learned': len(learned),
+                'mean_interval': sum(learned) / len(learned) if len(learned) > 0 else None,
+                'refreshes': self.refreshes,
+                'new_data': self.new_data,
+                'failures': self.failures,
+            }
+
+
+class PriorityRefresher(object):
+    """
+    Refreshes the registers tagged ``refreshClass=critical`` in each slave's template on a short interval,
+    and whole slaves on the regular interval, each refresh class with its own budget of ClearBlade queries per round.
+    Slaves left over by a budget are refreshed first in the next round, so under a constrained cloud quota
+    critical registers keep their interval while bulk data slows down.
+    """
+    def __init__(self, server_contexts=None, **kwargs):
+        """
+        Initializes the refresher
+
+        :param list server_contexts: the ClearBladeModbusProxyServerContext instances to refresh
+        :param kwargs: optional log, interval and budget (seconds between and slaves per whole-slave round),
+           critical_interval and critical_budget (seconds between and slaves per critical register round),
+           a budget of 0 refreshing every slave each round
+        """
+        if is_logger(kwargs.get('log', None)):
+            self.log = kwargs.get('log')
+        else:
+            self.log = get_wrapping_logger(name='ClearBladeModbusPriorityRefresher',
+                                           debug=True if kwargs.get('debug', None) else False)
+        self.classes = {
+            REFRESH_CLASS_BULK: {
+                'interval': float(kwargs.get('interval', DEFAULT_REFRESH_INTERVAL)),
+                'budget': int(kwargs.get('budget', DEFAULT_REFRESH_BUDGET)),
+            },
+            REFRESH_CLASS_CRITICAL: {
+                'interval': float(kwargs.get('critical_interval', DEFAULT_CRITICAL_INTERVAL)),
+                'budget': int(kwargs.get('critical_budget', DEFAULT_REFRESH_BUDGET)),
+            },
+        }
+        for schedule in self.classes.values():
+            schedule.update({'slaves': [], 'cursor': 0, 'rounds': 0, 'refreshes': 0, 'deferred': 0, 'failures': 0,
+                             'loop': None})
+        self._lock = threading.Lock()
+        for server_context in server_contexts or []:
+            self.register(server_context)
+
+    def register(self, server_context):
+        """
+        Adds the slave contexts of a server context to the refresh, and to the critical refresh if they have
+        critical registers
+
+        :param ClearBladeModbusProxyServerContext server_context: the server context
+        """
+        with self._lock:
+            for slave_id, slave in server_context:
+                self.classes[REFRESH_CLASS_BULK]['slaves'].append(slave)
+                if len(slave.critical) > 0:
+                    self.classes[REFRESH_CLASS_CRITICAL]['slaves'].append(slave)
+
+    def _next_slaves(self, refresh_class):
+        """Returns the slaves of a refresh class within its budget, continuing from the previous round"""
+        schedule = self.classes[refresh_class]
+        with self._lock:
+            slaves = schedule['slaves']
+            budget = schedule['budget']
+            if budget <= 0 or budget >= len(slaves):
+                return list(slaves)
+            start = schedule['cursor'] % len(slaves)
+            schedule['cursor'] = start + budget
+            schedule['deferred'] += len(slaves) - budget
+            return (slaves[start:] + slaves[:start])[0:budget]
+
+    def refresh(self, refresh_class):
+        """
+        Runs one round of a refresh class
+
+        :param str refresh_class: 'critical' reads the critical registers of each slave, 'bulk' whole slaves
+        :returns: the number of registers loaded
+        :rtype: int
+        """
+        schedule = self.classes[refresh_class]
+        loaded = 0
+        refreshed = 0
+        failures = 0
+        for slave in self._next_slaves(refresh_class):
+            try:
+                if refresh_class == REFRESH_CLASS_CRITICAL:
+                    loaded += slave.refresh_critical()
+                else:
+                    loaded += slave.refresh()
+                refreshed += 1
+            except Exception as e:
+                failures += 1
+                self.log.error("{} refresh of slave {} at {} failed: {}"
+                               .format(refresh_class, slave.slave_id, slave.ip_proxy, e))
+        with self._lock:
+            schedule['rounds'] += 1
+            schedule['refreshes'] += refreshed
+            schedule['failures'] += failures
+        return loaded
+
+    def _refresh_in_thread(self, refresh_class):
+        """Runs one round of a refresh class off the reactor thread"""
+        d = threads.deferToThread(self.refresh, refresh_class)
+        d.addErrback(lambda failure: self.log.error("{} refresh failed: {}"
+                                                    .format(refresh_class, failure.getErrorMessage())))
+        return d
+
+    def start(self):
+        """Schedules the rounds of each refresh class that has slaves, starting once the reactor runs"""
+        for refresh_class, schedule in self.classes.items():
+            if schedule['loop'] is None and len(schedule['slaves']) > 0:
+                schedule['loop'] = task.LoopingCall(self._refresh_in_thread, refresh_class)
+                reactor.callWhenRunning(schedule['loop'].start, schedule['interval'], now=True)
+
+    def stop(self):
+        """Stops the rounds of every refresh class"""
+        for schedule in self.classes.values():
+            if schedule['loop'] is not None:
+                if schedule['loop'].running:
+                    schedule['loop'].stop()
+                schedule['loop'] = None
+
+    def stats(self):
+        """
+        Returns the counters of each refresh class, where ``deferred`` counts slaves held over by its budget
+
+        :rtype: dict
+        """
+        with self._lock:
+            totals = {}
+            for refresh_class, schedule in self.classes.items():
+                for key in ('rounds', 'refreshes', 'deferred', 'failures'):
+                    totals['{}_{}'.format(refresh_class, key)] = schedule[key]
+                totals['{}_slaves'.format(refresh_class)] = len(schedule['slaves'])
+            return totals
@@ -0,0 +1,166 @@
+"""
+Modbus TCP listeners for the proxy server contexts, registered directly on the Twisted reactor
+so any number of proxy addresses is served by one event loop with a constant number of threads.
+Optionally a single wildcard listener per port dispatches connections by destination address.
+Server contexts whose reads may wait on a read deadline execute their requests on the reactor thread pool,
+so the wait never stalls the other connections.
+"""
+
+from pymodbus.server.async import ModbusServerFactory, ModbusTcpProtocol
+from pymodbus.exceptions import NoSuchSlaveException
+from pymodbus.pdu import ModbusExceptions
+from pymodbus.transaction import ModbusSocketFramer
+from twisted.internet import defer, reactor, threads
+from twisted.internet.protocol import ServerFactory
+
+from headless import is_logger, get_wrapping_logger
+
+
+class ThreadedModbusTcpProtocol(ModbusTcpProtocol):
+    """
+    A Modbus TCP protocol that executes the requests of a threaded factory on the reactor thread pool,
+    sending the responses of each connection in request order
+    """
+    def _execute(self, request):
+        """Executes the request, off the reactor thread if the factory is threaded"""
+        if not getattr(self.factory, 'threaded', False):
+            return ModbusTcpProtocol._execute(self, request)
+        previous = getattr(self, '_executing', None) or defer.succeed(None)
+        d = previous.addCallback(lambda ignored: threads.deferToThread(self._respond, request))
+        d.addCallback(lambda response: self._send(response) if response is not None else None)
+        d.addErrback(lambda failure: self.factory.store.log.error("Unable to execute Modbus request: {}"
+                                                                  .format(failure.getErrorMessage())))
+        self._executing = d
+
+    def _respond(self, request):
+        """Returns the response to a request as ``ModbusTcpProtocol._execute`` would send it, or None for none"""
+        try:
+            context = self.factory.store[request.unit_id]
+            response = request.execute(context)
+        except NoSuchSlaveException:
+            if self.factory.ignore_missing_slaves:
+                return None
+            response = request.doException(ModbusExceptions.GatewayNoResponse)
+        except Exception as e:
+            self.factory.store.log.debug("Datastore unable to fulfill request: {}".format(e))
+            response = request.doException(ModbusExceptions.SlaveFailure)
+        response.transaction_id = request.transaction_id
+        response.unit_id = request.unit_id
+        return response
+
+
+def _server_factory(context, identity, threaded=False):
+    """Returns the ModbusServerFactory of a server context, executing requests on the thread pool if threaded"""
+    factory = ModbusServerFactory(context, ModbusSocketFramer, identity)
+    if threaded:
+        factory.protocol = ThreadedModbusTcpProtocol
+        factory.threaded = True
+    return factory
+
+
+def listen_tcp(context, identity, address, threaded=False):
+    """
+    Registers a Modbus TCP endpoint on the reactor, bound to its own server context.
+    Must be called from the reactor thread (or before the reactor runs).
+
+    :param context.ClearBladeModbusProxyServerContext context: the server context answering requests
+    :param pymodbus.device.ModbusDeviceIdentification identity: the server identification
+    :param tuple address: the (ip_address, tcp_port) to listen on
+    :param bool threaded: executes requests on the reactor thread pool, for reads that wait on a read deadline
+    :returns: the listening port
+    :rtype: twisted.internet.interfaces.IListeningPort
+    """
+    factory = _server_factory(context, identity, threaded)
+    return reactor.listenTCP(int(address[1]), factory, interface=address[0])
+
+
+class DispatchingModbusTcpProtocol(ThreadedModbusTcpProtocol):
+    """
+    A Modbus TCP protocol for a wildcard listener that binds each accepted connection to the server context
+    of the proxy address the master connected to
+    """
+    def connectionMade(self):
+        """Selects the per-address factory from the connection's local (destination) address"""
+        host = self.transport.getHost().host
+        factory = self.factory.lookup(host)
+        if factory is None:
+            self.framer = None
+            self.transport.abortConnection()
+            return
+        self.factory = factory
+        ModbusTcpProtocol.connectionMade(self)
+
+    def dataReceived(self, data):
+        """Ignores data on connections to addresses that are not proxied"""
+        if self.framer is not None:
+            ModbusTcpProtocol.dataReceived(self, data)
+
+
+class DispatchingModbusServerFactory(ServerFactory):
+    """
+    A single listening factory shared by many proxy addresses, holding an O(1) table
+    of ``{ip_address: ModbusServerFactory}`` built from the ``ModbusProxyRtus`` rows
+    """
+    protocol = DispatchingModbusTcpProtocol
+
+    def __init__(self, **kwargs):
+        """
+        Initializes an empty dispatch table
+
+        :param kwargs: optional log
+        """
+        if is_logger(kwargs.get('log', None)):
+            self.log = kwargs.get('log')
+        else:
+            self.log = get_wrapping_logger(name='ClearBladeModbusDispatcher',
+                                           debug=True if kwargs.get('debug', None) else False)
+        self.factories = {}
+        self.unmatched = 0
+
+    def add(self, ip_address, context, identity, threaded=False):
+        """
+        Adds a proxy address to the dispatch table
+
+        :param str ip_address: the proxy IP address masters connect to
+        :param context.ClearBladeModbusProxyServerContext context: the server context answering requests
+        :param pymodbus.device.ModbusDeviceIdentification identity: the server identification
+        :param bool threaded: executes requests on the reactor thread pool, for reads that wait on a read deadline
+        """
+        self.factories[ip_address] = _server_factory(context, identity, threaded)
+
+    def lookup(self, ip_address):
+        """
+        Returns the factory of a proxy address
+
+        :param str ip_address: the local address of an accepted connection
+        :rtype: pymodbus.server.async.ModbusServerFactory or None
+        """
+        factory = self.factories.get(ip_address, None)
+        if factory is None:
+            self.unmatched += 1
+            self.log.warning("Rejecting Modbus connection to {} which is not a proxy address".format(ip_address))
+        return factory
+
+    def stats(self):
+        """
+        Returns the dispatch counters
+
+        :rtype: dict
+        """
+        return {
+            'addresses': len(self.factories),
+            'unmatched': self.unmatched,
+        }
+
+
+def listen_tcp_dispatch(factory, port, interface='0.0.0.0'):
+    """
+    Registers a single wildcard Modbus TCP endpoint on the reactor that dispatches by destination address
+
+    :param DispatchingModbusServerFactory factory: the dispatch table
+    :param int port: the TCP port shared by the proxy addresses
+    :param str interface: the address to bind, by default all IPv4 interfaces
+    :returns: the listening port
+    :rtype: twisted.internet.interfaces.IListeningPort
+    """
+    return reactor.listenTCP(int(port), factory, interface=interface)
@@ -0,0 +1,249 @@
+"""
+A register table in shared memory, so several adapter processes serving the same RTUs hold one copy of the
+register values and only one of them refreshes it from ClearBlade.
+
+The table is a memory-mapped file holding a fixed number of slots in an open-addressing hash table keyed by
+(ip_proxy, slave_id, register_type, address). Each slot has a fixed-width 16-bit value and an epoch timestamp.
+Slots are claimed when the data blocks are set up and never removed, so each process resolves a register to
+its slot once and then reads and writes it in place.
+"""
+
+import collections
+import mmap
+import os
+import socket
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from store import parse_timestamp
+from constants import REGISTER_TYPES, DEFAULT_SHARED_TABLE_SLOTS
+
+_HEADER = struct.Struct('<4sII')
+_MAGIC = b'CBRT'
+_VERSION = 2
+#: slot layout: ip(4) slave_id register_type address(4, template addresses reach 99999) value state pad timestamp
+_SLOT = struct.Struct('<4sBBIHB3xd')
+_KEY = struct.Struct('<4sBBI')
+_VALUE = struct.Struct('<H')
+_TIMESTAMP = struct.Struct('<d')
+_VALUE_OFFSET = 10
+_STATE_OFFSET = 12
+_TIMESTAMP_OFFSET = 16
+_SLOT_USED = 1
+
+
+def _pack_ip(ip_proxy):
+    """Returns the 4 byte key of a proxy address, hashing names that are not IPv4 addresses"""
+    try:
+        return socket.inet_aton(ip_proxy)
+    except (socket.error, TypeError):
+        return struct.pack('<I', zlib.crc32(str(ip_proxy).encode('utf-8')) & 0xffffffff)
+
+
+class SharedRegisterTable(object):
+    """
+    A fixed-capacity register table stored in a memory-mapped file shared between processes.
+    Values are unsigned 16-bit and timestamps are seconds since the epoch (0 when unknown).
+    """
+    def __init__(self, path, slots=DEFAULT_SHARED_TABLE_SLOTS):
+        """
+        Maps the table file, initializing it if it does not exist or has a different layout
+
+        :param str path: the table file, ideally on a memory filesystem such as /dev/shm
+        :param int slots: the number of registers the table can hold when it is created
+        """
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._thread_lock = threading.Lock()
+        self._lock()
+        try:
+            size = os.fstat(self._fd).st_size
+            header = os.read(self._fd, _HEADER.size) if size >= _HEADER.size else b''
+            if len(header) == _HEADER.size and _HEADER.unpack(header)[0:2] == (_MAGIC, _VERSION):
+                self.slots = _HEADER.unpack(header)[2]
+            else:
+                self.slots = int(slots)
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, _HEADER.size + self.slots * _SLOT.size)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, _HEADER.pack(_MAGIC, _VERSION, self.slots))
+            self._map = mmap.mmap(self._fd, _HEADER.size + self.slots * _SLOT.size)
+        finally:
+            self._unlock()
+        self.used = 0
+
+    def _lock(self):
+        """Serializes slot claims and initialization between processes, and between the threads of this process"""
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def slot(self, ip_proxy, slave_id, register_type, address):
+        """
+        Returns the offset of a register's slot, claiming an empty slot if the register is new
+
+        :param str ip_proxy: the proxy IP address of the slave
+        :param int slave_id: the Modbus slave ID
+        :param str register_type: the type of register ('co', 'di', 'hr', 'ir')
+        :param int address: the register address
+        :returns: the byte offset of the slot in the table
+        :rtype: int
+        """
+        key = _KEY.pack(_pack_ip(ip_proxy), slave_id, REGISTER_TYPES.index(register_type), address)
+        index = (zlib.crc32(key) & 0xffffffff) % self.slots
+        self._lock()
+        try:
+            for probe in range(0, self.slots):
+                offset = _HEADER.size + ((index + probe) % self.slots) * _SLOT.size
+                if ord(self._map[offset + _STATE_OFFSET:offset + _STATE_OFFSET + 1]) != _SLOT_USED:
+                    self._map[offset:offset + _SLOT.size] = _SLOT.pack(key[0:4], slave_id,
+                                                                       REGISTER_TYPES.index(register_type),
+                                                                       address, 0, _SLOT_USED, 0.0)
+                    self.used += 1
+                    return offset
+                if self._map[offset:offset + _KEY.size] == key:
+                    return offset
+        finally:
+            self._unlock()
+        raise IOError("Shared register table {} is full ({} slots)".format(self.path, self.slots))
+
+    def get_value(self, offset):
+        """Returns the value in a slot"""
+        return _VALUE.unpack_from(self._map, offset + _VALUE_OFFSET)[0]
+
+    def set_value(self, offset, value):
+        """Stores a value in a slot"""
+        _VALUE.pack_into(self._map, offset + _VALUE_OFFSET, int(value) & 0xffff)
+
+    def get_timestamp(self, offset):
+        """Returns the epoch timestamp in a slot, or None if unknown"""
+        timestamp = _TIMESTAMP.unpack_from(self._map, offset + _TIMESTAMP_OFFSET)[0]
+        return timestamp if timestamp > 0 else None
+
+    def set_timestamp(self, offset, timestamp):
+        """Stores a ClearBlade or epoch timestamp in a slot"""
+        epoch = parse_timestamp(timestamp)
+        _TIMESTAMP.pack_into(self._map, offset + _TIMESTAMP_OFFSET, epoch if epoch is not None else 0.0)
+
+    def sequence(self, ip_proxy, slave_id, register_type, addresses, timestamps=False):
+        """
+        Returns a list-like view of the values (or timestamps) of registers, for a sequential data block
+
+        :param str ip_proxy: the proxy IP address of the slave
+        :param int slave_id: the Modbus slave ID
+        :param str register_type: the type of register ('co', 'di', 'hr', 'ir')
+        :param list addresses: the register addresses in block order
+        :param bool timestamps: views the timestamps instead of the values
+        :rtype: SharedSequence
+        """
+        return SharedSequence(self, [self.slot(ip_proxy, slave_id, register_type, addr) for addr in addresses],
+                              timestamps)
+
+    def mapping(self, ip_proxy, slave_id, register_type, addresses, timestamps=False):
+        """
+        Returns a dict-like view of the values (or timestamps) of registers keyed by address, for a sparse data block
+
+        :param str ip_proxy: the proxy IP address of the slave
+        :param int slave_id: the Modbus slave ID
+        :param str register_type: the type of register ('co', 'di', 'hr', 'ir')
+        :param iterable addresses: the register addresses
+        :param bool timestamps: views the timestamps instead of the values
+        :rtype: SharedMapping
+        """
+        return SharedMapping(self, dict((addr, self.slot(ip_proxy, slave_id, register_type, addr))
+                                        for addr in addresses), timestamps)
+
+    def stats(self):
+        """
+        Returns the table counters of this process
+
+        :rtype: dict
+        """
+        return {
+            'slots': self.slots,
+            'claimed': self.used,
+        }
+
+    def flush(self):
+        """Writes the table through to its file"""
+        self._map.flush()
+
+    def close(self):
+        """Unmaps the table"""
+        self._map.close()
+        os.close(self._fd)
+
+
+class SharedSequence(collections.MutableSequence):
+    """A fixed-length list-like view of table slots, supporting indexing and equal-length slice assignment"""
+    def __init__(self, table, offsets, timestamps=False):
+        self.table = table
+        self.offsets = offsets
+        if timestamps:
+            self._get, self._set = table.get_timestamp, table.set_timestamp
+        else:
+            self._get, self._set = table.get_value, table.set_value
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(offset) for offset in self.offsets[index]]
+        return self._get(self.offsets[index])
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            offsets = self.offsets[index]
+            if len(offsets) != len(value):
+                raise ValueError("Shared register blocks cannot be resized")
+            for offset, item in zip(offsets, value):
+                self._set(offset, item)
+        else:
+            self._set(self.offsets[index], value)
+
+    def __delitem__(self, index):
+        raise TypeError("Shared register blocks cannot be resized")
+
+    def insert(self, index, value):
+        raise TypeError("Shared register blocks cannot be resized")
+
+
+class SharedMapping(collections.MutableMapping):
+    """A dict-like view of table slots keyed by register address, limited to the configured addresses"""
+    def __init__(self, table, offsets, timestamps=False):
+        self.table = table
+        self.offsets = offsets
+        if timestamps:
+            self._get, self._set = table.get_timestamp, table.set_timestamp
+        else:
+            self._get, self._set = table.get_value, table.set_value
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __contains__(self, address):
+        return address in self.offsets
+
+    def __getitem__(self, address):
+        return self._get(self.offsets[address])
+
+    def __setitem__(self, address, value):
+        self._set(self.offsets[address], value)
+
+    def __delitem__(self, address):
+        raise TypeError("Shared register blocks cannot be resized")
@@ -0,0 +1,157 @@
+"""
+Warm-start snapshots of the last-known register values, so a restarted adapter serves the values and timestamps
+it held before the restart instead of zeros until its first successful read from ClearBlade.
+
+The snapshot is a ``shared.SharedRegisterTable`` file written periodically from the data blocks of every slave.
+At startup each server context is restored from it before its listener opens, and slaves whose read mode does not
+refresh them in the background are then reconciled against ClearBlade once the reactor runs.
+Restored registers are marked fresh in the register cache, so with a cache TTL direct and async reads serve them
+from memory until the reconciling refresh or the TTL replaces them.
+"""
+
+import time
+
+from twisted.internet import reactor, task, threads
+
+from headless import is_logger, get_wrapping_logger
+from shared import SharedRegisterTable
+from constants import READ_MODE_DIRECT, READ_MODE_ASYNC, DEFAULT_SNAPSHOT_INTERVAL
+from constants import COL_REG_ADDRESS, COL_REG_DATA, COL_DATA_TIMESTAMP
+
+
+def _iso_timestamp(epoch):
+    """Formats epoch seconds as a ClearBlade ISO 8601 timestamp"""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+
+class RegisterSnapshot(object):
+    """
+    Periodically saves the registers of a set of server contexts to a memory-mapped file and restores them at startup
+    """
+    def __init__(self, path, **kwargs):
+        """
+        Opens (or creates) the snapshot file
+
+        :param str path: the snapshot file, which must persist across restarts (i.e. not under /dev/shm)
+        :param kwargs: optional log, interval (seconds between snapshots), slots (registers the file can hold)
+        """
+        if is_logger(kwargs.get('log', None)):
+            self.log = kwargs.get('log')
+        else:
+            self.log = get_wrapping_logger(name='ClearBladeModbusSnapshot',
+                                           debug=True if kwargs.get('debug', None) else False)
+        self.interval = float(kwargs.get('interval', DEFAULT_SNAPSHOT_INTERVAL))
+        if 'slots' in kwargs:
+            self.table = SharedRegisterTable(path, slots=kwargs.get('slots'))
+        else:
+            self.table = SharedRegisterTable(path)
+        self.contexts = []
+        self.restored = 0
+        self.snapshots = 0
+        self.failures = 0
+        self.last_duration = None
+        self._views = {}
+        self._loop = None
+
+    def _blocks(self, server_context):
+        """Generates the (slave context, data block) pairs of a server context"""
+        for slave_id, slave in server_context:
+            for block in slave.store.values():
+                if block is not None:
+                    yield slave, block
+
+    def _view(self, slave, block, addresses):
+        """Returns the (values, timestamps) table views of a block's registers, claiming their slots once"""
+        views = self._views.get(block, None)
+        if views is None:
+            views = (self.table.sequence(slave.ip_proxy, slave.slave_id, block.register_type, addresses),
+                     self.table.sequence(slave.ip_proxy, slave.slave_id, block.register_type, addresses,
+                                         timestamps=True))
+            self._views[block] = views
+        return views
+
+    def restore(self, server_context):
+        """
+        Loads the last-known registers of a server context from the snapshot, marking them fresh in the register cache
+        of their slave, and adds the context to the periodic snapshots.
+        Registers without a snapshot timestamp keep their initial values.
+
+        :param context.ClearBladeModbusProxyServerContext server_context: a newly built server context
+        :returns: the number of registers restored
+        :rtype: int
+        """
+        restored = 0
+        for slave, block in self._blocks(server_context):
+            addresses = block.registers()[0]
+            values, timestamps = self._view(slave, block, addresses)
+            rows = [{COL_REG_ADDRESS: addr, COL_REG_DATA: value, COL_DATA_TIMESTAMP: _iso_timestamp(timestamp)}
+                    for addr, value, timestamp in zip(addresses, values[:], timestamps[:]) if timestamp is not None]
+            addresses = block.load(rows)
+            slave.cache.update(block.register_type, addresses)
+            restored += len(addresses)
+        self.contexts.append(server_context)
+        self.restored += restored
+        return restored
+
+    def reconcile(self):
+        """
+        Schedules a background refresh of the restored slaves that are not refreshed periodically by their read mode,
+        so registers that changed while the adapter was down are corrected without waiting for a Modbus read
+        """
+        for server_context in self.contexts:
+            for slave_id, slave in server_context:
+                if slave.read_mode in (READ_MODE_DIRECT, READ_MODE_ASYNC):
+                    reactor.callWhenRunning(slave.refresh_in_background)
+
+    def save(self):
+        """
+        Writes the registers of every restored server context to the snapshot file
+
+        :returns: the number of registers saved
+        :rtype: int
+        """
+        started = time.time()
+        saved = 0
+        for server_context in self.contexts:
+            for slave, block in self._blocks(server_context):
+                addresses, block_values, block_timestamps = block.registers()
+                values, timestamps = self._view(slave, block, addresses)
+                values[:] = block_values
+                timestamps[:] = [timestamp or 0.0 for timestamp in block_timestamps]
+                saved += len(addresses)
+        self.table.flush()
+        self.snapshots += 1
+        self.last_duration = time.time() - started
+        return saved
+
+    def _save_in_thread(self):
+        """Saves a snapshot off the reactor thread, counting and logging a failed save"""
+        d = threads.deferToThread(self.save)
+
+        def _failed(failure):
+            self.failures += 1
+            self.log.error("Snapshot to {} failed: {}".format(self.table.path, failure.getErrorMessage()))
+
+        d.addErrback(_failed)
+        return d
+
+    def start(self):
+        """Schedules the periodic snapshots once the reactor runs, and a final snapshot at shutdown"""
+        if self._loop is None:
+            self._loop = task.LoopingCall(self._save_in_thread)
+            reactor.callWhenRunning(self._loop.start, self.interval, now=False)
+            reactor.addSystemEventTrigger('before', 'shutdown', self.save)
+
+    def stats(self):
+        """
+        Returns the snapshot counters
+
+        :rtype: dict
+        """
+        return {
+            'restored': self.restored,
+            'snapshots': self.snapshots,
+            'failures': self.failures,
+            'last_duration': self.last_duration,
+            'slots_claimed': self.table.used,
+        }
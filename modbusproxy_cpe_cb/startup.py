@@ -0,0 +1,107 @@
+"""
+Startup pipeline of the adapter: reads the ``ModbusProxyRtus`` collection once, page by page, groups the rows
+by proxy address and builds the server contexts one at a time.
+Building a context from rows already read is CPU-bound template parsing, which threads would not speed up.
+Listeners are registered as their contexts are built, but no proxy accepts connections until the reactor runs
+after the whole build.
+"""
+
+import time
+from collections import OrderedDict
+
+from clearblade.ClearBladeCore import Query
+
+from store import get_all_items
+from constants import COL_PROXY_IP_ADDRESS, DEFAULT_PAGE_SIZE
+
+
+def fetch_rtu_rows(collection, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Reads every RTU row with a proxy address and groups the rows by address
+
+    :param clearblade.Collections.Collection collection: the ModbusProxyRtus collection
+    :param int page_size: the number of rows requested per page
+    :returns: the rows of each proxy address in the format {ip_address: [row]}, in collection order
+    :rtype: collections.OrderedDict
+    """
+    query = Query()
+    query.notEqualTo(COL_PROXY_IP_ADDRESS, '')
+    grouped = OrderedDict()
+    for row in get_all_items(collection, query, page_size):
+        grouped.setdefault(str(row[COL_PROXY_IP_ADDRESS]), []).append(row)
+    return grouped
+
+
+class StartupPipeline(object):
+    """
+    Builds server contexts and times the adapter startup
+    """
+    def __init__(self):
+        """Initializes the pipeline, starting the clock for its metrics"""
+        self.started = time.time()
+        self.rtus = 0
+        self.proxies = 0
+        self.built = 0
+        self.fetch_seconds = None
+        self.build_seconds = None
+        self.first_listener = None
+        self.serving_since = None
+
+    def fetch(self, collection, page_size=DEFAULT_PAGE_SIZE):
+        """
+        Reads the RTU rows grouped by proxy address, see ``fetch_rtu_rows``
+
+        :param clearblade.Collections.Collection collection: the ModbusProxyRtus collection
+        :param int page_size: the number of rows requested per page
+        :rtype: collections.OrderedDict
+        """
+        fetch_start = time.time()
+        grouped = fetch_rtu_rows(collection, page_size)
+        self.fetch_seconds = time.time() - fetch_start
+        self.rtus = sum([len(rows) for rows in grouped.values()])
+        self.proxies = len(grouped)
+        return grouped
+
+    def build(self, build_context, ip_proxies):
+        """
+        Generates the server context of each proxy address in order, each built when the previous one
+        has been handed to the caller
+
+        :param callable build_context: called with a proxy address, returning its server context
+        :param list ip_proxies: the proxy addresses to build
+        :returns: a generator of (ip_address, server_context)
+        """
+        build_start = time.time()
+        try:
+            for ip_address in ip_proxies:
+                context = build_context(ip_address)
+                self.built += 1
+                yield ip_address, context
+        finally:
+            self.build_seconds = time.time() - build_start
+
+    def listener_added(self):
+        """Records the time to the first proxy listener being registered with the reactor or its server thread"""
+        if self.first_listener is None:
+            self.first_listener = time.time() - self.started
+
+    def serving(self):
+        """Records the time to serving, called once the reactor runs and registered listeners accept connections"""
+        if self.serving_since is None:
+            self.serving_since = time.time() - self.started
+
+    def stats(self):
+        """
+        Returns the startup metrics in seconds since the pipeline started
+
+        :rtype: dict
+        """
+        return {
+            'rtus': self.rtus,
+            'proxies': self.proxies,
+            'built': self.built,
+            'fetch_seconds': self.fetch_seconds,
+            'build_seconds': self.build_seconds,
+            'first_listener_seconds': self.first_listener,
+            'serving_seconds': self.serving_since,
+        }
@@ -2,17 +2,167 @@
 Subclasses of the PyModbus data blocks integrated with a ClearBlade Platform.
 """
 
+import calendar
+import numbers
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
 from clearblade.ClearBladeCore import Query
 from constants import *
-from pymodbus.datastore.store import ModbusSequentialDataBlock, ModbusSparseDataBlock
+from pymodbus.datastore.store import BaseModbusDataBlock, ModbusSequentialDataBlock, ModbusSparseDataBlock
 from pymodbus.exceptions import ParameterException, NotImplementedException
 from pymodbus.compat import iteritems, iterkeys, itervalues, get_next
 
 
+class PackedBitArray(object):
+    """
+    A fixed-length array of bits packed 8 per byte, the compact storage of coils and discrete inputs.
+    Supports indexing and equal-length slice assignment like a list of 0/1 values.
+    """
+    def __init__(self, length):
+        """
+        :param int length: the number of bits, all initially 0
+        """
+        self.length = length
+        self.bits = bytearray((length + 7) // 8)
+
+    def __len__(self):
+        return self.length
+
+    def _get(self, i):
+        return (self.bits[i >> 3] >> (i & 7)) & 1
+
+    def _set(self, i, value):
+        if value:
+            self.bits[i >> 3] |= 1 << (i & 7)
+        else:
+            self.bits[i >> 3] &= ~(1 << (i & 7)) & 0xff
+
+    def _index(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("bit index out of range")
+        return i
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(self.length))]
+        return self._get(self._index(index))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            positions = range(*index.indices(self.length))
+            value = list(value)
+            if len(positions) != len(value):
+                raise ValueError("PackedBitArray cannot be resized")
+            for i, bit in zip(positions, value):
+                self._set(i, bit)
+        else:
+            self._set(self._index(index), value)
+
+    def __iter__(self):
+        return (self._get(i) for i in range(0, self.length))
+
+
+class _Flight(object):
+    """A ClearBlade fetch of a range of registers in progress"""
+    def __init__(self, address, count):
+        self.address = address
+        self.end = address + count
+        self.ok = False
+        self.done = threading.Event()
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent fetches of a data block: a fetch overlapping one already in flight waits for it,
+    then only reads from ClearBlade the registers that the fetches it waited on did not cover.
+
+    Fetches of a block only run concurrently on worker threads: those of the async ``fetch.FetchPool``,
+    of the ``fetch.DeadlineFetcher`` and of the threaded request execution of proxies with a read deadline.
+    Direct reads on the reactor thread run one at a time and never coalesce here.
+    The two pools join identical requests before queueing them, so that retries do not take up workers;
+    this class merges the overlapping but different ranges that the workers then fetch at the same time.
+    """
+    def __init__(self):
+        self.fetches = 0
+        self.coalesced = 0
+        self.saved = 0
+        self._flights = []
+        self._lock = threading.Lock()
+
+    def run(self, fetch, address, count):
+        """
+        Runs a fetch of registers unless fetches in flight cover them
+
+        :param callable fetch: called with (address, count) to read the registers from ClearBlade
+        :param int address: The starting address
+        :param int count: The number of registers
+        :returns: the number of registers read by the fetch, or ``count`` if the fetches waited on covered them
+        :rtype: int
+        """
+        end = address + count
+        joined = False
+        while True:
+            with self._lock:
+                waits = [flight for flight in self._flights if flight.address < end and address < flight.end]
+                if len(waits) == 0:
+                    flight = _Flight(address, end - address)
+                    self._flights.append(flight)
+                    self.fetches += 1
+                    break
+                if not joined:
+                    # a caller may wait on several rounds of flights, but joins them once
+                    self.coalesced += 1
+                    joined = True
+            for waited in waits:
+                waited.done.wait()
+            covered = [(waited.address, waited.end) for waited in waits if waited.ok]
+            # narrow the range to the registers not covered at either end by the fetches waited on
+            progress = True
+            while progress and address < end:
+                progress = False
+                for first, last in covered:
+                    if first <= address < last:
+                        address, progress = last, True
+                    if first < end <= last:
+                        end, progress = first, True
+            if address >= end:
+                with self._lock:
+                    self.saved += 1
+                return count
+        try:
+            fetched = fetch(address, end - address)
+            flight.ok = True
+            return fetched
+        finally:
+            with self._lock:
+                self._flights.remove(flight)
+            flight.done.set()
+
+    def stats(self):
+        """
+        Returns the coalescing counters
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'fetches': self.fetches,
+                'coalesced': self.coalesced,
+                'saved': self.saved,
+            }
+
+
 class CbModbusSequentialDataBlock(ModbusSequentialDataBlock):
     """
     A custom subclass of the sequential data block that includes metadata for the ClearBlade platform context,
-    register type, and timestamps of the field data
+    register type, and timestamps of the field data.
+    Values are stored compactly as unsigned 16-bit arrays (hr, ir) or packed bits (co, di)
+    and timestamps as an array of epoch seconds (0 when unknown).
     """
     def __init__(self, context, register_type, address, values):
         """
@@ -29,13 +179,24 @@ class CbModbusSequentialDataBlock(ModbusSequentialDataBlock):
             self.register_type = register_type
         else:
             raise ParameterException("Register type must be one of: ".format(REGISTER_TYPES))
-        self.timestamps = []
-        for i in range(0, len(self.values)-1):
-            self.timestamps.append(None)
+        length = len(self.values)
+        if context.shared_table is not None:
+            addresses = range(address, address + length)
+            self.values = context.shared_table.sequence(context.ip_proxy, context.slave_id, register_type, addresses)
+            self.timestamps = context.shared_table.sequence(context.ip_proxy, context.slave_id, register_type,
+                                                            addresses, timestamps=True)
+        else:
+            initial = self.values
+            self.values = _compact_values(register_type, length)
+            self.values[0:length] = _pack_values(self.values, initial)
+            self.timestamps = array('d', [0.0]) * length
+        self.in_flight = SingleFlight()
 
     def getValues(self, address, count=1):
         """
-        Returns the requested values of the datastore
+        Returns the requested values of the datastore.
+        Registers refreshed within the cache TTL of the slave context, or prefetched by the slave context,
+        are served without querying ClearBlade.
 
         :param int address: The starting address
         :param int count: The number of values to retrieve
@@ -43,21 +204,59 @@ class CbModbusSequentialDataBlock(ModbusSequentialDataBlock):
         :rtype: list
         """
         start = address - self.address
+        _refresh(self, address, count, range(address, address + count))
+        return list(self.values[start:start + count])
+
+    def fetch(self, address, count=1):
+        """
+        Reads registers from ClearBlade into the datastore, widened by the read-ahead of the slave context
+        and waiting on overlapping fetches in flight instead of repeating them
+
+        :param int address: The starting address
+        :param int count: The number of values to retrieve
+        :returns: the number of registers read
+        :rtype: int
+        """
+        if self.context.read_ahead > 0:
+            address, count = self._read_ahead(address, count)
+        return self.in_flight.run(self._fetch, address, count)
+
+    def _read_ahead(self, address, count):
+        """
+        Widens a fetch to the whole block, or forward to the read-ahead row count of the slave context
+
+        :returns: the widened (address, count)
+        :rtype: tuple
+        """
+        limit = self.context.read_ahead
+        length = len(self.values)
+        if length <= limit:
+            return self.address, length
+        return address, max(count, min(self.address + length, address + limit) - address)
+
+    def _fetch(self, address, count=1):
+        """
+        Reads registers from ClearBlade into the datastore
+
+        :param int address: The starting address
+        :param int count: The number of values to retrieve
+        :returns: the number of registers read
+        :rtype: int
+        """
+        start = address - self.address
         values, timestamps = read_collection_data(self.context, self.register_type, address, count)
-        if len(values) != count:
-            self.context.log.warning("Register count mismatch {} requested but {} returned".format(count, len(values)))
+        fetched = len(values)
+        if fetched != count:
+            self.context.log.warning("Register count mismatch {} requested but {} returned".format(count, fetched))
             # TODO: WARNING may require a Modbus error to be generated
-            count = len(values)
-        j = 0
-        for i in range(address, address + count):
-            self.values[i] = values[j]
-            self.timestamps[i] = timestamps[i]
-            j += 1
-        return self.values[start:start + count]
+        self.values[start:start + fetched] = _pack_values(self.values, values)
+        self.timestamps[start:start + fetched] = _pack_timestamps(self.timestamps, timestamps)
+        self.context.cache.update(self.register_type, range(address, address + fetched))
+        return fetched
 
     def setValues(self, address, values):
         """
-        Sets the requested values of the datastore
+        Sets the requested values of the datastore, forwarding the write to ClearBlade as one batch
 
         :param int address: The starting address
         :param values: The new value(s) to be set, accepts a single int or a list of int
@@ -65,9 +264,29 @@ class CbModbusSequentialDataBlock(ModbusSequentialDataBlock):
         if not isinstance(values, list):
             values = [values]
         start = address - self.address
-        self.values[start:start + len(values)] = values
-        for i in range(address, len(values)-1):
-            write_collection_data(self.context, self.register_type, address=address + i, data=values[i])
+        self.values[start:start + len(values)] = _pack_values(self.values, values)
+        self.context.writer.submit(self.register_type, dict(zip(range(address, address + len(values)), values)))
+
+    def load(self, rows):
+        """
+        Loads rows read from the ClearBlade data collection into the datastore, ignoring unconfigured addresses
+
+        :param list rows: ClearBlade data collection rows of this block's register type
+        :returns: the addresses loaded
+        :rtype: list of int
+        """
+        in_range = {}
+        for row in rows:
+            i = row[COL_REG_ADDRESS] - self.address
+            if 0 <= i < len(self.values):
+                in_range[i] = row
+        # contiguous runs of rows are assigned with one slice each
+        for first, last in _address_runs(in_range):
+            run = [in_range[i] for i in range(first, last + 1)]
+            self.values[first:last + 1] = _pack_values(self.values, [row[COL_REG_DATA] for row in run])
+            self.timestamps[first:last + 1] = _pack_timestamps(self.timestamps,
+                                                               [row[COL_DATA_TIMESTAMP] for row in run])
+        return [i + self.address for i in sorted(in_range)]
 
     def get_timestamps(self, address, count=1):
         """
@@ -75,14 +294,261 @@ class CbModbusSequentialDataBlock(ModbusSequentialDataBlock):
 
         :param int address: the starting address
         :param int count: the number of registers to query
-        :returns: timestamps of the requested registers
-        :rtype: list of str
+        :returns: timestamps of the requested registers in epoch seconds, None where unknown
+        :rtype: list of float
         """
         start = address - self.address
-        return self.timestamps[start:start + count]
+        return [timestamp or None for timestamp in self.timestamps[start:start + count]]
+
+    def registers(self):
+        """
+        Returns the configured registers without refreshing them from ClearBlade
+
+        :returns: the (addresses, values, timestamps) of the registers, timestamps in epoch seconds or None
+        :rtype: tuple
+        """
+        return (range(self.address, self.address + len(self.values)), list(self.values),
+                self.get_timestamps(self.address, len(self.values)))
+
+
+class CbModbusSegmentedDataBlock(BaseModbusDataBlock):
+    """
+    A sequential data block that stores only the contiguous runs (segments) of configured register addresses,
+    with a sorted index of the segment start addresses searched by bisection.
+    Memory grows with the number of configured registers rather than the spread of their addresses.
+    As with a sequential block, any range between the first and last configured address is valid
+    and unconfigured addresses between segments read as 0.
+    """
+    def __init__(self, context, register_type, addresses):
+        """
+        Initializes the segmented datastore
+
+        :param context.ClearBladeModbusProxySlaveContext context: the parent/context of the data block
+        :param str register_type: select from hr, ir, di, co
+        :param list addresses: the configured register addresses
+        """
+        self.context = context
+        if register_type in REGISTER_TYPES:
+            self.register_type = register_type
+        else:
+            raise ParameterException("Register type must be one of: ".format(REGISTER_TYPES))
+        runs = _address_runs(set(addresses))
+        self.address = runs[0][0]
+        self.end = runs[-1][1] + 1
+        self.default_value = 0
+        self.starts = [first for first, last in runs]
+        self.segments = [self._segment(first, last) for first, last in runs]
+        self.in_flight = SingleFlight()
+
+    def _segment(self, first, last):
+        """Allocates the (values, timestamps) storage of the registers first..last"""
+        length = last - first + 1
+        table = self.context.shared_table
+        if table is not None:
+            addresses = range(first, last + 1)
+            return (table.sequence(self.context.ip_proxy, self.context.slave_id, self.register_type, addresses),
+                    table.sequence(self.context.ip_proxy, self.context.slave_id, self.register_type, addresses,
+                                   timestamps=True))
+        return _compact_values(self.register_type, length), array('d', [0.0]) * length
+
+    def _overlaps(self, address, count):
+        """
+        Generates the parts of segments overlapping a range of addresses
+
+        :returns: tuples of (segment, offset in segment, offset in range, length)
+        """
+        end = address + count
+        i = max(0, bisect_right(self.starts, address) - 1)
+        while i < len(self.starts) and self.starts[i] < end:
+            start = self.starts[i]
+            segment = self.segments[i]
+            first = max(address, start)
+            last = min(end, start + len(segment[0]))
+            if first < last:
+                yield segment, first - start, first - address, last - first
+            i += 1
+
+    def configured(self, address, count=1):
+        """
+        Returns the configured addresses within a range
+
+        :param int address: The starting address
+        :param int count: The number of addresses
+        :rtype: list of int
+        """
+        addresses = []
+        for segment, offset, start, length in self._overlaps(address, count):
+            addresses.extend(range(address + start, address + start + length))
+        return addresses
+
+    def __iter__(self):
+        """Iterates (address, value) of the configured registers"""
+        for start, (values, timestamps) in zip(self.starts, self.segments):
+            for i, value in enumerate(values):
+                yield start + i, value
+
+    def validate(self, address, count=1):
+        """
+        Checks to see if the request is in range
+
+        :param int address: The starting address
+        :param int count: The number of values to test for
+        :returns: True if the request in within range, False otherwise
+        """
+        return self.address <= address and address + count <= self.end
+
+    def getValues(self, address, count=1):
+        """
+        Returns the requested values of the datastore.
+        Registers refreshed within the cache TTL of the slave context, or prefetched by the slave context,
+        are served without querying ClearBlade.
+
+        :param int address: The starting address
+        :param int count: The number of values to retrieve
+        :returns: The requested values from address:address+count
+        :rtype: list
+        """
+        _refresh(self, address, count, self.configured(address, count))
+        result = [self.default_value] * count
+        for (values, timestamps), offset, start, length in self._overlaps(address, count):
+            result[start:start + length] = values[offset:offset + length]
+        return result
+
+    def fetch(self, address, count=1):
+        """
+        Reads registers from ClearBlade into the datastore, widened by the read-ahead of the slave context
+        and waiting on overlapping fetches in flight instead of repeating them
+
+        :param int address: The starting address
+        :param int count: The number of values to retrieve
+        :returns: the number of registers read
+        :rtype: int
+        """
+        if self.context.read_ahead > 0:
+            address, count = self._read_ahead(address, count)
+        return self.in_flight.run(self._fetch, address, count)
+
+    def _read_ahead(self, address, count):
+        """
+        Widens a fetch to the whole block, or forward over the following segments
+        to the read-ahead row count of the slave context
+
+        :returns: the widened (address, count)
+        :rtype: tuple
+        """
+        limit = self.context.read_ahead
+        if sum([len(values) for values, timestamps in self.segments]) <= limit:
+            return self.address, self.end - self.address
+        rows = len(self.configured(address, count))
+        end = address + count
+        i = bisect_right(self.starts, end - 1)
+        if i > 0:
+            # the rest of the segment holding the last requested address
+            segment_end = self.starts[i - 1] + len(self.segments[i - 1][0])
+            if segment_end > end:
+                end += min(segment_end - end, max(0, limit - rows))
+                rows = len(self.configured(address, end - address))
+        while rows < limit and i < len(self.starts):
+            take = min(len(self.segments[i][0]), limit - rows)
+            end = self.starts[i] + take
+            rows += take
+            i += 1
+        return address, end - address
+
+    def _fetch(self, address, count=1):
+        """
+        Reads registers from ClearBlade into the datastore
+
+        :param int address: The starting address
+        :param int count: The number of values to retrieve
+        :returns: the number of registers read
+        :rtype: int
+        """
+        values, timestamps = read_collection_data(self.context, self.register_type, address, count)
+        fetched = len(values)
+        if fetched != count:
+            self.context.log.warning("Register count mismatch {} requested but {} returned".format(count, fetched))
+        for (seg_values, seg_timestamps), offset, start, length in self._overlaps(address, fetched):
+            seg_values[offset:offset + length] = _pack_values(seg_values, values[start:start + length])
+            seg_timestamps[offset:offset + length] = _pack_timestamps(seg_timestamps,
+                                                                      timestamps[start:start + length])
+        self.context.cache.update(self.register_type, self.configured(address, fetched))
+        return fetched
+
+    def setValues(self, address, values):
+        """
+        Sets the requested values of the datastore, forwarding the write to ClearBlade as one batch
+
+        :param int address: The starting address
+        :param values: The new value(s) to be set, accepts a single int or a list of int
+        """
+        if not isinstance(values, list):
+            values = [values]
+        for (seg_values, seg_timestamps), offset, start, length in self._overlaps(address, len(values)):
+            seg_values[offset:offset + length] = _pack_values(seg_values, values[start:start + length])
+        self.context.writer.submit(self.register_type, dict(zip(range(address, address + len(values)), values)))
+
+    def load(self, rows):
+        """
+        Loads rows read from the ClearBlade data collection into the datastore, ignoring unconfigured addresses
+
+        :param list rows: ClearBlade data collection rows of this block's register type
+        :returns: the addresses loaded
+        :rtype: list of int
+        """
+        in_range = {}
+        for row in rows:
+            addr = row[COL_REG_ADDRESS]
+            i = bisect_right(self.starts, addr) - 1
+            if i >= 0 and addr < self.starts[i] + len(self.segments[i][0]):
+                in_range[addr] = row
+        # a contiguous run of configured addresses lies within one segment and is assigned with one slice
+        for first, last in _address_runs(in_range):
+            i = bisect_right(self.starts, first) - 1
+            values, timestamps = self.segments[i]
+            offset = first - self.starts[i]
+            run = [in_range[addr] for addr in range(first, last + 1)]
+            values[offset:offset + len(run)] = _pack_values(values, [row[COL_REG_DATA] for row in run])
+            timestamps[offset:offset + len(run)] = _pack_timestamps(timestamps,
+                                                                    [row[COL_DATA_TIMESTAMP] for row in run])
+        return sorted(in_range)
+
+    def get_timestamps(self, address, count=1):
+        """
+        Returns the timestamps of the field data for the specified registers
+
+        :param int address: the starting address
+        :param int count: the number of registers to query
+        :returns: timestamps of the requested registers in epoch seconds, None where unknown or unconfigured
+        :rtype: list of float
+        """
+        result = [None] * count
+        for (values, timestamps), offset, start, length in self._overlaps(address, count):
+            result[start:start + length] = [timestamp or None for timestamp in timestamps[offset:offset + length]]
+        return result
+
+    def registers(self):
+        """
+        Returns the configured registers without refreshing them from ClearBlade
+
+        :returns: the (addresses, values, timestamps) of the registers, timestamps in epoch seconds or None
+        :rtype: tuple
+        """
+        addresses, values, timestamps = [], [], []
+        for start, (seg_values, seg_timestamps) in zip(self.starts, self.segments):
+            addresses.extend(range(start, start + len(seg_values)))
+            values.extend(seg_values)
+            timestamps.extend([timestamp or None for timestamp in seg_timestamps])
+        return addresses, values, timestamps
 
 
 class CbModbusSparseDataBlock(ModbusSparseDataBlock):
+    """
+    A custom subclass of the sparse data block that includes metadata for the ClearBlade platform context,
+    register type, and timestamps of the field data.
+    Values are kept in a dict indexed by a sorted array of the configured addresses,
+    so ranges are validated by bisection and read as slices of the index.
+    """
     def __init__(self, context, register_type, values):
         """
         Initializes the sparse datastore.
@@ -101,45 +567,136 @@ class CbModbusSparseDataBlock(ModbusSparseDataBlock):
         self.timestamps = {}
         for addr in self.values:
             self.timestamps[addr] = None
+        self.addresses = array('l', sorted(self.values))
+        if context.shared_table is not None:
+            addresses = list(self.addresses)
+            self.values = context.shared_table.mapping(context.ip_proxy, context.slave_id, register_type, addresses)
+            self.timestamps = context.shared_table.mapping(context.ip_proxy, context.slave_id, register_type,
+                                                           addresses, timestamps=True)
+        self.in_flight = SingleFlight()
+
+    def _span(self, address, count):
+        """Returns the (low, high) positions in the sorted address index of the addresses within a range"""
+        return bisect_left(self.addresses, address), bisect_left(self.addresses, address + count)
+
+    def validate(self, address, count=1):
+        """
+        Checks to see if every address of the request is configured
+
+        :param int address: The starting address
+        :param int count: The number of values to test for
+        :returns: True if the request in within range, False otherwise
+        """
+        if count == 0:
+            return False
+        low, high = self._span(address, count)
+        return high - low == count
 
     def getValues(self, address, count=1):
         """
-        Returns the requested values of the datastore
+        Returns the requested values of the datastore.
+        Registers refreshed within the cache TTL of the slave context, or prefetched by the slave context,
+        are served without querying ClearBlade.
 
         :param address: The starting address
         :param count: The number of values to retrieve
-        :returns: The requested values from a:a+c
+        :returns: The requested values of the configured registers from a:a+c
+        """
+        low, high = self._span(address, count)
+        addresses = self.addresses[low:high]
+        _refresh(self, address, count, addresses)
+        return [self.values[addr] for addr in addresses]
+
+    def fetch(self, address, count=1):
+        """
+        Reads registers from ClearBlade into the datastore, widened by the read-ahead of the slave context
+        and waiting on overlapping fetches in flight instead of repeating them
+
+        :param int address: The starting address
+        :param int count: The number of values to retrieve
+        :returns: the number of registers read
+        :rtype: int
+        """
+        if self.context.read_ahead > 0:
+            address, count = self._read_ahead(address, count)
+        return self.in_flight.run(self._fetch, address, count)
+
+    def _read_ahead(self, address, count):
+        """
+        Widens a fetch to the whole block, or forward over the following configured addresses
+        to the read-ahead row count of the slave context
+
+        :returns: the widened (address, count)
+        :rtype: tuple
+        """
+        limit = self.context.read_ahead
+        low, high = self._span(address, count)
+        if len(self.addresses) <= limit:
+            first, last = 0, len(self.addresses) - 1
+        elif high - low < limit:
+            first, last = low, min(low + limit, len(self.addresses)) - 1
+        else:
+            return address, count
+        start = min(address, self.addresses[first])
+        return start, max(address + count, self.addresses[last] + 1) - start
+
+    def _fetch(self, address, count=1):
+        """
+        Reads registers from ClearBlade into the datastore
+
+        :param address: The starting address
+        :param count: The number of values to retrieve
+        :returns: the number of registers read
+        :rtype: int
         """
         values, timestamps = read_collection_data(self.context, self.register_type, address, count)
-        if len(values) != count:
-            self.context.log.warning("Register count mismatch {} requested but {} returned".format(count, len(values)))
-        for key in values:
-            for addr in self.values:
-                if key == addr:
-                    self.values[addr] = values[key]
-                    self.timestamps[addr] = timestamps[key]
-        # TODO: this sends back auto-filled registers that aren't in the sparse definition but should probably throw
-        #       a Modbus error
-        return [self.values[i] for i in range(address, address + count)]
+        low, high = self._span(address, count)
+        if len(values) != high - low:
+            self.context.log.warning("Register count mismatch {} requested but {} returned"
+                                     .format(high - low, len(values)))
+        merged = []
+        for addr, value in iteritems(values):
+            if addr in self.values:
+                self.values[addr] = value
+                self.timestamps[addr] = timestamps[addr]
+                merged.append(addr)
+        self.context.cache.update(self.register_type, merged)
+        return len(values)
 
     def setValues(self, address, values):
         """
-        Sets the requested values of the datastore
+        Sets the requested values of the datastore, forwarding the write to ClearBlade as one batch
 
         :param address: The starting address
         :param values: The new values to be set
         """
         if isinstance(values, dict):
-            for idx, val in iteritems(values):
-                self.values[idx] = val
-                # TODO: may be a more efficient way than multiple calls to the ClearBlade API (one per index)
-                write_collection_data(self.context, self.register_type, address=idx, data=val)
+            writes = dict(values)
         else:
             if not isinstance(values, list):
                 values = [values]
-            for idx, val in enumerate(values):
-                self.values[address + idx] = val
-                write_collection_data(self.context, self.register_type, address=address + idx, data=val)
+            writes = dict(zip(range(address, address + len(values)), values))
+        for idx, val in iteritems(writes):
+            if idx in self.values:
+                self.values[idx] = val
+        self.context.writer.submit(self.register_type, writes)
+
+    def load(self, rows):
+        """
+        Loads rows read from the ClearBlade data collection into the datastore, ignoring unconfigured addresses
+
+        :param list rows: ClearBlade data collection rows of this block's register type
+        :returns: the addresses loaded
+        :rtype: list of int
+        """
+        loaded = []
+        for row in rows:
+            addr = row[COL_REG_ADDRESS]
+            if addr in self.values:
+                self.values[addr] = row[COL_REG_DATA]
+                self.timestamps[addr] = row[COL_DATA_TIMESTAMP]
+                loaded.append(addr)
+        return loaded
 
     def get_timestamps(self, address, count=1):
         """
@@ -147,17 +704,310 @@ class CbModbusSparseDataBlock(ModbusSparseDataBlock):
 
         :param int address: the starting address
         :param int count: the number of registers to query
-        :returns: timestamps of the requested registers in the format {address: timestamp}
-        :rtype: dict of str
+        :returns: timestamps of the requested registers in epoch seconds, None where unknown
+        :rtype: list of float
+        """
+        low, high = self._span(address, count)
+        return [parse_timestamp(self.timestamps[addr]) for addr in self.addresses[low:high]]
+
+    def registers(self):
+        """
+        Returns the configured registers without refreshing them from ClearBlade
+
+        :returns: the (addresses, values, timestamps) of the registers, timestamps in epoch seconds or None
+        :rtype: tuple
         """
-        return [self.timestamps[i] for i in range(address, address + count)]
+        addresses = list(self.addresses)
+        return (addresses, [self.values[addr] for addr in addresses],
+                [parse_timestamp(self.timestamps[addr]) for addr in addresses])
+
+
+def _compact_values(register_type, length):
+    """
+    Allocates zeroed compact register storage: packed bits for coils and discrete inputs, otherwise 16-bit words
+
+    :param str register_type: the type of register ('co', 'di', 'hr', 'ir')
+    :param int length: the number of registers
+    :rtype: array.array or PackedBitArray
+    """
+    if register_type in (TYPE_COIL, TYPE_DISCRETE_INPUT):
+        return PackedBitArray(length)
+    return array('H', [0]) * length
+
+
+def _pack_values(storage, values):
+    """Converts values for slice assignment to a register storage, masking 16-bit words"""
+    if isinstance(storage, array):
+        return array('H', [int(value) & 0xffff for value in values])
+    return values
+
+
+def _pack_timestamps(storage, timestamps):
+    """Converts ClearBlade timestamps for slice assignment to an epoch timestamp storage"""
+    if isinstance(storage, array):
+        return array('d', [parse_timestamp(timestamp) or 0.0 for timestamp in timestamps])
+    return timestamps
+
+
+_ISO_TIMESTAMP = re.compile(r'^(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(\.\d+)?'
+                            r'\s*(Z|[+-]\d{2}:?\d{2})?$')
+
+
+def parse_timestamp(timestamp):
+    """
+    Converts a data collection timestamp to seconds since the epoch (UTC) so timestamps can be compared
+
+    Accepts epoch seconds or milliseconds, ISO 8601 (e.g. ``2019-01-21T07:00:00Z``)
+    and ``MM/DD/YYYY hh:mm:ss`` strings.
+
+    :param timestamp: the timestamp value from ClearBlade
+    :returns: seconds since the epoch, or None if the timestamp is empty or unrecognized
+    :rtype: float or None
+    """
+    if timestamp is None or timestamp == '' or isinstance(timestamp, bool):
+        return None
+    if isinstance(timestamp, numbers.Number):
+        return float(timestamp) / 1000 if timestamp > 1e11 else float(timestamp)
+    timestamp = str(timestamp).strip()
+    match = _ISO_TIMESTAMP.match(timestamp)
+    if match:
+        year, month, day, hour, minute, second, fraction, zone = match.groups()
+        epoch = calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second)))
+        if fraction:
+            epoch += float(fraction)
+        if zone and zone != 'Z':
+            offset = zone.replace(':', '')
+            minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+            epoch -= minutes * 60 if offset[0] == '+' else -minutes * 60
+        return float(epoch)
+    try:
+        return float(calendar.timegm(time.strptime(timestamp, '%m/%d/%Y %H:%M:%S')))
+    except ValueError:
+        return None
+
+
+def sortable_timestamp(timestamp, overlap=0):
+    """
+    Normalizes a data collection timestamp to a value that ClearBlade compares in time order,
+    as the bound of a timestamp range query
+
+    Epoch numbers keep their unit (seconds or milliseconds) and ISO 8601 strings are converted to UTC
+    ``YYYY-MM-DDThh:mm:ssZ`` (rounded down to the second, so a range starting at the bound still includes the row).
+    ``MM/DD/YYYY hh:mm:ss`` strings do not sort in time order and are rejected.
+
+    :param timestamp: the timestamp value from ClearBlade
+    :param float overlap: (optional) seconds to step the bound back by
+    :returns: the normalized timestamp, or None if the timestamp cannot bound a range query
+    :rtype: float or str or None
+    """
+    if isinstance(timestamp, numbers.Number) and not isinstance(timestamp, bool):
+        if overlap == 0:
+            return timestamp
+        return timestamp - overlap * 1000 if timestamp > 1e11 else timestamp - overlap
+    if timestamp is None or not _ISO_TIMESTAMP.match(str(timestamp).strip()):
+        return None
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(int(parse_timestamp(timestamp) - overlap)))
+
+
+def _refresh(block, address, count, addresses):
+    """
+    Brings the registers of a read up to date according to the read mode of the slave context.
+    Prefetch, batch, shared, adaptive and priority modes always serve from memory,
+    direct mode fetches synchronously on a cache miss (waiting at most the read deadline of the slave context, if any,
+    before serving the last-known values) and async mode hands cache misses to the fetch pool while the caller
+    is served from memory.
+
+    :param block: the CbModbusSequentialDataBlock or CbModbusSparseDataBlock being read
+    :param int address: The starting address
+    :param int count: The number of values to retrieve
+    :param iterable addresses: the configured register addresses being read
+    """
+    context = block.context
+    if context.read_mode in (READ_MODE_PREFETCH, READ_MODE_BATCH, READ_MODE_SHARED, READ_MODE_ADAPTIVE,
+                             READ_MODE_PRIORITY):
+        return
+    if context.cache.lookup(block.register_type, addresses):
+        return
+    if context.read_mode == READ_MODE_ASYNC:
+        # failures are logged by the fetch pool and the next read will request the registers again
+        context.fetch_pool.fetch(block, address, count).addErrback(lambda failure: None)
+    elif context.read_deadline > 0:
+        # a fetch missing the deadline updates the block in the background once it completes
+        context.deadline_fetcher.fetch(block, address, count, context.read_deadline)
+    else:
+        block.fetch(address, count)
+
+
+def iter_pages(collection, query, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Generates the pages of rows matching a query so large collections can be processed as they stream in
+
+    :param clearblade.Collections.Collection collection: the ClearBlade collection
+    :param clearblade.ClearBladeCore.Query query: the query to match
+    :param int page_size: the number of rows requested per page
+    :returns: a generator of row lists
+    """
+    page = 1
+    while True:
+        items = collection.getItems(query, pagesize=page_size, pagenum=page)
+        if len(items) > 0:
+            yield items
+        if len(items) < page_size:
+            break
+        page += 1
+
+
+def _keyset_query(query, last=None):
+    """
+    Returns a data collection query ordered by timestamp and row ID, restricted to the rows after a keyset position
+
+    :param clearblade.ClearBladeCore.Query query: a data collection query
+    :param tuple last: (optional) the (timestamp, item_id) of the last row already read
+    :rtype: clearblade.ClearBladeCore.Query
+    """
+    keyset = Query()
+    keyset.sorting = [{'ASC': COL_DATA_TIMESTAMP}, {'ASC': COL_ITEM_ID}]
+    if last is None:
+        keyset.filters = [list(group) for group in query.filters]
+        return keyset
+    timestamp, item_id = last
+    # each AND group of the query splits into rows of a later timestamp and rows of the same timestamp
+    # with a later row ID, as the Query API has no way to AND a condition onto groups that are already ORed
+    for group in query.filters or [[]]:
+        keyset.filters.append(list(group) + [{'GT': [{COL_DATA_TIMESTAMP: timestamp}]}])
+        keyset.filters.append(list(group) + [{'EQ': [{COL_DATA_TIMESTAMP: timestamp}]},
+                                             {'GT': [{COL_ITEM_ID: item_id}]}])
+    return keyset
+
+
+def iter_data_pages(collection, query, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Generates the pages of data collection rows matching a query using keyset pagination: rows are read in
+    (timestamp, item_id) order and each page starts after the last row of the previous page, rather than at an
+    offset. Rows written while the query is read get a later timestamp, so they move behind the position
+    already reached and are read again at the end; no row shifts into a page already read and is skipped.
+
+    :param clearblade.Collections.Collection collection: the ClearBlade data collection
+    :param clearblade.ClearBladeCore.Query query: the query to match, whose rows must have a timestamp
+    :param int page_size: the number of rows requested per page
+    :returns: a generator of row lists
+    """
+    last = None
+    while True:
+        items = collection.getItems(_keyset_query(query, last), pagesize=page_size, pagenum=1)
+        if len(items) > 0:
+            yield items
+        if len(items) < page_size:
+            break
+        last = (items[-1][COL_DATA_TIMESTAMP], items[-1][COL_ITEM_ID])
+
+
+def get_all_data(collection, query, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Retrieves every data collection row matching a query, see ``iter_data_pages``
+
+    :param clearblade.Collections.Collection collection: the ClearBlade data collection
+    :param clearblade.ClearBladeCore.Query query: the query to match
+    :param int page_size: the number of rows requested per page
+    :returns: the matching rows
+    :rtype: list of dict
+    """
+    rows = []
+    for items in iter_data_pages(collection, query, page_size):
+        rows.extend(items)
+    return rows
+
+
+def get_all_items(collection, query, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Retrieves every row matching a query, reading the collection page by page
+
+    :param clearblade.Collections.Collection collection: the ClearBlade collection
+    :param clearblade.ClearBladeCore.Query query: the query to match
+    :param int page_size: the number of rows requested per page
+    :returns: the matching rows
+    :rtype: list of dict
+    """
+    rows = []
+    for items in iter_pages(collection, query, page_size):
+        rows.extend(items)
+    return rows
+
+
+def read_slave_data(context, page_size=DEFAULT_PAGE_SIZE, since=None):
+    """
+    Retrieve every register of all types for a slave from the data collection in a single query
+
+    :param context.ClearBladeModbusProxySlaveContext context: The ClearBlade parent metadata to query against.
+    :param int page_size: the number of rows requested per page
+    :param since: (optional) only rows with a timestamp at or after this bound are returned,
+       normalized by ``sortable_timestamp``
+    :returns: the data collection rows of the slave
+    :rtype: list of dict
+    """
+    collection = context.client.collection(context.cb_data_collection)
+    query = Query()
+    query.equalTo(COL_PROXY_IP_ADDRESS, context.ip_proxy)
+    query.equalTo(COL_SLAVE_ID, context.slave_id)
+    if since is not None:
+        query.greaterThanEqualTo(COL_DATA_TIMESTAMP, since)
+    return get_all_data(collection, query, page_size)
+
+
+def chunk_queries(groups, query_groups=DEFAULT_QUERY_GROUPS):
+    """
+    ORs filter groups together into queries of at most ``query_groups`` groups each.
+    ClearBlade query filters are sent in the URL, so a query of unbounded groups can exceed the URL length limit.
+
+    :param list groups: queries of one filter group each
+    :param int query_groups: the most filter groups per query
+    :rtype: list of clearblade.ClearBladeCore.Query
+    """
+    queries = []
+    for start in range(0, len(groups), query_groups):
+        query = Query()
+        for group in groups[start:start + query_groups]:
+            query = query.Or(group)
+        queries.append(query)
+    return queries
+
+
+def read_registers(context, registers, page_size=DEFAULT_PAGE_SIZE, query_groups=DEFAULT_QUERY_GROUPS):
+    """
+    Retrieve selected registers of a slave from the data collection, matching each contiguous run of addresses
+    by range, with at most ``query_groups`` runs per query (see ``chunk_queries``)
+
+    :param context.ClearBladeModbusProxySlaveContext context: The ClearBlade parent metadata to query against.
+    :param dict registers: the addresses to read of each register type in the format {register_type: [address]}
+    :param int page_size: the number of rows requested per page
+    :param int query_groups: the most address runs per query
+    :returns: the data collection rows of the registers
+    :rtype: list of dict
+    """
+    groups = []
+    for register_type, addresses in sorted(registers.items()):
+        for first, last in _address_runs(addresses):
+            run_query = Query()
+            run_query.equalTo(COL_PROXY_IP_ADDRESS, context.ip_proxy)
+            run_query.equalTo(COL_SLAVE_ID, context.slave_id)
+            run_query.equalTo(COL_REG_TYPE, register_type)
+            run_query.greaterThanEqualTo(COL_REG_ADDRESS, first)
+            run_query.lessThanEqualTo(COL_REG_ADDRESS, last)
+            groups.append(run_query)
+    if len(groups) == 0:
+        return []
+    collection = context.client.collection(context.cb_data_collection)
+    rows = []
+    for query in chunk_queries(groups, query_groups):
+        rows.extend(get_all_data(collection, query, page_size))
+    return rows
 
 
 def read_collection_data(context, register_type, address, count, fill=0):
     """
     Retrieve data from the specified collection.
     When retrieving sequential blocks if the ClearBlade collection is missing registers between the start and end,
-    those will be filled (optionally)
+    those will be filled (optionally). The sorted rows are merged into the output in a single pass.
 
     :param context.ClearBladeModbusProxySlaveContext context: The ClearBlade parent metadata to query against.
     :param str register_type: the type of register ('co', 'di', 'hr', 'ir')
@@ -167,7 +1017,7 @@ def read_collection_data(context, register_type, address, count, fill=0):
     :returns: values, timestamps of the data read from the ClearBlade collection/proxy
     :rtype: list or dict (sequential or sparse)
     """
-    collection = context.cb_system.Collection(context.cb_auth, collectionName=context.cb_data_collection)
+    collection = context.client.collection(context.cb_data_collection)
     query = Query()
     query.equalTo(COL_PROXY_IP_ADDRESS, context.ip_proxy)
     query.equalTo(COL_SLAVE_ID, context.slave_id)
@@ -177,7 +1027,7 @@ def read_collection_data(context, register_type, address, count, fill=0):
         query.lessThan(COL_REG_ADDRESS, address + count)
     else:
         query.equalTo(COL_REG_ADDRESS, address)
-    reg_list = sorted(collection.getItems(query), key=lambda k: k[COL_REG_ADDRESS])
+    reg_list = sorted(get_all_items(collection, query), key=lambda k: k[COL_REG_ADDRESS])
     if len(reg_list) != count:
         context.log.warning("Got {} rows from ClearBlade, expecting {} registers".format(len(reg_list), count))
     if context.sparse:
@@ -197,24 +1047,85 @@ def read_collection_data(context, register_type, address, count, fill=0):
             values[reg[COL_REG_ADDRESS]] = reg[COL_REG_DATA]
             timestamps[reg[COL_REG_ADDRESS]] = reg[COL_DATA_TIMESTAMP]
     else:
-        values = []
-        timestamps = []
-        for addr in range(address, address + count):
-            if reg_list[addr][COL_REG_ADDRESS] != addr:
-                if fill is not None:
-                    if isinstance(fill, int):
-                        context.log.info("Filling {} register {} with value {}".format(register_type, addr, fill))
-                        reg_list.insert(addr, {COL_REG_DATA: fill})
-                    else:
-                        raise ValueError("Fill parameter must be integer or None")
-                else:
-                    raise ParameterException("ClearBlade Collection missing register {} from block [{}:{}]"
-                                             .format(addr, address, address + count))
-            values.append(reg_list[addr][COL_REG_DATA])
-            timestamps.append(reg_list[addr][COL_DATA_TIMESTAMP])
+        if fill is not None and not isinstance(fill, int):
+            raise ValueError("Fill parameter must be integer or None")
+        values = [fill] * count
+        timestamps = [None] * count
+        cursor = 0
+        filled = 0
+        for i in range(0, count):
+            addr = address + i
+            while cursor < len(reg_list) and reg_list[cursor][COL_REG_ADDRESS] < addr:
+                cursor += 1
+            if cursor < len(reg_list) and reg_list[cursor][COL_REG_ADDRESS] == addr:
+                values[i] = reg_list[cursor][COL_REG_DATA]
+                timestamps[i] = reg_list[cursor][COL_DATA_TIMESTAMP]
+                cursor += 1
+            elif fill is None:
+                raise ParameterException("ClearBlade Collection missing register {} from block [{}:{}]"
+                                         .format(addr, address, address + count))
+            else:
+                filled += 1
+        if filled > 0:
+            context.log.info("Filled {} missing {} registers of block [{}:{}] with value {}"
+                             .format(filled, register_type, address, address + count, fill))
     return values, timestamps
 
 
+def _address_runs(addresses):
+    """
+    Groups addresses into contiguous runs
+
+    :param iterable addresses: register addresses
+    :returns: tuples of (first, last) address of each run in ascending order
+    :rtype: list of tuple
+    """
+    runs = []
+    for addr in sorted(addresses):
+        if len(runs) > 0 and runs[-1][1] + 1 == addr:
+            runs[-1] = (runs[-1][0], addr)
+        else:
+            runs.append((addr, addr))
+    return runs
+
+
+def write_collection_batch(context, register_type, writes):
+    """
+    Write several registers to the data collection using the fewest ClearBlade update calls.
+    A ClearBlade update sets the same data on every matching row and the collections API has no per-row bulk update,
+    so registers are grouped by value with one call per distinct value, each matching the contiguous address runs
+    that share the value. A write of N different values (e.g. FC16 of telemetry setpoints) still takes N calls,
+    which are sent concurrently over the HTTP sessions of the client (see ``client.ClearBladeClient.map``).
+
+    :param context.ClearBladeModbusProxySlaveContext context: The ClearBlade parent metadata to query against.
+    :param str register_type: the type of register (co, hr)
+    :param dict writes: the data to write in the format {address: value}
+    :returns: the number of ClearBlade update calls made
+    :rtype: int
+    """
+    by_value = {}
+    for addr, data in iteritems(writes):
+        by_value.setdefault(data, []).append(addr)
+    collection = context.client.collection(context.cb_data_collection)
+    updates = []
+    for data, addresses in iteritems(by_value):
+        query = Query()
+        for first, last in _address_runs(addresses):
+            run_query = Query()
+            run_query.equalTo(COL_PROXY_IP_ADDRESS, context.ip_proxy)
+            run_query.equalTo(COL_SLAVE_ID, context.slave_id)
+            run_query.equalTo(COL_REG_TYPE, register_type)
+            if first == last:
+                run_query.equalTo(COL_REG_ADDRESS, first)
+            else:
+                run_query.greaterThanEqualTo(COL_REG_ADDRESS, first)
+                run_query.lessThanEqualTo(COL_REG_ADDRESS, last)
+            query = query.Or(run_query)
+        updates.append((query, {COL_REG_DATA: data}))
+    context.client.map(lambda update: collection.updateItems(*update), updates)
+    return len(updates)
+
+
 def write_collection_data(context, register_type, address, data):
     """
     Retrieve input register values from the Analog_Input_Registers collection
@@ -224,7 +1135,7 @@ def write_collection_data(context, register_type, address, data):
     :param int address: The starting address
     :param data: The data value(s) to write
     """
-    collection = context.cb_system.Collection(context.cb_auth, collectionName=context.cb_data_collection)
+    collection = context.client.collection(context.cb_data_collection)
     query = Query()
     query.equalTo(COL_PROXY_IP_ADDRESS, context.ip_proxy)
     query.equalTo(COL_SLAVE_ID, context.slave_id)
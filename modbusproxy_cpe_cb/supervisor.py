@@ -0,0 +1,220 @@
+"""
+Supervision of adapter worker processes that each serve a shard of the Modbus proxies with their own reactor,
+so request decoding and JSON parsing scale across CPU cores instead of sharing one interpreter lock.
+
+Workers are copies of the adapter started with ``--shard <n>``. Each one reads the ``ModbusProxyRtus`` rows
+and keeps the proxies assigned to its shard by ``shard_proxies``. Worker output is relayed through the
+supervisor log, and worker statistics are written to stdout as prefixed JSON lines so the supervisor
+can aggregate them.
+"""
+
+import json
+import signal
+import subprocess
+import sys
+import threading
+import time
+from numbers import Number
+
+from headless import is_logger, get_wrapping_logger
+from constants import WORKER_STATS_PREFIX, WORKER_PEAK_STATS, DEFAULT_WORKER_MAX_BACKOFF, DEFAULT_WORKER_STOP_TIMEOUT
+
+
+def shard_proxies(ip_proxies, workers):
+    """
+    Assigns proxy IP addresses to workers so that every worker computes the same split independently
+
+    :param list ip_proxies: the proxy IP addresses read from the ModbusProxyRtus collection
+    :param int workers: the number of worker processes
+    :returns: the shard of each address in the format {ip_address: shard}
+    :rtype: dict
+    """
+    return dict((ip_address, n % workers) for n, ip_address in enumerate(sorted(ip_proxies)))
+
+
+def emit_worker_stats(statistics):
+    """
+    Writes the statistics of a worker to stdout for its supervisor
+
+    :param list statistics: tuples of (label, callable) whose returned statistics are reported
+    """
+    report = dict((label, get_stats()) for label, get_stats in statistics)
+    sys.stdout.write(WORKER_STATS_PREFIX + json.dumps(report) + '\n')
+    sys.stdout.flush()
+
+
+class WorkerProcess(object):
+    """
+    A worker process serving one shard of the proxies, whose output is relayed to the supervisor log
+    """
+    def __init__(self, shard, command, log):
+        """
+        :param shard: the shard number of the worker, or a name for an unsharded worker
+        :param list command: the command line starting the worker
+        :param logging.Logger log: the supervisor logger
+        """
+        self.shard = shard
+        self.command = command
+        self.log = log
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        self.failures = 0
+        self.restart_at = None
+        self.stats = {}
+
+    def start(self):
+        """Starts the worker process and the thread relaying its output"""
+        self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        bufsize=1, close_fds=True)
+        self.started = time.time()
+        self.restart_at = None
+        relay = threading.Thread(target=self._relay, args=(self.process,), name='Worker{}Relay'.format(self.shard))
+        relay.daemon = True
+        relay.start()
+        self.log.info("Started worker {} (pid {})".format(self.shard, self.process.pid))
+
+    def _relay(self, process):
+        """Relays worker log lines and collects its statistics reports until the process exits"""
+        for line in iter(process.stdout.readline, b''):
+            line = line.rstrip()
+            if line.startswith(WORKER_STATS_PREFIX):
+                try:
+                    self.stats = json.loads(line[len(WORKER_STATS_PREFIX):])
+                except ValueError:
+                    pass
+            elif line:
+                self.log.info("[worker {}] {}".format(self.shard, line))
+        process.stdout.close()
+
+    def alive(self):
+        """
+        Returns True while the worker process is running
+
+        :rtype: bool
+        """
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        """Interrupts the worker so it takes down its virtual interfaces before exiting"""
+        if self.alive():
+            self.process.send_signal(signal.SIGINT)
+
+    def kill(self):
+        """Kills a worker that did not stop when interrupted"""
+        if self.alive():
+            self.log.warning("Killing worker {} (pid {})".format(self.shard, self.process.pid))
+            self.process.kill()
+
+
+class Supervisor(object):
+    """
+    Runs the adapter as a number of worker processes, restarting any that exit
+    with an exponential backoff and logging their aggregated statistics each heartbeat
+    """
+    def __init__(self, workers, command, **kwargs):
+        """
+        Initializes the supervisor
+
+        :param int workers: the number of worker processes
+        :param list command: the adapter command line, to which each worker's ``--shard <n>`` is appended
+        :param kwargs: optional log, heartbeat (seconds between statistics logs), max_backoff (seconds),
+           refresher (the command line of an unsharded process refreshing the shared register table)
+        """
+        if is_logger(kwargs.get('log', None)):
+            self.log = kwargs.get('log')
+        else:
+            self.log = get_wrapping_logger(name='ClearBladeModbusSupervisor',
+                                           debug=True if kwargs.get('debug', None) else False)
+        self.heartbeat = int(kwargs.get('heartbeat', 30))
+        self.max_backoff = float(kwargs.get('max_backoff', DEFAULT_WORKER_MAX_BACKOFF))
+        self.workers = [WorkerProcess(shard, list(command) + ['--shard', str(shard)], self.log)
+                        for shard in range(0, max(1, int(workers)))]
+        if kwargs.get('refresher', None) is not None:
+            self.workers.append(WorkerProcess('refresher', list(kwargs.get('refresher')), self.log))
+        self._stop = threading.Event()
+
+    def _check(self, worker, now):
+        """Schedules the restart of a worker that exited, or restarts it once its backoff has elapsed"""
+        if worker.alive() or self._stop.is_set():
+            return
+        if worker.restart_at is None:
+            if now - worker.started > self.max_backoff:
+                worker.failures = 0
+            backoff = min(self.max_backoff, 2 ** worker.failures)
+            worker.failures += 1
+            worker.restart_at = now + backoff
+            self.log.error("Worker {} exited with code {} - restarting in {}s"
+                           .format(worker.shard, worker.process.returncode, backoff))
+        elif now >= worker.restart_at:
+            worker.restarts += 1
+            worker.start()
+
+    def run(self):
+        """Starts the workers and supervises them until interrupted or terminated"""
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._stop.set())
+        for worker in self.workers:
+            worker.start()
+        time_ref = time.time()
+        try:
+            while not self._stop.is_set():
+                now = time.time()
+                for worker in self.workers:
+                    self._check(worker, now)
+                if now - time_ref >= self.heartbeat:
+                    self._log_stats()
+                    time_ref = now
+                self._stop.wait(1)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Interrupts all workers, killing any still running after the stop timeout"""
+        self._stop.set()
+        for worker in self.workers:
+            worker.stop()
+        deadline = time.time() + DEFAULT_WORKER_STOP_TIMEOUT
+        while any([worker.alive() for worker in self.workers]) and time.time() < deadline:
+            time.sleep(0.1)
+        for worker in self.workers:
+            worker.kill()
+
+    def aggregate(self):
+        """
+        Sums the latest counters reported by the workers, by label and counter.
+        Timings, backoffs and the sizes of the shared register table, listed in ``WORKER_PEAK_STATS``,
+        do not add up across workers and are reported as the largest value of any worker.
+
+        :rtype: dict
+        """
+        totals = {}
+        for worker in self.workers:
+            for label, values in worker.stats.items():
+                merged = totals.setdefault(label, {})
+                for key, value in values.items():
+                    if not isinstance(value, Number):
+                        continue
+                    if key in WORKER_PEAK_STATS:
+                        merged[key] = max(merged.get(key, value), value)
+                    else:
+                        merged[key] = merged.get(key, 0) + value
+        return totals
+
+    def stats(self):
+        """
+        Returns the worker process counters
+
+        :rtype: dict
+        """
+        return {
+            'workers': len(self.workers),
+            'alive': len([worker for worker in self.workers if worker.alive()]),
+            'restarts': sum([worker.restarts for worker in self.workers]),
+        }
+
+    def _log_stats(self):
+        """Logs the supervisor counters and the aggregated worker statistics"""
+        self.log.debug("Heartbeat ({}s)".format(self.heartbeat))
+        self.log.debug("Workers: {}".format(self.stats()))
+        for label, values in sorted(self.aggregate().items()):
+            self.log.debug("{}: {}".format(label, values))
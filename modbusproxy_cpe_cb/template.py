@@ -0,0 +1,321 @@
+"""
+Parsing of Inmarsat IDP Modbus Proxy ``config.dat`` templates, with a cache of parsed templates keyed by a hash
+of their content so RTUs sharing a template (and restarts of the adapter) parse it only once.
+
+Parsed templates are persisted as compiled register maps: compact binary files of identity fields and
+(register_type, refresh_class, block_size, address, param_id) records ordered by register type and address, which are
+memory-mapped at startup and give each data block its sorted addresses without parsing or sorting.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+from constants import *
+
+#: Bumped whenever the compiled register map layout changes, invalidating persisted maps
+REGISTER_MAP_VERSION = 2
+REGISTER_MAP_EXTENSION = '.crm'
+
+_IDENTITY_TAGS = ('VendorName', 'ProductCode', 'VendorUrl', 'ProductName', 'ModelName', 'MajorMinorRevision')
+_REGISTER_TYPES = {
+    TEMPLATE_PARSER_TYPE_INPUT_REGISTER: TYPE_INPUT_REGISTER,
+    TEMPLATE_PARSER_TYPE_HOLDING_REGISTER: TYPE_HOLDING_REGISTER,
+    TEMPLATE_PARSER_TYPE_DISCRETE_INPUT: TYPE_DISCRETE_INPUT,
+    TEMPLATE_PARSER_TYPE_COIL: TYPE_COIL,
+}
+_MAGIC = b'CBRM'
+#: header: magic version flags slave_id identity_count error_count then a register count per REGISTER_TYPES entry
+_MAP_HEADER = struct.Struct('<4sHBBHH4I')
+#: register record: register_type refresh_class block_size address param_id (-1 when undefined)
+_MAP_REGISTER = struct.Struct('<BBHii')
+#: string record: tag (index of _IDENTITY_TAGS, or _ERROR_TAG) length, followed by the utf-8 bytes
+_MAP_STRING = struct.Struct('<BH')
+_ERROR_TAG = 0xff
+_FLAG_SPARSE = 0x01
+_FLAG_ZERO_MODE = 0x02
+
+
+def _tokens(line):
+    """Generates the (key, value) pairs of a ``;`` separated template line"""
+    for token in line.split(TEMPLATE_PARSER_SEPARATOR):
+        key, sep, value = token.partition('=')
+        yield key.strip(), value.strip()
+
+
+def _blocks(registers, refresh_class=None):
+    """
+    Returns the sorted unique addresses of each register type, registers without a type being coils
+
+    :param list registers: the [param_id, address, register_type, refresh_class] of the registers
+    :param str refresh_class: (optional) only includes registers of this refresh class
+    """
+    blocks = dict((register_type, set()) for register_type in REGISTER_TYPES)
+    for param_id, address, register_type, register_class in registers:
+        if address is not None and (refresh_class is None or register_class == refresh_class):
+            blocks[register_type if register_type in blocks else TYPE_COIL].add(address)
+    return dict((register_type, sorted(addresses)) for register_type, addresses in blocks.items())
+
+
+def parse_template(config_file):
+    """
+    Parses a ``config.dat`` file in a single pass, indexing register definitions by paramId
+
+    :param str config_file: the content of the template
+    :returns: a dict with ``identity`` (dict of ModbusDeviceIdentification attributes), ``sparse`` (bool),
+       ``slave_id`` (int or None), ``zero_mode`` (bool), ``registers`` (list of
+       [param_id, address, register_type, refresh_class] in definition order), ``blocks`` (the sorted addresses
+       of each register type), ``critical`` (the sorted addresses of each register type tagged
+       ``refreshClass=critical``) and ``errors`` (list of str)
+    :rtype: dict
+    """
+    template = {
+        'identity': {},
+        'sparse': False,
+        'slave_id': None,
+        'zero_mode': True,
+        'registers': [],
+        'errors': [],
+    }
+    by_param_id = {}
+    for line in config_file.splitlines():
+        if line.startswith(TEMPLATE_PARSER_DESC):
+            for key, value in _tokens(line):
+                if key in _IDENTITY_TAGS:
+                    template['identity'][key] = value
+                elif key.lower() == TEMPLATE_PARSER_SPARSE_MODE:
+                    template['sparse'] = bool(int(value))
+        elif line.startswith(TEMPLATE_PARSER_NETWORK):
+            for key, value in _tokens(line):
+                if key == TEMPLATE_PARSER_SLAVE_ID:
+                    net_id = int(value)
+                    if 1 <= net_id <= 254:
+                        template['slave_id'] = net_id
+                    else:
+                        template['errors'].append("Invalid Modbus Slave ID {id}".format(id=net_id))
+                elif key == TEMPLATE_PARSER_NOT_ZERO_MODE:
+                    template['zero_mode'] = int(value) != 1
+        elif line.startswith(TEMPLATE_PARSER_REGISTER_DEF):
+            # TODO: handle multi-register blocks
+            register = None
+            for key, value in _tokens(line):
+                if key == TEMPLATE_PARSER_REG_UID:
+                    param_id = int(value)
+                    register = by_param_id.get(param_id, None)
+                    if register is None:
+                        register = [param_id, None, None, REFRESH_CLASS_BULK]
+                        by_param_id[param_id] = register
+                        template['registers'].append(register)
+                elif key == TEMPLATE_PARSER_REG_ADDRESS:
+                    addr = int(value)
+                    # TODO: confirm this works properly
+                    if not template['zero_mode']:
+                        addr += 1
+                    if 0 <= addr <= 99999:
+                        if register is None:
+                            register = [None, None, None, REFRESH_CLASS_BULK]
+                            template['registers'].append(register)
+                        register[1] = addr
+                    else:
+                        template['errors'].append("Invalid Modbus address {num}".format(num=addr))
+                elif key == TEMPLATE_PARSER_REG_TYPE:
+                    if value in _REGISTER_TYPES:
+                        if register is not None:
+                            register[2] = _REGISTER_TYPES[value]
+                    else:
+                        template['errors'].append("Unsupported registerType {}".format(value))
+                elif key == TEMPLATE_PARSER_REG_CLASS:
+                    if value in REFRESH_CLASSES:
+                        if register is not None:
+                            register[3] = value
+                    else:
+                        template['errors'].append("Unsupported refreshClass {}".format(value))
+    template['blocks'] = _blocks(template['registers'])
+    template['critical'] = _blocks(template['registers'], REFRESH_CLASS_CRITICAL)
+    return template
+
+
+def compile_template(template):
+    """
+    Compiles a parsed template into the binary register map format
+
+    :param dict template: a template returned by ``parse_template``
+    :returns: the register map
+    :rtype: bytes
+    """
+    strings = [(_IDENTITY_TAGS.index(tag), value) for tag, value in sorted(template['identity'].items())]
+    strings += [(_ERROR_TAG, error) for error in template['errors']]
+    flags = (_FLAG_SPARSE if template['sparse'] else 0) | (_FLAG_ZERO_MODE if template['zero_mode'] else 0)
+    by_type = dict((register_type, []) for register_type in REGISTER_TYPES)
+    for param_id, address, register_type, refresh_class in template['registers']:
+        if address is not None:
+            by_type[register_type if register_type in by_type else TYPE_COIL].append(
+                (address, -1 if param_id is None else param_id,
+                 REFRESH_CLASSES.index(refresh_class) if refresh_class in REFRESH_CLASSES else 0))
+    counts = [len(by_type[register_type]) for register_type in REGISTER_TYPES]
+    chunks = [_MAP_HEADER.pack(_MAGIC, REGISTER_MAP_VERSION, flags, template['slave_id'] or 0,
+                               len(template['identity']), len(template['errors']), *counts)]
+    for n, register_type in enumerate(REGISTER_TYPES):
+        for address, param_id, class_index in sorted(by_type[register_type]):
+            chunks.append(_MAP_REGISTER.pack(n, class_index, 1, address, param_id))
+    for tag, value in strings:
+        encoded = value.encode('utf-8')
+        chunks.append(_MAP_STRING.pack(tag, len(encoded)))
+        chunks.append(encoded)
+    return b''.join(chunks)
+
+
+def load_register_map(path):
+    """
+    Memory-maps a compiled register map and returns it as a parsed template
+
+    :param str path: the register map file
+    :returns: a dict in the format returned by ``parse_template``
+    :rtype: dict
+    :raises ValueError: if the file is not a register map of the current version
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < _MAP_HEADER.size:
+            raise ValueError("Truncated register map {}".format(path))
+        register_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        header = _MAP_HEADER.unpack_from(register_map, 0)
+        if header[0:2] != (_MAGIC, REGISTER_MAP_VERSION):
+            raise ValueError("Unsupported register map {}".format(path))
+        flags, slave_id, identity_count, error_count = header[2:6]
+        template = {
+            'identity': {},
+            'sparse': bool(flags & _FLAG_SPARSE),
+            'slave_id': slave_id if slave_id > 0 else None,
+            'zero_mode': bool(flags & _FLAG_ZERO_MODE),
+            'registers': [],
+            'errors': [],
+            'blocks': {},
+            'critical': {},
+        }
+        offset = _MAP_HEADER.size
+        for register_type, count in zip(REGISTER_TYPES, header[6:]):
+            addresses = []
+            critical = []
+            for n in range(0, count):
+                type_index, class_index, block_size, address, param_id = _MAP_REGISTER.unpack_from(register_map,
+                                                                                                   offset)
+                offset += _MAP_REGISTER.size
+                refresh_class = REFRESH_CLASSES[class_index]
+                addresses.append(address)
+                if refresh_class == REFRESH_CLASS_CRITICAL:
+                    critical.append(address)
+                template['registers'].append([param_id if param_id >= 0 else None, address, register_type,
+                                              refresh_class])
+            # records are sorted by address, so a block only needs adjacent duplicates removed
+            template['blocks'][register_type] = [address for n, address in enumerate(addresses)
+                                                 if n == 0 or address != addresses[n - 1]]
+            template['critical'][register_type] = [address for n, address in enumerate(critical)
+                                                   if n == 0 or address != critical[n - 1]]
+        for n in range(0, identity_count + error_count):
+            tag, length = _MAP_STRING.unpack_from(register_map, offset)
+            offset += _MAP_STRING.size
+            value = register_map[offset:offset + length].decode('utf-8')
+            offset += length
+            if tag == _ERROR_TAG:
+                template['errors'].append(value)
+            else:
+                template['identity'][_IDENTITY_TAGS[tag]] = value
+        return template
+    except struct.error:
+        raise ValueError("Truncated register map {}".format(path))
+    finally:
+        register_map.close()
+
+
+class TemplateCache(object):
+    """
+    Parsed templates keyed by the SHA-1 of their content, optionally persisted to a local directory
+    of compiled register maps so an adapter restart memory-maps the templates it has already seen.
+    """
+    def __init__(self, path=None):
+        """
+        Initializes the cache
+
+        :param str path: (optional) the register map directory, otherwise templates are cached in memory only
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.loaded = 0
+        self._templates = {}
+        self._unsaved = set()
+        self._lock = threading.Lock()
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def _key(config_file):
+        """Returns the content hash of a template"""
+        if not isinstance(config_file, bytes):
+            config_file = config_file.encode('utf-8')
+        return hashlib.sha1(config_file).hexdigest()
+
+    def _map_path(self, key):
+        """Returns the register map file of a template"""
+        return os.path.join(self.path, key + REGISTER_MAP_EXTENSION)
+
+    def get(self, config_file):
+        """
+        Returns the parsed template, loading its register map or parsing it if its content has not been seen before
+
+        :param str config_file: the content of the template
+        :rtype: dict
+        """
+        key = self._key(config_file)
+        with self._lock:
+            template = self._templates.get(key, None)
+            if template is not None:
+                self.hits += 1
+                return template
+        loaded = False
+        if self.path is not None and os.path.exists(self._map_path(key)):
+            try:
+                template = load_register_map(self._map_path(key))
+                loaded = True
+            except (IOError, ValueError):
+                template = None
+        if template is None:
+            template = parse_template(config_file)
+        with self._lock:
+            if loaded:
+                self.loaded += 1
+            else:
+                self.misses += 1
+                self._unsaved.add(key)
+            return self._templates.setdefault(key, template)
+
+    def save(self):
+        """Compiles the templates parsed since the cache was created into register maps"""
+        if self.path is None:
+            return
+        with self._lock:
+            unsaved = [(key, self._templates[key]) for key in self._unsaved]
+            self._unsaved = set()
+        for key, template in unsaved:
+            # each worker process writes its own temporary file and the last complete one wins
+            temp_path = '{}.{}.tmp'.format(self._map_path(key), os.getpid())
+            with open(temp_path, 'wb') as f:
+                f.write(compile_template(template))
+            os.rename(temp_path, self._map_path(key))
+
+    def stats(self):
+        """
+        Returns the cache counters
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'templates': len(self._templates),
+                'hits': self.hits,
+                'loaded': self.loaded,
+                'misses': self.misses,
+            }
@@ -0,0 +1,135 @@
+"""
+Coalescing of Modbus register writes into batched ClearBlade collection updates.
+"""
+
+import threading
+
+from twisted.internet import reactor, threads
+from twisted.python.threadable import isInIOThread
+
+from store import write_collection_batch
+from constants import DEFAULT_WRITE_RETRY_INTERVAL, DEFAULT_WRITE_RETRY_MAX_BACKOFF
+
+
+class WriteCoalescer(object):
+    """
+    Collects the register writes of a slave context and sends them to ClearBlade with the fewest update calls.
+    With a window of 0 each Modbus write request is flushed immediately as one batch, on the reactor thread pool
+    when submitted from the running reactor so its ClearBlade calls do not stall other connections;
+    otherwise writes arriving within the window are merged (the latest value per register wins) and flushed together.
+    Writes that ClearBlade rejects are held in memory and retried with exponential backoff, merged under any later
+    writes of the same registers; they are lost if the adapter stops first, which write-behind mode prevents.
+    In write-behind mode writes are appended to the durable journal instead and flushed in the background.
+    """
+    def __init__(self, context, window=0, write_behind=None, max_backoff=DEFAULT_WRITE_RETRY_MAX_BACKOFF):
+        """
+        Initializes the coalescer
+
+        :param context.ClearBladeModbusProxySlaveContext context: the slave context being written to
+        :param float window: seconds to hold writes for merging with later writes before flushing
+        :param journal.WriteBehindFlusher write_behind: (optional) journals writes for background flushing
+        :param float max_backoff: the most seconds between retries of failed writes
+        """
+        self.context = context
+        self.window = float(window)
+        self.write_behind = write_behind
+        self.max_backoff = float(max_backoff)
+        self.backoff = 0
+        self.requests = 0
+        self.registers = 0
+        self.updates = 0
+        self.errors = 0
+        self.retries = 0
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def submit(self, register_type, writes):
+        """
+        Queues register writes for ClearBlade
+
+        :param str register_type: the type of register (co, hr)
+        :param dict writes: the data to write in the format {address: value}
+        """
+        if self.write_behind is not None:
+            self.write_behind.journal.append(self.context.ip_proxy, self.context.slave_id, register_type, writes)
+            self.write_behind.notify()
+            with self._lock:
+                self.requests += 1
+                self.registers += len(writes)
+            return
+        with self._lock:
+            self.requests += 1
+            self._pending.setdefault(register_type, {}).update(writes)
+            if self.window > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        if reactor.running and isInIOThread():
+            threads.deferToThread(self.flush)
+        else:
+            self.flush()
+
+    def flush(self):
+        """
+        Sends all pending writes to ClearBlade, scheduling a retry of the writes that fail
+
+        :returns: the number of ClearBlade update calls made
+        :rtype: int
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._timer = None
+        calls = 0
+        failed = {}
+        for register_type, writes in pending.items():
+            try:
+                calls += write_collection_batch(self.context, register_type, writes)
+            except Exception as e:
+                self.context.log.error("Failed writing {} {} registers of slave {} to ClearBlade: {}"
+                                       .format(len(writes), register_type, self.context.slave_id, e))
+                failed[register_type] = writes
+                continue
+            with self._lock:
+                self.registers += len(writes)
+        with self._lock:
+            self.updates += calls
+            if len(failed) == 0:
+                if len(pending) > 0:
+                    self.backoff = 0
+                return calls
+            self.errors += len(failed)
+            self.retries += 1
+            for register_type, writes in failed.items():
+                # writes submitted since the flush are newer and win
+                newer = self._pending.setdefault(register_type, {})
+                for addr, value in writes.items():
+                    newer.setdefault(addr, value)
+            self.backoff = min(self.max_backoff, max(DEFAULT_WRITE_RETRY_INTERVAL, self.backoff * 2))
+            if self._timer is None:
+                self._timer = threading.Timer(self.backoff, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+            self.context.log.warning("Retrying {} failed register writes of slave {} in {}s"
+                                     .format(sum([len(writes) for writes in failed.values()]),
+                                             self.context.slave_id, self.backoff))
+        return calls
+
+    def stats(self):
+        """
+        Returns the write counters
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'registers': self.registers,
+                'updates': self.updates,
+                'errors': self.errors,
+                'retries': self.retries,
+                'pending': sum([len(writes) for writes in self._pending.values()]),
+            }
@@ -23,6 +23,7 @@ setup(name='modbusproxy_cpe_cb',
           'clearblade',
           'headless',
           'twisted',
+          'requests',
       ],
       include_package_data=True,
       zip_safe=False)
@@ -0,0 +1,86 @@
+"""
+In-memory stand-ins for the ClearBlade collections used by the adapter, evaluating the filters and sort order
+of ``clearblade.ClearBladeCore.Query`` the way the platform does
+"""
+
+import logging
+import operator
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modbusproxy_cpe_cb'))
+
+from client import ClearBladeClient  # noqa: E402
+from constants import DEFAULT_HTTP_POOL_SIZE  # noqa: E402
+
+_OPERATORS = {'EQ': operator.eq, 'NEQ': operator.ne, 'GT': operator.gt, 'GTE': operator.ge,
+              'LT': operator.lt, 'LTE': operator.le}
+
+
+class FakeCollection(object):
+    """A collection of rows supporting getItems and updateItems, recording each call"""
+    def __init__(self, rows=None):
+        self.rows = rows if rows is not None else []
+        self.calls = []
+        self.on_get = None
+        self.on_update = None
+
+    def _match(self, row, query):
+        if query is None or len(query.filters) == 0:
+            return True
+        for group in query.filters:
+            matched = True
+            for condition in group:
+                op, operands = list(condition.items())[0]
+                column, value = list(operands[0].items())[0]
+                if column not in row or not _OPERATORS[op](row[column], value):
+                    matched = False
+                    break
+            if matched:
+                return True
+        return False
+
+    def getItems(self, query=None, pagesize=100, pagenum=1, url=""):
+        self.calls.append(('get', pagenum))
+        rows = [dict(row) for row in self.rows if self._match(row, query)]
+        for key in reversed(getattr(query, 'sorting', None) or []):
+            direction, column = list(key.items())[0]
+            rows.sort(key=lambda row: row.get(column), reverse=direction == 'DESC')
+        page = rows[(pagenum - 1) * pagesize:pagenum * pagesize]
+        if self.on_get is not None:
+            self.on_get(self)
+        return page
+
+    def updateItems(self, query, data):
+        self.calls.append(('update', data))
+        if self.on_update is not None:
+            self.on_update(self, query, data)
+        for row in self.rows:
+            if self._match(row, query):
+                row.update(data)
+
+
+def data_row(ip_address, slave_id, register_type, address, value, timestamp, item_id):
+    """Returns a ModbusProxyData row"""
+    return {'ip_address': ip_address, 'slave_id': slave_id, 'register_type': register_type,
+            'register_address': address, 'register_data': value, 'timestamp': timestamp, 'item_id': item_id}
+
+
+class FakeClient(ClearBladeClient):
+    """A client.ClearBladeClient serving every collection name from one FakeCollection"""
+    def __init__(self, collection, pool_size=DEFAULT_HTTP_POOL_SIZE):
+        super(FakeClient, self).__init__(None, None, pool_size=pool_size)
+        self.data = collection
+
+    def collection(self, name):
+        return self.data
+
+
+class FakeSlave(object):
+    """The attributes of a context.ClearBladeModbusProxySlaveContext used to read and write its registers"""
+    def __init__(self, client, ip_proxy, slave_id):
+        self.client = client
+        self.cb_data_collection = 'ModbusProxyData'
+        self.ip_proxy = ip_proxy
+        self.slave_id = slave_id
+        self.log = logging.getLogger('FakeSlave')
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from fakes import FakeClient, FakeCollection, FakeSlave
+
+from client import ClearBladeError
+from journal import WriteJournal, WriteBehindFlusher
+
+
+class FakeServerContext(object):
+    def __init__(self, slaves):
+        self.slaves = slaves
+
+    def __iter__(self):
+        return iter([(slave.slave_id, slave) for slave in self.slaves])
+
+
+class WriteBehindFlushTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = WriteJournal(os.path.join(self.directory, 'writes.journal'), fsync=False)
+        self.collection = FakeCollection()
+        self.client = FakeClient(self.collection)
+        slaves = [FakeSlave(self.client, '10.0.0.1', 1), FakeSlave(self.client, '10.0.0.2', 1)]
+        self.flusher = WriteBehindFlusher(self.journal, [FakeServerContext(slaves)], max_attempts=2)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.directory)
+
+    def fail_first_slave(self, status_code):
+        def update(collection, query, data):
+            if '10.0.0.1' in repr(query.filters):
+                raise ClearBladeError("ClearBlade PUT failed with status {}".format(status_code), status_code)
+        self.collection.on_update = update
+
+    def dead_letters(self):
+        with open(self.journal.dead_letter_path) as f:
+            return len(f.readlines())
+
+    def test_failed_group_does_not_hold_up_the_others(self):
+        self.fail_first_slave(503)
+        self.journal.append('10.0.0.1', 1, 'hr', {5: 1})
+        self.journal.append('10.0.0.2', 1, 'hr', {5: 2})
+        self.assertRaises(IOError, self.flusher.flush)
+        self.assertEqual([entry['ip'] for entry in self.journal.pending()], ['10.0.0.1'])
+        self.assertEqual(self.flusher.flushed, 1)
+
+    def test_entry_is_dead_lettered_after_max_attempts(self):
+        self.fail_first_slave(503)
+        self.journal.append('10.0.0.1', 1, 'hr', {5: 1})
+        self.assertRaises(IOError, self.flusher.flush)
+        self.assertEqual(len(self.journal), 1)
+        self.assertRaises(IOError, self.flusher.flush)
+        self.assertEqual(len(self.journal), 0)
+        self.assertEqual(self.dead_letters(), 1)
+
+    def test_rejected_entry_is_dead_lettered_at_once(self):
+        self.fail_first_slave(400)
+        self.journal.append('10.0.0.1', 1, 'hr', {5: 1})
+        self.assertRaises(IOError, self.flusher.flush)
+        self.assertEqual(len(self.journal), 0)
+        self.assertEqual(self.dead_letters(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import fakes  # noqa: F401 puts the adapter modules on the path
+
+from shared import SharedRegisterTable
+
+
+class SharedRegisterTableTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.table = SharedRegisterTable(os.path.join(self.directory, 'registers'), slots=64)
+
+    def tearDown(self):
+        self.table.close()
+        shutil.rmtree(self.directory)
+
+    def test_addresses_beyond_16_bits_have_their_own_slots(self):
+        low = self.table.slot('10.0.0.1', 1, 'hr', 34463)
+        high = self.table.slot('10.0.0.1', 1, 'hr', 99999)
+        self.assertNotEqual(low, high)
+        self.table.set_value(low, 1)
+        self.table.set_value(high, 2)
+        self.table.set_timestamp(high, 1548054000)
+        self.assertEqual((self.table.get_value(low), self.table.get_value(high)), (1, 2))
+        self.assertEqual(self.table.get_timestamp(high), 1548054000)
+        self.assertEqual(self.table.slot('10.0.0.1', 1, 'hr', 99999), high)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import threading
+import time
+import unittest
+
+from fakes import FakeClient, FakeCollection, FakeSlave, data_row
+
+from clearblade.ClearBladeCore import Query
+from store import CbModbusSequentialDataBlock, CbModbusSegmentedDataBlock, CbModbusSparseDataBlock
+from store import SingleFlight, iter_data_pages, read_registers, sortable_timestamp
+
+
+class KeysetPaginationTest(unittest.TestCase):
+    def setUp(self):
+        self.collection = FakeCollection([
+            data_row('10.0.0.1', 1, 'hr', n, n, '2019-01-21T07:00:0{}Z'.format(n), 'id-{}'.format(n))
+            for n in range(0, 6)])
+
+    def test_reads_every_row(self):
+        pages = list(iter_data_pages(self.collection, Query(), page_size=2))
+        self.assertEqual([[row['register_address'] for row in page] for page in pages], [[0, 1], [2, 3], [4, 5]])
+
+    def test_row_updated_between_pages_is_not_skipped(self):
+        def update_first_row(collection):
+            if len(collection.calls) == 1:
+                collection.rows[0].update({'register_data': 100, 'timestamp': '2019-01-21T07:00:09Z'})
+        self.collection.on_get = update_first_row
+        rows = [row for page in iter_data_pages(self.collection, Query(), page_size=2) for row in page]
+        self.assertEqual(sorted(set(row['register_address'] for row in rows)), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(rows[-1]['register_data'], 100)
+
+    def test_rows_sharing_a_timestamp_page_by_item_id(self):
+        for row in self.collection.rows:
+            row['timestamp'] = '2019-01-21T07:00:00Z'
+        query = Query()
+        query.equalTo('slave_id', 1)
+        rows = [row for page in iter_data_pages(self.collection, query, page_size=4) for row in page]
+        self.assertEqual([row['item_id'] for row in rows], ['id-{}'.format(n) for n in range(0, 6)])
+
+
+class ReadRegistersTest(unittest.TestCase):
+    def test_address_runs_are_split_across_queries(self):
+        collection = FakeCollection([data_row('10.0.0.1', 1, 'hr', n, n, '2019-01-21T07:00:00Z', 'id-{:03d}'.format(n))
+                                     for n in range(0, 20)])
+        slave = FakeSlave(FakeClient(collection), '10.0.0.1', 1)
+        rows = read_registers(slave, {'hr': range(0, 20, 2)}, query_groups=4)
+        self.assertEqual(sorted(row['register_address'] for row in rows), list(range(0, 20, 2)))
+        self.assertEqual(len(collection.calls), 3)
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_caller_waiting_on_successive_flights_is_coalesced_once(self):
+        flights = SingleFlight()
+        started = [threading.Event(), threading.Event()]
+        release = [threading.Event(), threading.Event()]
+
+        def blocking_fetch(n):
+            def fetch(address, count):
+                started[n].set()
+                release[n].wait(5)
+                return count
+            return fetch
+
+        def unexpected_fetch(address, count):
+            raise AssertionError("registers {}:{} were covered by the flights waited on".format(address, count))
+
+        threads = [threading.Thread(target=flights.run, args=(blocking_fetch(0), 0, 10))]
+        threads[0].start()
+        started[0].wait(5)
+        # waits on the flight of 0:10, then on the flight of 10:10 started meanwhile
+        threads.append(threading.Thread(target=flights.run, args=(unexpected_fetch, 0, 20)))
+        threads[1].start()
+        while flights.stats()['coalesced'] == 0:
+            time.sleep(0.01)
+        threads.append(threading.Thread(target=flights.run, args=(blocking_fetch(1), 10, 10)))
+        threads[2].start()
+        started[1].wait(5)
+        release[0].set()
+        time.sleep(0.2)
+        release[1].set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(flights.stats(), {'fetches': 2, 'coalesced': 1, 'saved': 1})
+
+
+class GetTimestampsTest(unittest.TestCase):
+    def setUp(self):
+        slave = FakeSlave(FakeClient(FakeCollection()), '10.0.0.1', 1)
+        slave.shared_table = None
+        self.blocks = [CbModbusSequentialDataBlock(slave, 'hr', 5, [0, 0]),
+                       CbModbusSegmentedDataBlock(slave, 'hr', [5, 6]),
+                       CbModbusSparseDataBlock(slave, 'hr', {5: 0, 6: 0})]
+        self.rows = [data_row('10.0.0.1', 1, 'hr', 5, 51, '2019-01-21T07:00:00Z', 'id-5')]
+
+    def test_every_block_returns_epoch_seconds(self):
+        for block in self.blocks:
+            block.load(self.rows)
+            self.assertEqual(block.get_timestamps(5, 2), [1548054000.0, None], type(block).__name__)
+
+
+class SortableTimestampTest(unittest.TestCase):
+    def test_overlap_steps_iso_bound_back(self):
+        self.assertEqual(sortable_timestamp('2019-01-21T08:00:30.5+01:00', 60), '2019-01-21T06:59:30Z')
+
+    def test_overlap_keeps_epoch_unit(self):
+        self.assertEqual(sortable_timestamp(1548054000, 60), 1548053940)
+        self.assertEqual(sortable_timestamp(1548054000000, 60), 1548053940000)
+
+    def test_unsortable_format_is_rejected(self):
+        self.assertIsNone(sortable_timestamp('01/21/2019 07:00:00', 60))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,18 @@
+import unittest
+
+import fakes  # noqa: F401 puts the adapter modules on the path
+
+from supervisor import Supervisor
+
+
+class AggregateTest(unittest.TestCase):
+    def test_counters_add_up_and_timings_take_the_largest(self):
+        supervisor = Supervisor(2, ['adapter'])
+        supervisor.workers[0].stats = {'Startup': {'built': 3, 'build_seconds': 2.5}, 'Shared table': {'slots': 64}}
+        supervisor.workers[1].stats = {'Startup': {'built': 4, 'build_seconds': 1.5}, 'Shared table': {'slots': 64}}
+        self.assertEqual(supervisor.aggregate(), {'Startup': {'built': 7, 'build_seconds': 2.5},
+                                                  'Shared table': {'slots': 64}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+
+from fakes import FakeClient, FakeCollection, FakeSlave
+
+from twisted.internet import reactor
+
+from store import write_collection_batch
+from writer import WriteCoalescer
+
+
+class BlockingUpdates(object):
+    """Holds every update until released, recording how many run at the same time"""
+    def __init__(self, collection):
+        self.release = threading.Event()
+        self.running = 0
+        self.most_running = 0
+        self._lock = threading.Lock()
+        collection.on_update = self
+
+    def __call__(self, collection, query, data):
+        with self._lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        self.release.wait(5)
+        with self._lock:
+            self.running -= 1
+
+
+class WriteCollectionBatchTest(unittest.TestCase):
+    def test_one_concurrent_call_per_distinct_value(self):
+        collection = FakeCollection()
+        slave = FakeSlave(FakeClient(collection), '10.0.0.1', 1)
+        updates = BlockingUpdates(collection)
+        timer = threading.Timer(0.2, updates.release.set)
+        timer.start()
+        self.assertEqual(write_collection_batch(slave, 'hr', {5: 1, 6: 1, 7: 2, 8: 3}), 3)
+        timer.join()
+        self.assertEqual(len([call for call in collection.calls if call[0] == 'update']), 3)
+        self.assertEqual(updates.most_running, 3)
+
+
+class WriteCoalescerTest(unittest.TestCase):
+    def test_immediate_flush_does_not_block_the_reactor(self):
+        collection = FakeCollection()
+        coalescer = WriteCoalescer(FakeSlave(FakeClient(collection), '10.0.0.1', 1))
+        updates = BlockingUpdates(collection)
+        submitted = []
+
+        def submit():
+            started = time.time()
+            coalescer.submit('hr', {5: 1, 6: 2})
+            submitted.append(time.time() - started)
+            updates.release.set()
+            poll()
+
+        def poll():
+            if coalescer.stats()['updates'] == 2 or time.time() - started > 5:
+                reactor.stop()
+            else:
+                reactor.callLater(0.01, poll)
+
+        started = time.time()
+        reactor.callWhenRunning(submit)
+        reactor.run(installSignalHandlers=False)
+        self.assertLess(submitted[0], 1)
+        self.assertEqual(coalescer.stats()['updates'], 2)
+        self.assertEqual(len([call for call in collection.calls if call[0] == 'update']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()